@@ -3,12 +3,20 @@ import os
 import multiprocessing
 from mvc import converter
 from mvc import conversion
+from mvc import settings
 from mvc import signals
+from mvc import throughput
 from mvc import video
 
 VERSION = '3.0a'
 
 class Application(signals.SignalEmitter):
+    # how many times a second the frontend hears about a conversion's progress
+    max_notify_rate = 4
+    # start finding out what ffmpeg can do in startup().  Frontends that
+    # often exit without converting anything turn this off, and get the
+    # capabilities once they know they need them.
+    probe_at_startup = True
 
     def __init__(self, simultaneous=None):
 	signals.SignalEmitter.__init__(self)
@@ -17,13 +25,23 @@ class Application(signals.SignalEmitter):
                 simultaneous = multiprocessing.cpu_count()
             except NotImplementedError:
                 pass
-        self.converter_manager = converter.ConverterManager()
-        self.conversion_manager = conversion.ConversionManager(simultaneous)
+        self.converter_manager = converter.ConverterManager(
+            os.path.join(settings.get_user_data_directory(), 'presets.json'))
+        self.conversion_manager = conversion.ConversionManager(
+            simultaneous, max_notify_rate=self.max_notify_rate)
+        self.conversion_manager.dedupe = True
+        self.conversion_manager.throughput_history = (
+            throughput.ThroughputHistory(os.path.join(
+                settings.get_user_data_directory(), 'throughput.json')))
         self.started = False
 
     def startup(self):
         if self.started:
             return
+        # the first conversion needs to know what ffmpeg can do; find out
+        # while the converters load
+        if self.probe_at_startup:
+            settings.start_ffmpeg_probe()
         self.converter_manager.startup()
         self.started = True
 
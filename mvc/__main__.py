@@ -2,8 +2,10 @@ if __name__ == "__main__":
     try:
         from mvc.ui.widgets import Application
     except ImportError:
-        from mvc.ui.console import Application
-    from mvc.widgets import app
-    from mvc.widgets import initialize
-    app.widgetapp = Application()
-    initialize(app.widgetapp)
+        from mvc.ui.console import main
+        main()
+    else:
+        from mvc.widgets import app
+        from mvc.widgets import initialize
+        app.widgetapp = Application()
+        initialize(app.widgetapp)
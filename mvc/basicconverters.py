@@ -2,6 +2,7 @@ import logging
 import re
 
 from mvc import converter
+from mvc.converter import EncoderOption
 
 """
 class WebM_HD(converter.FFmpegConverterInfo720p):
@@ -135,21 +136,55 @@ null_converter = NullConverter('Same Format')
 converters = [video_formats, audio_formats, ingest_formats, null_converter]
 """
 
+# Encoders the presets can use, fastest first.  libopenh264 is there for
+# ffmpeg builds without the GPL encoders; mpeg4 is in every build.  The last
+# one is what we use when we can't tell what ffmpeg has (see
+# choose_encoder()), so the H.264 lists end with libx264 again: it's in far
+# more builds than libopenh264.
+LIBX264 = EncoderOption('libx264', '-preset fast -crf 22')
+LIBOPENH264 = EncoderOption('libopenh264', '-b:v 2M')
+H264_ENCODERS = [LIBX264, LIBOPENH264, LIBX264]
+MP4_VIDEO_ENCODERS = [LIBX264, LIBOPENH264, EncoderOption('mpeg4', '-q:v 3')]
+
+# for devices that only play H.264 baseline
+LIBX264_BASELINE = EncoderOption(
+    'libx264', '-preset fast -profile:v baseline -level 30')
+H264_BASELINE_ENCODERS = [
+    LIBX264_BASELINE,
+    EncoderOption('libopenh264', '-profile:v constrained_baseline -level 30'),
+    LIBX264_BASELINE,
+    ]
+
+# ffmpeg's own aac encoder only became good enough to not need -strict
+# experimental in 3.0
+AAC_ENCODERS = [
+    EncoderOption('aac', min_version=(3, 0)),
+    EncoderOption('libfdk_aac'),
+    EncoderOption('aac', '-strict experimental'),
+    ]
+
+# -cpu-used 0 is several times slower than 4, for very little gain
+VP8_ENCODERS = [
+    EncoderOption('libvpx', '-deadline good -cpu-used 4'),
+    ]
+
 class MP4(converter.FFmpegConverterInfo):
     media_type = 'format'
     extension = 'mp4'
-    parameters = ('-f mp4 -crf 22 -vcodec libx264 -preset slow ')
+    fragmented = True
+    parameters = ('-f mp4 ')
+    video_encoders = MP4_VIDEO_ENCODERS
 
 class WebM(converter.FFmpegConverterInfo):
     media_type = 'format'
     extension = 'webm'
-    parameters = ('-y -skip_threshold 0 -rc_buf_aggressivity 0 -bufsize 6000k -rc_init_occupancy 4000 -threads 4 -deadline good -cpu-used 0 '
+    parameters = ('-y -skip_threshold 0 -rc_buf_aggressivity 0 -bufsize 6000k -rc_init_occupancy 4000 -threads 4 '
                   '-crf 0 -qmin 0 -qmax 0 '
                   '-vb 1000k '
-                  '-vcodec libvpx '
                   '-r 25 '
                   '-an '
                   '-f webm ')
+    video_encoders = VP8_ENCODERS
 
 class OggTheora(converter.FFmpeg2TheoraConverterInfo):
     media_type = 'format'
@@ -0,0 +1,291 @@
+"""capabilities.py -- Find out what the installed ffmpeg can do.
+
+ffmpeg builds differ a lot: a distribution's ffmpeg might not have libvpx
+or the native aac encoder, and old versions don't have -progress.  We ask
+ffmpeg for its version, encoders, muxers, filters and options once, and
+keep the answers in a cache file.  The cache entry for an executable is
+good for as long as its path, size and modification time stay the same,
+so we normally only run ffmpeg again after it gets upgraded.
+
+Starting ffmpeg four times takes a while, so CapabilityLoader does it in a
+background thread.  The app starts it at startup and only waits for it when
+it needs the answers.
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+from mvc import execute
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+VERSION_RE = re.compile(r'^n?(\d+(?:\.\d+)*)')
+
+def parse_version(output):
+    """Get the version tuple from the output of ffmpeg -version.
+
+    Git builds report versions like N-12345-gabcdef, which we can't compare;
+    they give None.
+    """
+    words = output.split()
+    for i, word in enumerate(words[:-1]):
+        if word.lower() == 'version':
+            match = VERSION_RE.match(words[i + 1])
+            if match is None:
+                return None
+            return tuple(int(part) for part in match.group(1).split('.'))
+    return None
+
+def _after_header(output, separator_re):
+    """Get the lines of a listing after the legend, which ends with a line
+    of dashes.
+    """
+    lines = output.splitlines()
+    for index, line in enumerate(lines):
+        if separator_re.match(line):
+            return lines[index + 1:]
+    return lines
+
+def parse_encoders(output):
+    """Parse ffmpeg -encoders.
+
+    :returns: dict mapping encoder names to their type: 'video', 'audio' or
+    'subtitle'
+    """
+    types = {'V': 'video', 'A': 'audio', 'S': 'subtitle'}
+    encoders = {}
+    for line in _after_header(output, re.compile(r'^\s*-+\s*$')):
+        parts = line.split()
+        if len(parts) >= 2 and parts[0][:1] in types:
+            encoders[parts[1]] = types[parts[0][0]]
+    return encoders
+
+def parse_muxers(output):
+    """Parse ffmpeg -muxers (or -formats).
+
+    :returns: set of muxer names
+    """
+    muxers = set()
+    for line in _after_header(output, re.compile(r'^\s*-+\s*$')):
+        flags, parts = line[:4], line[4:].split()
+        if 'E' in flags and parts:
+            muxers.update(parts[0].split(','))
+    return muxers
+
+def parse_filters(output):
+    """Parse ffmpeg -filters.
+
+    :returns: set of filter names
+    """
+    filters = set()
+    for line in output.splitlines():
+        parts = line.split()
+        # "... scale   V->V   Scale the input video..."
+        for index, part in enumerate(parts[1:], 1):
+            if '->' in part:
+                filters.add(parts[index - 1])
+                break
+    return filters
+
+def parse_options(output):
+    """Get the option names that ffmpeg -h long lists."""
+    options = set()
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith('-'):
+            options.add(line.split()[0])
+    return options
+
+class Capabilities(object):
+    """What an ffmpeg executable can do."""
+    def __init__(self, version=None, encoders=None, muxers=None,
+                 filters=None, options=None):
+        self.version = version
+        self.encoders = encoders or {}
+        self.muxers = muxers or set()
+        self.filters = filters or set()
+        self.options = options or set()
+
+    def __repr__(self):
+        return '<Capabilities %s: %i encoders, %i muxers, %i filters>' % (
+            '.'.join(str(v) for v in self.version) if self.version
+            else 'unknown version', len(self.encoders), len(self.muxers),
+            len(self.filters))
+
+    def has_encoder(self, name):
+        return name in self.encoders
+
+    def has_muxer(self, name):
+        return name in self.muxers
+
+    def has_filter(self, name):
+        return name in self.filters
+
+    @property
+    def supports_progress(self):
+        """Whether ffmpeg has -progress (added in 1.0), or None if we can't
+        tell.
+        """
+        if self.options:
+            return '-progress' in self.options
+        if self.version is not None:
+            return self.version >= (1, 0)
+        return None
+
+    def to_dict(self):
+        return {'version': list(self.version) if self.version else None,
+                'encoders': self.encoders,
+                'muxers': sorted(self.muxers),
+                'filters': sorted(self.filters),
+                'options': sorted(self.options)}
+
+    @classmethod
+    def from_dict(cls, data):
+        version = data.get('version')
+        return cls(tuple(version) if version else None,
+                   dict(data['encoders']), set(data['muxers']),
+                   set(data['filters']), set(data['options']))
+
+def _run(executable, *args):
+    with open(os.devnull, 'wb') as devnull:
+        return execute.check_output([executable] + list(args),
+                                    stderr=devnull)
+
+def probe(executable):
+    """Ask an ffmpeg executable what it can do.
+
+    :raises: EnvironmentError or execute.CalledProcessError if ffmpeg
+    can't be run
+    """
+    capabilities = Capabilities(parse_version(_run(executable, '-version')))
+    capabilities.encoders = parse_encoders(_run(executable, '-encoders'))
+    try:
+        capabilities.muxers = parse_muxers(_run(executable, '-muxers'))
+    except execute.CalledProcessError:
+        # older versions only have -formats, which lists the muxers along
+        # with the demuxers
+        capabilities.muxers = parse_muxers(_run(executable, '-formats'))
+    capabilities.filters = parse_filters(_run(executable, '-filters'))
+    try:
+        capabilities.options = parse_options(_run(executable, '-h', 'long'))
+    except execute.CalledProcessError:
+        # too old for -h long, and so for -progress too
+        pass
+    return capabilities
+
+class CapabilityCache(object):
+    """Capabilities of ffmpeg executables, stored in a JSON file.
+
+    :param path: the cache file; None means keep it in memory only
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self.entries = dict(data['entries'])
+        except (EnvironmentError, ValueError, KeyError, TypeError):
+            logger.warn('error loading ffmpeg capabilities from %r',
+                        self.path, exc_info=True)
+            self.entries = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps({'version': CACHE_VERSION,
+                               'entries': self.entries})
+        directory = os.path.dirname(self.path)
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if os.path.exists(self.path) and os.name == 'nt':
+                os.remove(self.path)
+            os.rename(temp_path, self.path)
+        except EnvironmentError:
+            logger.warn('error saving ffmpeg capabilities to %r', self.path,
+                        exc_info=True)
+
+    @staticmethod
+    def _stamp(executable):
+        st = os.stat(executable)
+        return [st.st_mtime, st.st_size]
+
+    def get(self, executable, probe=probe):
+        """Get the capabilities of an executable, probing it if the cache
+        doesn't have them (or they're out of date).
+        """
+        executable = os.path.abspath(executable)
+        stamp = self._stamp(executable)
+        with self.lock:
+            entry = self.entries.get(executable)
+        if entry is not None and entry['stamp'] == stamp:
+            try:
+                return Capabilities.from_dict(entry['capabilities'])
+            except (KeyError, TypeError):
+                logger.warn('bad capability cache entry for %r',
+                            executable)
+        logger.info('probing %r', executable)
+        capabilities = probe(executable)
+        with self.lock:
+            self.entries[executable] = {
+                'stamp': stamp, 'capabilities': capabilities.to_dict()}
+        self.save()
+        return capabilities
+
+class CapabilityLoader(object):
+    """Gets the capabilities of an executable in a background thread.
+
+    :param executable: path to ffmpeg, or None if we don't have one
+    :param cache: CapabilityCache to use
+    """
+    def __init__(self, executable, cache):
+        self.executable = executable
+        self.cache = cache
+        self.capabilities = None
+        self.loaded = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._load,
+                                       name='CapabilityLoader')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _load(self):
+        try:
+            if self.executable is not None:
+                self.capabilities = self.cache.get(self.executable)
+        except (EnvironmentError, execute.CalledProcessError):
+            logger.warn("can't get the capabilities of %r", self.executable,
+                        exc_info=True)
+        finally:
+            self.loaded.set()
+
+    def get(self, timeout=None):
+        """Wait for the capabilities.
+
+        :returns: the Capabilities, or None if they couldn't be found (or
+        the timeout passed)
+        """
+        if self.thread is None and not self.loaded.is_set():
+            self._load()
+        self.loaded.wait(timeout)
+        return self.capabilities
@@ -0,0 +1,239 @@
+"""concurrency.py -- Adapt how many conversions run at once.
+
+AdaptiveConcurrency watches three things: the system load average, the
+available memory, and how fast the running conversions are encoding.  It
+moves the ConversionManager's simultaneous limit up or down, staying
+within its minimum and maximum.
+
+- If the load or the memory use gets too high, the limit goes down by one.
+- If every slot is busy and the machine has room, it tries one more slot.
+  If the total encode speed doesn't go up enough after that, the extra
+  slot gets taken back.  No more slots are tried for a while.
+
+It also tells the manager whether a conversion fits in the free memory.
+A conversion doesn't start if the memory it's expected to need would eat
+into the reserve.  The estimate depends on the output resolution and the
+video codec.  Once conversions with a converter have finished, their peak
+memory use gets used for it instead, if that's larger.
+"""
+
+import logging
+import multiprocessing
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+# memory that every converter process needs, whatever it's converting
+BASE_FOOTPRINT = 64 * 1024 * 1024
+
+# roughly how many frames an encoder keeps in memory (lookahead, reference
+# frames, threads)
+FRAMES_IN_FLIGHT = {
+    'libx264': 80,
+    'libx265': 80,
+    'libvpx': 40,
+    'libvpx-vp9': 40,
+    'libtheora': 8,
+    'mpeg4': 8,
+    'dnxhd': 8,
+    'prores': 8,
+    'prores_ks': 8,
+}
+DEFAULT_FRAMES_IN_FLIGHT = 16
+
+# bytes per pixel of a frame in YUV 4:2:0
+BYTES_PER_PIXEL = 1.5
+
+def get_load_average():
+    """Get the 1 minute load average, or None if we can't tell."""
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+def get_available_memory(meminfo_path='/proc/meminfo'):
+    """Get how many bytes of memory can be used without swapping, or None
+    if we can't tell.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    values = {}
+    try:
+        with open(meminfo_path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2:
+                    values[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except (EnvironmentError, ValueError):
+        logger.warn("can't read %r", meminfo_path, exc_info=True)
+        return None
+    if 'MemAvailable' in values:
+        return values['MemAvailable']
+    # kernels before 3.14
+    if 'MemFree' in values:
+        return (values['MemFree'] + values.get('Buffers', 0) +
+                values.get('Cached', 0))
+    return None
+
+def get_cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+class AdaptiveConcurrency(object):
+    """Adjusts ConversionManager.simultaneous to what the machine can take.
+
+    :param minimum: lowest limit
+    :param maximum: highest limit; None means the number of CPUs
+    :param max_load: load average above which we run fewer conversions;
+    None means the number of CPUs
+    :param memory_reserve: bytes of memory to keep free
+    :param interval: seconds between adjustments
+    :param min_gain: how much faster (as a fraction) the conversions have to
+    get for an extra slot to stay
+    :param hold_time: seconds to wait after an extra slot didn't help before
+    trying again
+    :param ramp_up: seconds that a conversion takes to reach its full memory
+    use; until then, its estimated footprint counts as used
+    """
+    def __init__(self, minimum=1, maximum=None, max_load=None,
+                 memory_reserve=256 * 1024 * 1024, interval=10.0,
+                 min_gain=0.05, hold_time=60.0, ramp_up=10.0):
+        if maximum is None:
+            maximum = get_cpu_count()
+        if max_load is None:
+            max_load = float(get_cpu_count())
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.max_load = max_load
+        self.memory_reserve = memory_reserve
+        self.interval = interval
+        self.min_gain = min_gain
+        self.hold_time = hold_time
+        self.ramp_up = ramp_up
+        self.last_update = None
+        # conversion -> progress at the last update, to measure speed with
+        self.last_progress = {}
+        # total speed before we tried an extra slot, if we're trying one
+        self.probe_speed = None
+        self.hold_until = None
+        # converter identifier -> peak bytes per output pixel we've seen
+        self.observed_footprints = {}
+        # these can be swapped out for testing
+        self.get_load_average = get_load_average
+        self.get_available_memory = get_available_memory
+
+    def clamp(self, limit):
+        return min(max(limit, self.minimum), self.maximum)
+
+    def measure_speed(self, conversions, elapsed):
+        """Get the total encode speed (seconds of media per second) since
+        the last measurement.
+        """
+        speed = 0.0
+        progress = {}
+        for c in conversions:
+            if c.progress is None:
+                continue
+            progress[c] = c.progress
+            if elapsed > 0:
+                # conversions that started since count from 0
+                speed += max(c.progress - self.last_progress.get(c, 0.0),
+                             0) / elapsed
+        self.last_progress = progress
+        return speed
+
+    def update(self, manager, now):
+        """Adjust manager.simultaneous, if it's time to.
+
+        :returns: True if the limit changed
+        """
+        if self.last_update is None:
+            self.last_update = now
+            self.measure_speed(manager.in_progress, 0)
+            manager.simultaneous = self.clamp(manager.simultaneous or
+                                              self.minimum)
+            return False
+        if now - self.last_update < self.interval:
+            return False
+        speed = self.measure_speed(manager.in_progress,
+                                   now - self.last_update)
+        self.last_update = now
+        load = self.get_load_average()
+        memory = self.get_available_memory()
+        old_limit = limit = manager.simultaneous
+        busy = len(manager.in_progress) >= limit
+        if ((load is not None and load > self.max_load) or
+            (memory is not None and memory < self.memory_reserve)):
+            limit -= 1
+            self.probe_speed = None
+        elif self.probe_speed is not None:
+            # we tried an extra slot last time; keep it if it helped
+            if busy and speed < self.probe_speed * (1 + self.min_gain):
+                limit -= 1
+                self.hold_until = now + self.hold_time
+            self.probe_speed = None
+        elif (busy and (load is None or load < self.max_load * 0.75) and
+              (self.hold_until is None or now >= self.hold_until)):
+            self.probe_speed = speed
+            limit += 1
+        limit = self.clamp(limit)
+        if limit != old_limit:
+            logger.info('running %i conversions at once (was %i); load %s, '
+                        'available memory %s, speed %.2fx', limit, old_limit,
+                        load, memory, speed)
+            manager.simultaneous = limit
+            return True
+        return False
+
+    def estimate_footprint(self, conversion):
+        """Estimate the peak memory that a conversion's converter needs."""
+        converter, video = conversion.converter, conversion.video
+        if converter.audio_only or video.audio_only or not video.width:
+            return BASE_FOOTPRINT
+        width, height = converter.get_target_size(video)
+        frames = FRAMES_IN_FLIGHT.get(converter.get_video_codec(video),
+                                      DEFAULT_FRAMES_IN_FLIGHT)
+        estimate = BASE_FOOTPRINT + frames * width * height * BYTES_PER_PIXEL
+        observed = self.observed_footprints.get(converter.identifier)
+        if observed is not None:
+            estimate = max(estimate, observed * width * height)
+        return estimate
+
+    def record_footprint(self, conversion):
+        """Remember how much memory a finished conversion used."""
+        converter, video = conversion.converter, conversion.video
+        if converter.audio_only or video.audio_only or not video.width:
+            return
+        max_rss = conversion.get_resource_usage().get('max_rss')
+        if not max_rss:
+            return
+        width, height = converter.get_target_size(video)
+        per_pixel = float(max_rss) / (width * height)
+        self.observed_footprints[converter.identifier] = max(
+            per_pixel, self.observed_footprints.get(converter.identifier, 0))
+
+    def can_admit(self, manager, conversion, now):
+        """Is there enough memory to start conversion?
+
+        A conversion always gets admitted if nothing else is running;
+        otherwise it could never run.
+        """
+        if not manager.in_progress:
+            return True
+        memory = self.get_available_memory()
+        if memory is None:
+            return True
+        # conversions that just started haven't used their memory yet
+        for c in manager.in_progress:
+            if c.started_at is None or now - c.started_at < self.ramp_up:
+                memory -= self.estimate_footprint(c)
+        footprint = self.estimate_footprint(conversion)
+        if memory - footprint < self.memory_reserve:
+            logger.debug('not starting %s: it needs about %iMB and there is '
+                        '%iMB available', conversion, footprint // 2 ** 20,
+                        max(memory, 0) // 2 ** 20)
+            return False
+        return True
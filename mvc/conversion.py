@@ -1,5 +1,9 @@
 import collections
+import contextlib
 import errno
+import gzip
+import heapq
+import itertools
 import os
 import time
 import tempfile
@@ -8,12 +12,44 @@ import shutil
 import logging
 
 from mvc import execute
-from mvc.utils import line_reader
-from mvc.video import get_thumbnail_synchronous
-from mvc.widgets import get_conversion_directory
+from mvc import journal
+from mvc import metrics
+from mvc import scheduling
+from mvc import segments
+from mvc import tracing
+from mvc.converter import STREAM_COPY
+from mvc.utils import line_reader, progress_reader
+from mvc.video import VideoFile, get_thumbnail_synchronous
+from mvc.frontend import get_conversion_directory
 
 logger = logging.getLogger(__name__)
 
+# extra progress details that converters with a structured progress channel
+# can report (see ConverterInfo.get_progress_arguments())
+PROGRESS_DETAILS = ('frame', 'fps', 'speed', 'out_time', 'total_size',
+                    'bitrate')
+
+def total_resource_usage(usages):
+    """Add up a list of resource usage dicts.
+
+    max_rss is the largest of them, everything else is summed (except for
+    the per-pass lists that Conversion.get_resource_usage() adds).
+    """
+    total = {}
+    for usage in usages:
+        for key, value in usage.iteritems():
+            if key == 'passes':
+                continue
+            elif key == 'max_rss':
+                total[key] = max(total.get(key, 0), value)
+            else:
+                total[key] = total.get(key, 0) + value
+    return total
+
+# how many lines of converter output each conversion keeps in memory.  The
+# full output only gets kept if the manager has a log_dir.
+MAX_LOG_LINES = 1000
+
 class Conversion(object):
     def __init__(self, video, converter, manager, output_dir=None):
         self.video = video
@@ -21,10 +57,55 @@ class Conversion(object):
         if output_dir is None:
             output_dir = get_conversion_directory()
         self.output_dir = output_dir
-        self.lines = []
+        self.lines = collections.deque(maxlen=MAX_LOG_LINES)
+        self.log_path = None
+        self.log_file = None
         self.thread = None
         self.popen = None
         self.status = 'initialized'
+        # when the manager queued us, for the queue wait metric
+        self.queued_at = None
+        # which of the manager's slots we're running in (for tracing)
+        self.slot = None
+        # our id in the manager's journal, if it has one
+        self.job_id = None
+        # higher priority conversions can preempt lower ones (see
+        # ConversionManager.preempt)
+        self.priority = 0
+        # mvc.scheduling.SchedulingClass for the converter processes; if
+        # None, the manager picks one when we start.  cpus are the CPUs
+        # we're pinned to.
+        self.scheduling = None
+        self.cpus = None
+        # stream type -> converter.EncoderOption that we convert with.
+        # Picked when we start, unless it's set before then; from then on,
+        # self.converter always uses them.
+        self.encoders = None
+        # stream type -> 'copy' if the input stream gets copied as is, or
+        # why it gets encoded (see ConverterInfo.plan_streams()).  Decided
+        # along with encoders.
+        self.stream_plan = None
+        # signature of the output (see get_signature()), worked out when we
+        # get queued.  If another conversion of the same input with
+        # the same signature is queued or running, it's our leader: we wait
+        # for it to finish, then link or copy its output instead of
+        # converting.  followers are the conversions waiting on us.
+        self.signature = None
+        self.leader = None
+        self.followers = []
+        # cleared while we're paused, so that we don't start the next
+        # process.  pause_lock keeps pause() from racing with starting one.
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+        self.pause_lock = threading.Lock()
+        self.paused_at = None
+        # when converting in segments: the SegmentCheckpoint, and the
+        # (start, length) of the segment we're on
+        self.checkpoint = None
+        self.segment = None
+        # seconds of the input that this run encoded, if that's less than
+        # all of it (segments done by an earlier run get skipped)
+        self.encoded_duration = None
         self.temp_output = None
         self.error = None
         self.started_at = None
@@ -33,6 +114,17 @@ class Conversion(object):
         self.progress_percent = None
         self.create_thumbnail = False
         self.eta = None
+        # predicted wall-clock seconds for the whole conversion, from the
+        # manager's throughput history
+        self.estimated_duration = None
+        # which of the converter's jobs (passes) we're running
+        self.pass_index = 0
+        self.pass_count = 1
+        # resource usage dict for each pass that ran
+        self.resource_usage = []
+        for key in PROGRESS_DETAILS:
+            setattr(self, key, None)
+        self.status_lock = threading.Lock()
         self.listeners = set()
         self.set_converter(converter)
         logger.info('created %r', self)
@@ -43,6 +135,8 @@ class Conversion(object):
         self.converter = converter
         self.output = os.path.join(self.output_dir,
                                    converter.get_output_filename(self.video))
+        self.estimated_duration = self.manager.estimate_duration(
+            self.video, converter)
 
 
     def __repr__(self):
@@ -62,7 +156,7 @@ class Conversion(object):
         self.listeners.remove(f)
 
     def notify_listeners(self):
-        self.manager.notify_queue.add(self)
+        self.manager.notifications.post(self)
 
     def run(self):
         logger.info('starting %r', self)
@@ -80,9 +174,57 @@ class Conversion(object):
         self.thread.setDaemon(True)
         self.thread.start()
 
+    def can_pause(self):
+        return execute.can_suspend()
+
+    def pause(self):
+        """Suspend the conversion.
+
+        The converter process gets stopped (SIGSTOP), and won't use any CPU
+        until resume() is called.  The time spent paused doesn't count
+        towards the ETA.
+
+        :returns: True if we paused, False if we can't pause right now
+        """
+        if not self.can_pause() or self.status != 'converting':
+            return False
+        logger.info('pausing %r', self)
+        with self.pause_lock:
+            self.unpaused.clear()
+            if self.popen is not None:
+                self.popen.suspend()
+            self.paused_at = time.time()
+            self.status = 'paused'
+        self.notify_listeners()
+        return True
+
+    def resume(self):
+        """Continue a conversion that pause() suspended.
+
+        :returns: True if we resumed, False if we weren't paused
+        """
+        if self.status != 'paused':
+            return False
+        logger.info('resuming %r', self)
+        with self.pause_lock:
+            if self.started_at is not None:
+                # push the start time back, so that the ETA and the
+                # throughput we record don't include the pause
+                self.started_at += time.time() - self.paused_at
+            self.paused_at = None
+            self.status = 'converting'
+            if self.popen is not None:
+                self.popen.resume()
+            self.unpaused.set()
+        self.notify_listeners()
+        return True
+
     def stop(self):
         logger.info('stopping %r', self)
         self.error = 'manually stopped'
+        # let the conversion thread notice that we stopped, if it's waiting
+        # to be resumed
+        self.unpaused.set()
         if self.popen is None:
             status = 'canceled'
             try:
@@ -107,34 +249,441 @@ class Conversion(object):
         self.manager.conversion_finished(self)
 
     def _thread(self):
-        for commandline in self.get_subprocess_arguments(self.temp_output):
-            logger.info('commandline: %r', ' '.join(commandline))
+        try:
+            self.open_log()
             try:
-                self.popen = execute.Popen(commandline, bufsize=1)
-                self.process_output()
-                if self.popen:
-                    # if we stop the thread, we can get here after `.stop()`
-                    # finishes.
-                    self.popen.wait()
-            except OSError, e:
-                if e.errno == errno.ENOENT:
-                    print '%r does not exist' % (self.converter.get_executable(),)
-                    self.error = '%r does not exist' % (
-                        self.converter.get_executable(),)
+                if self.leader is not None:
+                    self._copy_from_leader()
                 else:
-                    logger.exception('OSError in %s' % (self.thread.name,))
-                    self.error = str(e)
-            except Exception, e:
-                logger.exception('in %s' % (self.thread.name,))
+                    self._convert()
+            finally:
+                self.close_log()
+            if self.create_thumbnail:
+                self.write_thumbnail_file()
+        except Exception, e:
+            # whatever went wrong, the conversion has to finish, or it sits
+            # in in_progress forever
+            logger.exception('in %s' % (self.thread.name,))
+            if self.error is None:
+                self.error = str(e) or e.__class__.__name__
+        self.finalize()
+
+    def get_signature(self):
+        """Get the signature of our output (see
+        ConverterInfo.get_signature()).
+
+        It's normally worked out when we get queued, from the converter we
+        were queued with.  If the converter can't tell yet (say, ffmpeg's
+        capabilities aren't known), it's None, and gets tried again on the
+        next call.
+        """
+        if self.signature is None:
+            try:
+                self.signature = self.converter.get_signature(self.video)
+            except (EnvironmentError, ValueError):
+                logger.exception('error getting the signature of %s', self)
+        return self.signature
+
+    def _copy_from_leader(self):
+        """Make our output from our leader's, which is the same."""
+        self.encoders = self.leader.encoders
+        self.stream_plan = self.leader.stream_plan
+        source = self.leader.output
+        if os.path.abspath(source) == os.path.abspath(self.output):
+            logger.info('%r: %r already made our output', self, self.leader)
+            self.temp_output = None
+            return
+        logger.info('%r: same output as %r, linking %r', self, self.leader,
+                    source)
+        try:
+            with self.stage('link'):
+                try:
+                    os.link(source, self.temp_output)
+                except (AttributeError, EnvironmentError), e:
+                    # no hard links on this platform or filesystem, or
+                    # between these directories
+                    logger.info("can't link %r: %s; copying it", source, e)
+                    shutil.copyfile(source, self.temp_output)
+        except EnvironmentError, e:
+            logger.exception('while copying the output of %r', self.leader)
+            self.error = str(e)
+
+    def _convert(self):
+        if self.encoders is None:
+            self.encoders = self.converter.choose_encoders(self.video)
+            if self.manager.stream_copy:
+                self.plan_streams()
+        if self.encoders:
+            logger.info('%r: using %s', self, ', '.join(
+                    '%s: %s' % (stream, self.encoders[stream])
+                    for stream in sorted(self.encoders)))
+            self.converter = self.converter.with_encoders(self.encoders)
+        missing = self.converter.get_missing_requirements(self.video)
+        if missing:
+            self.error = 'the converter is missing %s' % ', '.join(missing)
+            logger.warn('%r: %s', self, self.error)
+        elif self.use_segments():
+            self._convert_segments()
+        else:
+            jobs = self.get_subprocess_arguments(self.temp_output)
+            self.pass_count = len(jobs)
+            for self.pass_index, commandline in enumerate(jobs):
+                self._run_job(commandline)
+
+    def plan_streams(self):
+        """Switch the streams that can be copied from the input to
+        STREAM_COPY.
+        """
+        self.stream_plan = self.converter.plan_streams(self.video,
+                                                       self.encoders)
+        for stream, decision in self.stream_plan.items():
+            if decision == 'copy':
+                self.encoders[stream] = STREAM_COPY
+            else:
+                logger.info('%r: encoding %s: %s', self, stream, decision)
+
+    @property
+    def copied_streams(self):
+        """The stream types that get copied from the input."""
+        if not self.stream_plan:
+            return []
+        return sorted(stream for stream, decision in self.stream_plan.items()
+                      if decision == 'copy')
+
+    def _run_job(self, commandline):
+        """Run one converter process and follow its output.
+
+        :returns: the execute.Popen for the process, or None if it couldn't
+        be started
+        """
+        with self.job_token() as have_token:
+            if not have_token:
+                return None
+            return self._run_process(commandline)
+
+    @contextlib.contextmanager
+    def job_token(self):
+        """Hold a token from the manager's jobserver (if it has one) while
+        a converter process runs.
+
+        Yields False if we got stopped while waiting for a token.
+        """
+        jobserver = self.manager.jobserver
+        if jobserver is None:
+            yield True
+            return
+        token = jobserver.acquire(cancelled=lambda: self.error is not None)
+        if token is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            jobserver.release(token)
+
+    def _run_process(self, commandline):
+        progress_pipe = self._open_progress_pipe()
+        pass_fds = ()
+        if progress_pipe is not None:
+            read_fd, write_fd = progress_pipe
+            commandline = (commandline[:1] +
+                           self.converter.get_progress_arguments(write_fd) +
+                           commandline[1:])
+            pass_fds = (write_fd,)
+        progress_thread = None
+        popen = None
+        logger.info('commandline: %r', ' '.join(commandline))
+        pass_started = time.time()
+        try:
+            try:
+                popen = self._start_process(commandline, pass_fds)
+            finally:
+                if progress_pipe is not None:
+                    # only the child should hold the write end, so that
+                    # we see EOF when it exits.
+                    os.close(write_fd)
+            if popen is None:
+                # stopped while we were paused
+                return None
+            if progress_pipe is not None:
+                progress_thread = self._start_progress_thread(read_fd)
+            self.process_output(progress_pipe is not None)
+            # if we stop the thread, we can get here after `.stop()`
+            # finishes, in which case this returns right away.
+            popen.wait()
+            self.resource_usage.append(popen.get_resource_usage())
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                print '%r does not exist' % (self.converter.get_executable(),)
+                self.error = '%r does not exist' % (
+                    self.converter.get_executable(),)
+            else:
+                logger.exception('OSError in %s' % (self.thread.name,))
                 self.error = str(e)
+        except Exception, e:
+            logger.exception('in %s' % (self.thread.name,))
+            self.error = str(e)
+        finally:
+            if progress_thread is not None:
+                progress_thread.join()
+            elif progress_pipe is not None:
+                os.close(read_fd)
+            if popen is not None:
+                self.record_stage('pass%i' % (self.pass_index + 1),
+                                  pass_started, time.time())
+                if popen.ended_at is not None:
+                    self.trace_subprocess(popen, commandline)
+        return popen
 
-        if self.create_thumbnail:
-            self.write_thumbnail_file()
-        self.finalize()
+    def _start_process(self, commandline, pass_fds):
+        """Start a converter process, once we're not paused.
+
+        :returns: the execute.Popen, or None if we got stopped while we
+        were waiting
+        """
+        while True:
+            self.unpaused.wait()
+            with self.pause_lock:
+                if self.error is not None:
+                    return None
+                if not self.unpaused.is_set():
+                    # paused again before we got the lock
+                    continue
+                self.popen = execute.Popen(commandline, bufsize=1,
+                                           pass_fds=pass_fds,
+                                           **self.get_scheduling_args())
+                return self.popen
+
+    def get_scheduling_args(self):
+        """Get the execute.Popen arguments for our scheduling class."""
+        if self.scheduling is None:
+            return {}
+        return self.scheduling.get_popen_args(self.cpus)
+
+    def use_segments(self):
+        """Should we convert in segments (see mvc.segments)?"""
+        segment_length = self.manager.segment_length
+        return (segment_length is not None and
+                self.video.duration > segment_length and
+                self.converter.supports_segments(self.video))
+
+    def get_scratch_root(self):
+        if self.manager.scratch_dir is not None:
+            return self.manager.scratch_dir
+        return os.path.join(self.output_dir, '.mvc-segments')
+
+    def _convert_segments(self):
+        segment_length = self.manager.segment_length
+        # the arguments for a segment go into the key, so that changing the
+        # converter settings invalidates the segments.  The segment's path
+        # shows up in them, so use one that's the same every time (and that
+        # exists, since converters check the directory).
+        placeholder = os.path.join(tempfile.gettempdir(), 'mvc-segment.%s' % (
+                self.converter.extension or 'out',))
+        key = segments.job_key(
+            self.video.filename, self.converter.identifier, self.output,
+            *self.converter.get_segment_jobs(self.video, placeholder, 0,
+                                             segment_length)[-1])
+        try:
+            self.checkpoint = segments.SegmentCheckpoint(
+                self.get_scratch_root(), key, self.converter.extension,
+                self.video.duration, segment_length)
+        except EnvironmentError, e:
+            logger.exception('while creating the scratch directory for %s',
+                             self)
+            self.error = str(e)
+            return
+        checkpoint = self.checkpoint
+        self.encoded_duration = 0.0
+        for index, start, length in checkpoint.segments:
+            if checkpoint.is_done(index):
+                continue
+            self.segment = (start, length)
+            jobs = self.converter.get_segment_jobs(
+                self.video, checkpoint.partial_path(index), start, length)
+            self.pass_count = len(jobs)
+            for self.pass_index, commandline in enumerate(jobs):
+                popen = self._run_job(commandline)
+                if self.error is not None:
+                    return
+                if popen.returncode != 0:
+                    self.error = 'segment %i failed (exit code %s)' % (
+                        index, popen.returncode)
+                    return
+            self.encoded_duration += length
+            try:
+                checkpoint.mark_done(index)
+            except EnvironmentError, e:
+                logger.exception('while recording segment %i of %s', index,
+                                 self)
+                self.error = str(e)
+                return
+        self.segment = None
+        commandline = self.converter.get_concat_job(
+            checkpoint.write_concat_list(), self.temp_output)
+        logger.info('commandline: %r', ' '.join(commandline))
+        try:
+            with self.job_token() as have_token:
+                if have_token:
+                    with self.stage('concat'):
+                        execute.check_output(commandline)
+        except execute.CalledProcessError, e:
+            logger.error('joining segments failed for %s:\n%s', self,
+                         e.output)
+            self.error = 'joining segments failed (exit code %s)' % (
+                e.returncode,)
+        except EnvironmentError, e:
+            logger.exception('while joining segments for %s', self)
+            self.error = str(e)
+
+    def open_log(self):
+        """Start writing the converter output to a compressed file in the
+        manager's log_dir, if it has one.
+        """
+        log_dir = self.manager.log_dir
+        if log_dir is None:
+            return
+        prefix = os.path.splitext(os.path.basename(self.output))[0] + '-'
+        try:
+            fd, self.log_path = tempfile.mkstemp(prefix=prefix,
+                                                 suffix='.log.gz',
+                                                 dir=log_dir)
+            os.close(fd)
+            self.log_file = gzip.open(self.log_path, 'wb')
+        except EnvironmentError:
+            logger.warn('error opening log file for %s', self, exc_info=True)
+            self.log_path = self.log_file = None
+
+    def close_log(self):
+        if self.log_file is None:
+            return
+        log_file, self.log_file = self.log_file, None
+        try:
+            log_file.close()
+        except EnvironmentError:
+            logger.warn('error closing log file for %s', self, exc_info=True)
+
+    def log_line(self, line):
+        self.lines.append(line)
+        if self.log_file is not None:
+            try:
+                self.log_file.write(line + '\n')
+            except EnvironmentError:
+                logger.warn('error writing log file for %s; only keeping '
+                            'the last %i lines', self, MAX_LOG_LINES,
+                            exc_info=True)
+                self.close_log()
+                self.log_path = None
+
+    def get_log(self):
+        """Get the converter output as a string.
+
+        Once the conversion is done, this is the full output if we were
+        writing it to a log file.  Otherwise it's the last MAX_LOG_LINES
+        lines.
+        """
+        if self.log_path is not None and self.log_file is None:
+            try:
+                log_file = gzip.open(self.log_path, 'rb')
+                try:
+                    return log_file.read()
+                finally:
+                    log_file.close()
+            except EnvironmentError:
+                logger.warn('error reading log file for %s', self,
+                            exc_info=True)
+        return ''.join(line + '\n' for line in list(self.lines))
+
+    def _open_progress_pipe(self):
+        """Open a pipe for the converter to report structured progress on.
+
+        :returns: (read_fd, write_fd) tuple, or None if the converter or the
+        platform doesn't support it.
+        """
+        if not execute.can_pass_fds():
+            return None
+        if self.converter.get_progress_arguments(0) is None:
+            return None
+        try:
+            return execute.child_pipe()
+        except EnvironmentError:
+            logger.warn('error creating progress pipe for %s; falling back '
+                        'to parsing output', self, exc_info=True)
+            return None
+
+    def _start_progress_thread(self, read_fd):
+        thread = threading.Thread(target=self._progress_thread,
+                                  args=(os.fdopen(read_fd, 'rb', 0),),
+                                  name="Progress:%s" % (self,))
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+    def _progress_thread(self, handle):
+        try:
+            for values in progress_reader(handle):
+                try:
+                    status = self.converter.process_progress(self.video,
+                                                             values)
+                except StandardError:
+                    logging.warn("error in process_progress()", exc_info=True)
+                    continue
+                if status:
+                    self.update_status(status)
+        finally:
+            handle.close()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that records how long its block took as a stage
+        of this conversion.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record_stage(name, start, time.time())
+
+    def record_stage(self, name, start, end):
+        """Record a stage in the manager's metrics, and in the trace if
+        tracing is on.
+        """
+        self.manager.metrics.observe(name, end - start)
+        tracer = tracing.tracer
+        if tracer is not None:
+            tracer.complete(name, start, end, self.get_trace_track(),
+                            args={'conversion': unicode(self)})
+
+    def trace_subprocess(self, popen, commandline):
+        tracer = tracing.tracer
+        if tracer is None:
+            return
+        tracer.complete(os.path.basename(commandline[0]), popen.started_at,
+                        popen.ended_at, self.get_trace_track(),
+                        category='subprocess',
+                        args={'pid': popen.pid,
+                              'returncode': popen.returncode,
+                              'commandline': ' '.join(commandline)})
+
+    def get_trace_track(self):
+        if self.slot is None:
+            return 'unscheduled'
+        return 'slot %i' % self.slot
+
+    def get_resource_usage(self):
+        """Get the resources used by all passes of this conversion.
+
+        :returns: dict like execute.Popen.get_resource_usage() returns, plus
+        passes: the list of per-pass dicts
+        """
+        total = total_resource_usage(self.resource_usage)
+        total['passes'] = list(self.resource_usage)
+        return total
 
     def write_thumbnail_file(self):
         try:
-            self._write_thumbnail_file()
+            with self.stage('thumbnail'):
+                self._write_thumbnail_file()
         except StandardError:
             logging.warn("Error writing thumbnail", exc_info=True)
 
@@ -180,59 +729,124 @@ class Conversion(object):
             effective_duration = self.duration
         return self.progress / effective_duration
 
-    def process_output(self):
-        self.started_at = time.time()
-        self.status = 'converting'
+    def calc_eta(self):
+        """Estimate how many seconds are left.
+
+        We combine extrapolating from our progress so far with the time the
+        throughput history predicts for the whole job.  The further along we
+        are, the more we trust our own progress.
+        """
+        elapsed = time.time() - self.started_at
+        if self.estimated_duration is not None:
+            predicted = max(self.estimated_duration - elapsed, 0.0)
+        else:
+            predicted = None
+        percent = self.progress_percent
+        if self.duration and 0 < percent < 1.0:
+            extrapolated = elapsed / percent - elapsed
+        else:
+            extrapolated = None
+        if extrapolated is None:
+            return predicted if predicted is not None else 0.0
+        elif predicted is None:
+            return extrapolated
+        return percent * extrapolated + (1 - percent) * predicted
+
+    def process_output(self, progress_channel=False):
+        """Read the converter's output until it finishes.
+
+        :param progress_channel: if True, progress is coming in over a
+        separate channel (see _progress_thread()) and the output is only
+        checked for errors.
+        """
+        if self.started_at is None:
+            self.started_at = time.time()
+        with self.pause_lock:
+            # pause() may have gotten in since the process started
+            if self.status != 'paused':
+                self.status = 'converting'
+        if progress_channel and self.video.duration:
+            self.update_status({'duration': self.video.duration})
         # We use line_reader, rather than just iterating over the file object,
         # because iterating over the file object gives us all the lines when
         # the process ends, and we're looking for real-time updates.
         for line in line_reader(self.popen.stdout):
-            self.lines.append(line) # for debugging, if needed
+            self.log_line(line) # for debugging, if needed
             try:
-                status = self.converter.process_status_line(self.video, line)
+                if progress_channel:
+                    status = self.converter.process_error_line(self.video,
+                                                               line)
+                else:
+                    status = self.converter.process_status_line(self.video,
+                                                                line)
             except StandardError:
                 logging.warn("error in process_status_line()", exc_info=True)
                 continue
             if status is None:
                 continue
-            updated = set()
-            if 'finished' in status:
-                self.error = status.get('error', None)
+            if not self.update_status(status):
                 break
-            if 'duration' in status:
-                updated.update(('duration', 'progress'))
-                self.duration = float(status['duration'])
-                if self.progress is None:
-                    self.progress = 0.0
-            if 'pass1' in status:
-                updated.add('progress')
-                self.progress = min(float(status['pass1']/2.0),
-                                    self.duration)
-            if 'pass2' in status:
-                updated.add('progress')
-                self.progress = min(float(status['pass2']/2.0 + 5),
-                                    self.duration)
-            if 'progress' in status:
-                updated.add('progress')
-                self.progress = min(float(status['progress']),
-                                    self.duration)
-            if 'eta' in status:
-                updated.add('eta')
-                self.eta = float(status['eta'])
-
-            if updated:
-                self.progress_percent = self.calc_progress_percent()
-                if 'eta' not in updated:
-                    if self.duration and 0 < self.progress_percent < 1.0:
-                        progress = self.progress_percent * 100
-                        elapsed = time.time() - self.started_at
-                        time_per_percent = elapsed / progress
-                        self.eta = float(
-                            time_per_percent * (100 - progress))
-                    else:
-                        self.eta = 0.0
 
-                self.notify_listeners()
+    def update_status(self, status):
+        """Update our progress from a status dict.
+
+        This gets called from both the output reading thread and the progress
+        thread.
+
+        :returns: False if the status says the conversion is finished.
+        """
+        with self.status_lock:
+            return self._update_status(status)
+
+    def _update_status(self, status):
+        updated = set()
+        if 'finished' in status:
+            self.error = status.get('error', None)
+            return False
+        if 'duration' in status:
+            updated.update(('duration', 'progress'))
+            self.duration = float(status['duration'])
+            if self.progress is None:
+                self.progress = 0.0
+        if 'pass1' in status and self.segment is None:
+            updated.add('progress')
+            self.progress = min(float(status['pass1']/2.0),
+                                self.duration)
+        if 'pass2' in status:
+            updated.add('progress')
+            self.progress = min(float(status['pass2']/2.0 + 5),
+                                self.duration)
+        if 'progress' in status:
+            # progress is for the current pass; spread the passes out over
+            # the duration
+            updated.add('progress')
+            progress = float(status['progress'])
+            if self.segment is not None:
+                # progress is within the segment; everything before the
+                # segment is done
+                start, length = self.segment
+                progress = ((start * self.pass_count +
+                             self.pass_index * length + progress) /
+                            self.pass_count)
+            elif self.pass_count > 1 and self.duration:
+                progress = ((self.pass_index * self.duration + progress) /
+                            self.pass_count)
+            self.progress = min(progress, self.duration)
+        if 'eta' in status:
+            updated.add('eta')
+            self.eta = float(status['eta'])
+        for key in PROGRESS_DETAILS:
+            if key in status:
+                updated.add(key)
+                setattr(self, key, status[key])
+
+        if updated:
+            self.progress_percent = self.calc_progress_percent()
+            if 'eta' not in updated:
+                self.eta = self.calc_eta()
+
+            self.notify_listeners()
+        return True
 
     def finalize(self):
         self.progress = self.duration
@@ -242,7 +856,14 @@ class Conversion(object):
             self.status = 'staging'
             self.notify_listeners()
             try:
-                self.converter.finalize(self.temp_output, self.output)
+                with self.stage('finalize'):
+                    if self.leader is not None:
+                        # our leader's converter already finalized it
+                        if self.temp_output is not None:
+                            shutil.move(self.temp_output, self.output)
+                    else:
+                        self.converter.finalize(self.temp_output,
+                                                self.output)
             except EnvironmentError, e:
                 logger.exception('while trying to move %r to %r after %s',
                                   self.temp_output, self.output, self)
@@ -250,6 +871,14 @@ class Conversion(object):
                 self.status = 'failed'
             else:
                 self.status = 'finished'
+                self.manager.record_throughput(self)
+                if self.checkpoint is not None:
+                    self.checkpoint.remove()
+                    if self.manager.scratch_dir is None:
+                        try:
+                            os.rmdir(self.get_scratch_root())
+                        except EnvironmentError:
+                            pass # other jobs are still using it
         else:
             if self.temp_output is not None:
                 try:
@@ -263,8 +892,9 @@ class Conversion(object):
             output_basename = os.path.splitext(os.path.basename(self.output))[0]
             thumbnail_path = os.path.join(self.output_dir,
                     output_basename + '.png')
-            get_thumbnail_synchronous(self.video.filename,
-                    self.video.width, self.video.height, thumbnail_path)
+            with self.stage('thumbnail'):
+                get_thumbnail_synchronous(self.video.filename,
+                        self.video.width, self.video.height, thumbnail_path)
         if self.status != 'canceled':
             self.notify_listeners()
         logger.info('finished %r; status: %s', self, self.status)
@@ -273,56 +903,570 @@ class Conversion(object):
         return (self.converter.get_jobs(self.video, output))
 
 
+class NotificationBus(object):
+    """Collects conversion changes from worker threads for the main thread.
+
+    post() can be called from any thread.  Changes to the same conversion
+    that come in faster than max_rate per second get coalesced into one
+    notification.  A change of status (for example to 'finished') is always
+    delivered right away.
+
+    The consumer calls collect() to get the conversions that changed.  To
+    find out when to do that, it can either set wakeup to a callable, which
+    gets called (from any thread) when there's something to collect, or
+    block in wait().
+    """
+    def __init__(self, max_rate=None):
+        if max_rate:
+            self.min_interval = 1.0 / max_rate
+        else:
+            self.min_interval = 0.0
+        self.wakeup = None
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        # conversion -> time the notification is due
+        self.pending = {}
+        # conversion -> (time, status) of the last delivered notification
+        self.delivered = {}
+        self.timer_due = None
+        self.signaled = False
+
+    def post(self, conversion):
+        now = time.time()
+        with self.lock:
+            last_time, last_status = self.delivered.get(conversion,
+                                                        (None, None))
+            if last_time is None or conversion.status != last_status:
+                due = now
+            else:
+                due = max(now, last_time + self.min_interval)
+            if conversion in self.pending and self.pending[conversion] <= due:
+                return
+            self.pending[conversion] = due
+        if due <= now:
+            self._wake()
+        else:
+            self._schedule(due)
+
+    def _wake(self):
+        with self.lock:
+            if self.signaled:
+                return
+            self.signaled = True
+        self.event.set()
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def _schedule(self, due):
+        with self.lock:
+            if self.timer_due is not None and self.timer_due <= due:
+                return
+            self.timer_due = due
+        timer = threading.Timer(max(due - time.time(), 0), self._timer_fired)
+        timer.setDaemon(True)
+        timer.start()
+
+    def _timer_fired(self):
+        with self.lock:
+            self.timer_due = None
+        self._wake()
+
+    def collect(self):
+        """Get the conversions that have changed since the last call.
+
+        Notifications that aren't due yet stay pending.
+        """
+        now = time.time()
+        with self.lock:
+            self.signaled = False
+            self.event.clear()
+            changed = [c for c, due in self.pending.iteritems() if due <= now]
+            for conversion in changed:
+                del self.pending[conversion]
+                if conversion.status in ('canceled', 'finished', 'failed'):
+                    self.delivered.pop(conversion, None)
+                else:
+                    self.delivered[conversion] = (now, conversion.status)
+            if self.pending:
+                next_due = min(self.pending.itervalues())
+            else:
+                next_due = None
+        if next_due is not None:
+            self._schedule(next_due)
+        return changed
+
+    def rearm(self):
+        """Let the next post() wake the consumer again, without collecting
+        anything.
+
+        For consumers that got woken up but don't want the changes yet;
+        they stay pending until the next collect().
+        """
+        with self.lock:
+            self.signaled = False
+            self.event.clear()
+
+    def wait(self, timeout=None):
+        """Block until there's something to collect, or timeout seconds have
+        passed.
+        """
+        self.event.wait(timeout)
+
+    def is_empty(self):
+        with self.lock:
+            return not self.pending
+
+
 class ConversionManager(object):
-    def __init__(self, simultaneous=None):
-        self.notify_queue = set()
+    def __init__(self, simultaneous=None, max_notify_rate=None):
+        self.notifications = NotificationBus(max_notify_rate)
         self.in_progress = set()
         self.waiting = collections.deque()
         self.simultaneous = simultaneous
         self.running = False
         self.create_thumbnails = False
+        # if set, each conversion writes its full output to a file in here
+        self.log_dir = None
+        # mvc.throughput.ThroughputHistory to predict conversion times with
+        self.throughput_history = None
+        # mvc.metrics.StageMetrics that the conversion stages are timed in
+        self.metrics = metrics.stages
+        # where the manager gets the time from; mvc.simulation swaps in a
+        # virtual clock
+        self.clock = time.time
+        # mvc.journal.JobJournal to record the jobs in, so that they survive
+        # a restart
+        self.journal = None
+        # if set, conversions of inputs longer than this many seconds run in
+        # segments of this length, which a retry doesn't have to redo (see
+        # mvc.segments)
+        self.segment_length = None
+        # where the segments go; None means a directory in the output
+        # directory
+        self.scratch_dir = None
+        # if True, a conversion that can't start right away pauses a running
+        # one with a lower priority, which gets resumed when a slot frees up.
+        # Not with a jobserver (see _preempt_for()).
+        self.preempt = False
+        # conversions paused to make room for higher priority ones
+        self.preempted = []
+        # mvc.scheduling.SchedulingClass for conversions that don't have
+        # one, by priority; default_scheduling is for the priorities that
+        # aren't in there.
+        self.scheduling_by_priority = {}
+        self.default_scheduling = None
+        self.cores = scheduling.CoreAllocator()
+        # mvc.concurrency.AdaptiveConcurrency to adjust simultaneous with,
+        # and to check that a conversion fits in memory before it starts
+        self.concurrency = None
+        # mvc.jobserver.JobServerClient to take a token from before each
+        # converter process starts
+        self.jobserver = None
+        # if True, input streams that already match what the converter
+        # makes get copied instead of encoded again
+        self.stream_copy = True
+        # if True, a conversion that would make the same output as one
+        # that's already queued or running waits for it and reuses its
+        # output (see Conversion.leader)
+        self.dedupe = False
+
+    def estimate_duration(self, video, converter):
+        """Predict how many wall-clock seconds a conversion will take.
+
+        :returns: seconds, or None if we don't know
+        """
+        if self.throughput_history is None:
+            return None
+        return self.throughput_history.estimate_duration(converter, video)
+
+    def record_throughput(self, conversion):
+        if self.throughput_history is None or conversion.started_at is None:
+            return
+        if not conversion.video.duration:
+            return
+        if conversion.copied_streams or conversion.leader is not None:
+            # a remux or a copy says nothing about how fast the converter
+            # encodes
+            return
+        encoded = conversion.encoded_duration
+        if encoded is None:
+            encoded = conversion.video.duration
+        self.throughput_history.record(conversion.converter, conversion.video,
+                                       encoded,
+                                       time.time() - conversion.started_at)
+        self.throughput_history.save()
+
+    def estimate_remaining(self, conversion):
+        """Predict how many seconds are left for a conversion.
+
+        :returns: seconds, or None if we don't know
+        """
+        if conversion.status in ('converting', 'paused'):
+            return conversion.eta
+        elif conversion.status == 'initialized':
+            return conversion.estimated_duration
+        else:
+            return 0.0
+
+    def estimate_completion(self):
+        """Predict how many seconds until all running and waiting
+        conversions are done.
+
+        This plays out the waiting queue over the available slots.
+
+        :returns: seconds, or None if we can't predict some conversion
+        """
+        remaining = [self.estimate_remaining(c) for c in
+                     itertools.chain(self.in_progress, self.preempted)]
+        waiting = [self.estimate_remaining(c) for c in self.waiting]
+        if None in remaining or None in waiting:
+            return None
+        if self.simultaneous is None:
+            slots = max(len(remaining) + len(waiting), 1)
+        else:
+            slots = self.simultaneous
+        finish_times = sorted(remaining)
+        # the first job to finish frees up the first slot, etc.
+        free_at = finish_times + [0.0] * (slots - len(finish_times))
+        heapq.heapify(free_at)
+        done = max(finish_times) if finish_times else 0.0
+        for duration in waiting:
+            finish = heapq.heappop(free_at) + duration
+            heapq.heappush(free_at, finish)
+            done = max(done, finish)
+        return done
 
     def get_conversion(self, video, converter, **kwargs):
         return Conversion(video, converter, self, **kwargs)
 
     def remove(self, conversion):
-        self.waiting.remove(conversion)
+        leader = conversion.leader if self.dedupe else None
+        if leader is not None and conversion in leader.followers:
+            leader.followers.remove(conversion)
+        else:
+            self.waiting.remove(conversion)
+        self.trace_scheduler('remove', conversion)
+        self.journal_update(conversion, 'canceled')
+        if self.dedupe:
+            self.release_followers(conversion)
+
+    def journal_update(self, conversion, state, **kwargs):
+        if self.journal is None or conversion.job_id is None:
+            return
+        try:
+            self.journal.update(conversion.job_id, state,
+                                error=conversion.error, **kwargs)
+        except (EnvironmentError, journal.Error):
+            logger.exception('error updating the journal for %s', conversion)
+
+    def resume_jobs(self, get_converter):
+        """Queue the jobs that the journal says didn't finish last time.
+
+        Anything they left behind gets deleted first.
+
+        :param get_converter: function that returns the converter for an
+        identifier (like ConverterManager.get_by_id)
+        :returns: list of the resumed conversions
+        """
+        resumed = []
+        for job in self.journal.unfinished():
+            self.journal.clean_up(job)
+            try:
+                converter = get_converter(job.converter)
+                video = VideoFile(job.input)
+            except (KeyError, ValueError), e:
+                logger.warn("can't resume %r: %s", job, e)
+                self.journal.update(job.id, 'failed', error=str(e))
+                continue
+            conversion = self.get_conversion(
+                video, converter, output_dir=os.path.dirname(job.output))
+            conversion.job_id = job.id
+            logger.info('resuming %r as %r', job, conversion)
+            resumed.append(self.run_conversion(conversion))
+        return resumed
+
+    def queued(self):
+        """Iterate over the conversions that are queued or running,
+        including the ones waiting for a leader.
+        """
+        for conversion in itertools.chain(self.in_progress, self.preempted,
+                                          self.waiting):
+            yield conversion
+            if self.dedupe:
+                for follower in conversion.followers:
+                    yield follower
+
+    def is_duplicate(self, conversion):
+        """Is this conversion already done (according to the journal), or
+        already queued or running?
+        """
+        key = (conversion.video.filename, conversion.converter.identifier,
+               conversion.output)
+        for other in self.queued():
+            if (other.video.filename, other.converter.identifier,
+                other.output) == key:
+                return True
+        return self.journal is not None and self.journal.is_finished(*key)
+
+    def find_leader(self, conversion):
+        """Find a queued or running conversion that makes the same output
+        as conversion (see Conversion.leader).
+
+        :returns: the Conversion, or None
+        """
+        signature = conversion.get_signature()
+        if signature is None:
+            return None
+        for other in itertools.chain(self.in_progress, self.preempted,
+                                     self.waiting):
+            if (other.get_signature() == signature and
+                other.video.filename == conversion.video.filename and
+                other.status in ('initialized', 'converting', 'paused',
+                                 'staging')):
+                return other
+        return None
+
+    def release_followers(self, leader):
+        """Deal with the conversions waiting for leader, once it's done.
+
+        If it finished, they get queued to copy its output; they take up
+        a slot like any other conversion, and start_waiting() starts them.
+        If it got canceled, they get queued again, and convert themselves.
+        If it failed, so do they, since they'd run the same commands.
+        """
+        followers, leader.followers = leader.followers, []
+        for follower in followers:
+            if leader.status == 'finished':
+                self.trace_scheduler('copy', follower,
+                                     leader=unicode(leader))
+                self.add_waiting(follower)
+            elif leader.status == 'failed':
+                follower.error = 'converting for %s failed: %s' % (
+                    leader, leader.error)
+                follower.status = 'failed'
+                self.journal_update(follower, 'failed')
+                follower.notify_listeners()
+            else:
+                follower.leader = None
+                self.run_conversion(follower)
+
+    def trace_scheduler(self, event, conversion, **args):
+        """Record a scheduling decision, if tracing is on."""
+        tracer = tracing.tracer
+        if tracer is None:
+            return
+        if conversion is not None:
+            args['conversion'] = unicode(conversion)
+        tracer.instant(event, 'scheduler', args=args)
+        tracer.counter('conversions', {'running': len(self.in_progress),
+                                       'waiting': len(self.waiting),
+                                       'preempted': len(self.preempted)})
 
     def start_conversion(self, video, converter):
         return self.run_conversion(self.get_conversion(video, converter))
 
     def run_conversion(self, conversion):
-        if (self.simultaneous is not None and
-            len(self.in_progress) >= self.simultaneous):
-            self.waiting.append(conversion)
+        conversion.queued_at = self.clock()
+        if self.journal is not None:
+            try:
+                if conversion.job_id is None:
+                    conversion.job_id = self.journal.add(
+                        conversion.video.filename,
+                        conversion.converter.identifier, conversion.output)
+                else:
+                    self.journal.update(conversion.job_id, 'waiting')
+            except (EnvironmentError, journal.Error):
+                logger.exception('error adding %s to the journal',
+                                 conversion)
+        if self.dedupe:
+            leader = self.find_leader(conversion)
+            if leader is not None:
+                logger.info('%r makes the same output as %r; waiting for it',
+                            conversion, leader)
+                conversion.leader = leader
+                leader.followers.append(conversion)
+                self.trace_scheduler('follow', conversion,
+                                     leader=unicode(leader))
+                return conversion
+        if not self.can_start() and self.preempt:
+            self._preempt_for(conversion)
+        if not self.can_start() or not self.can_admit(conversion):
+            self.add_waiting(conversion)
+            self.trace_scheduler('enqueue', conversion)
         else:
             self._start_conversion(conversion)
             self.running = True
         return conversion
 
+    def can_start(self):
+        """Can another conversion start right now?"""
+        return (self.simultaneous is None or
+                len(self.in_progress) < self.simultaneous)
+
+    def _preempt_for(self, conversion):
+        """Pause a running conversion with a lower priority than
+        conversion, to free up a slot for it.
+
+        The one with the lowest priority gets paused; of those, the one with
+        the most left to do.
+
+        :returns: the paused conversion, or None
+        """
+        if self.jobserver is not None:
+            # A paused conversion keeps its jobserver token, so the one we
+            # made room for could wait for a token forever (under make -j1,
+            # there's only the one), and the paused one can't resume until
+            # it's done.
+            return None
+        candidates = [c for c in self.in_progress
+                      if c.status == 'converting' and
+                      c.priority < conversion.priority]
+        candidates.sort(key=lambda c: (c.priority, -(c.eta or 0.0)))
+        for victim in candidates:
+            if victim.pause():
+                self.in_progress.discard(victim)
+                self.preempted.append(victim)
+                self.trace_scheduler('preempt', victim, slot=victim.slot,
+                                     by=unicode(conversion))
+                victim.slot = None
+                return victim
+        return None
+
+    def can_admit(self, conversion):
+        """Is there enough memory to start conversion right now?"""
+        if self.concurrency is None:
+            return True
+        return self.concurrency.can_admit(self, conversion, self.clock())
+
+    def add_waiting(self, conversion):
+        """Queue a conversion, behind the others with the same or higher
+        priority.
+        """
+        if (not self.waiting or
+            conversion.priority <= self.waiting[-1].priority):
+            self.waiting.append(conversion)
+            return
+        for index, other in enumerate(self.waiting):
+            if other.priority < conversion.priority:
+                break
+        self.waiting.rotate(-index)
+        self.waiting.appendleft(conversion)
+        self.waiting.rotate(index)
+
+    def pop_waiting(self):
+        """Take the conversion that should start next off the waiting queue.
+
+        This is first come, first served within each priority; subclasses
+        can pick a different order (see mvc.simulation).
+        """
+        return self.waiting.popleft()
+
+    def peek_waiting(self):
+        """Get the conversion that pop_waiting() would return."""
+        return self.waiting[0]
+
+    def _next_preempted(self):
+        """Get the preempted conversion that should resume next, if it
+        should go before the waiting ones.
+        """
+        if not self.preempted:
+            return None
+        conversion = max(self.preempted, key=lambda c: c.priority)
+        if self.waiting and self.waiting[0].priority > conversion.priority:
+            return None
+        return conversion
+
+    def _resume_conversion(self, conversion):
+        self.preempted.remove(conversion)
+        used = set(c.slot for c in self.in_progress)
+        conversion.slot = 1
+        while conversion.slot in used:
+            conversion.slot += 1
+        self.in_progress.add(conversion)
+        self.trace_scheduler('resume', conversion, slot=conversion.slot)
+        conversion.resume()
+
     def _start_conversion(self, conversion):
+        queue_wait = None
+        if conversion.queued_at is not None:
+            queue_wait = self.clock() - conversion.queued_at
+            self.metrics.observe('queue', queue_wait)
+        used = set(c.slot for c in self.in_progress)
+        conversion.slot = 1
+        while conversion.slot in used:
+            conversion.slot += 1
         self.in_progress.add(conversion)
+        self.assign_scheduling(conversion)
+        self.trace_scheduler('start', conversion, slot=conversion.slot,
+                             queue_wait=queue_wait)
         conversion.create_thumbnail = self.create_thumbnails
         conversion.run()
+        if self.journal is not None:
+            self.journal_update(conversion, 'converting',
+                                temp_output=conversion.temp_output)
+
+    def get_scheduling(self, conversion):
+        """Get the SchedulingClass that a conversion should run with."""
+        if conversion.scheduling is not None:
+            return conversion.scheduling
+        return self.scheduling_by_priority.get(conversion.priority,
+                                               self.default_scheduling)
+
+    def assign_scheduling(self, conversion):
+        conversion.scheduling = self.get_scheduling(conversion)
+        if conversion.scheduling is not None and conversion.scheduling.cores:
+            conversion.cpus = self.cores.allocate(conversion.scheduling.cores)
 
     def check_notifications(self):
         if not self.running:
-            # don't bother checking if we're not running
+            # don't bother checking if we're not running, but keep the
+            # wakeups coming for when we are
+            self.notifications.rearm()
             return
 
-        self.notify_queue, changed = set(), self.notify_queue
-
-        for conversion in changed:
+        for conversion in self.notifications.collect():
             if conversion.status in ('canceled', 'finished', 'failed'):
                 self.conversion_finished(conversion)
             for listener in conversion.listeners:
                 listener(conversion)
+        if self.concurrency is not None:
+            self.adjust_concurrency()
+
+    def adjust_concurrency(self):
+        """Let the AdaptiveConcurrency change our limit, and start waiting
+        conversions if it went up (or memory got freed).
+        """
+        if self.concurrency.update(self, self.clock()):
+            self.trace_scheduler('limit', None, simultaneous=self.simultaneous)
+        self.start_waiting()
 
     def conversion_finished(self, conversion):
-        self.in_progress.discard(conversion)
-        while (self.waiting and self.simultaneous is not None and
-               len(self.in_progress) < self.simultaneous):
-            c = self.waiting.popleft()
-            self._start_conversion(c)
-        if not self.in_progress:
+        if conversion in self.in_progress or conversion in self.preempted:
+            self.in_progress.discard(conversion)
+            if conversion in self.preempted:
+                self.preempted.remove(conversion)
+            if conversion.cpus is not None:
+                self.cores.release(conversion.cpus)
+                conversion.cpus = None
+            self.trace_scheduler('finish', conversion,
+                                 status=conversion.status)
+            self.journal_update(conversion, conversion.status)
+            if (self.concurrency is not None and
+                conversion.status == 'finished'):
+                self.concurrency.record_footprint(conversion)
+        if self.dedupe:
+            self.release_followers(conversion)
+        self.start_waiting()
+        if not self.in_progress and not self.preempted:
             self.running = False
+
+    def start_waiting(self):
+        """Start (or resume) conversions while there's room for them."""
+        while (self.waiting or self.preempted) and self.can_start():
+            preempted = self._next_preempted()
+            if preempted is not None:
+                self._resume_conversion(preempted)
+            elif self.can_admit(self.peek_waiting()):
+                self._start_conversion(self.pop_waiting())
+            else:
+                break
@@ -1,8 +1,11 @@
+import copy
+import hashlib
 import json
 import logging
 import os
 import re
 import shutil
+import tempfile
 
 from mvc import resources, settings, utils
 from mvc.utils import hms_to_seconds
@@ -14,6 +17,153 @@ logger = logging.getLogger(__name__)
 
 NON_WORD_CHARS = re.compile(r"[^a-zA-Z0-9]+")
 
+def _parse_time(t):
+    if ':' in t:
+        hours, minutes, seconds = [float(m) for m in t.split(':')[:3]]
+        return hms_to_seconds(hours, minutes, seconds)
+    else:
+        return float(t)
+
+class StatusLineParser(object):
+    """Turns lines of converter output into status dicts.
+
+    Almost every line a converter prints is a progress line, so rather than
+    trying each regex in turn, we look at how the first word of the line
+    starts (leading whitespace is skipped) and only run the handler
+    registered for that.
+
+    :param handlers: dict mapping word prefixes to functions that take the
+    line and return a status dict or None.  Longer prefixes are tried first.
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.prefix_lengths = sorted(set(len(k) for k in handlers),
+                                     reverse=True)
+
+    def parse(self, line):
+        stripped = line.lstrip()
+        for length in self.prefix_lengths:
+            handler = self.handlers.get(stripped[:length])
+            if handler is not None:
+                return handler(line)
+        return None
+
+DIGITS = '0123456789'
+
+# what ffmpeg -i calls the codecs our encoders write
+ENCODER_CODECS = {
+    'libx264': 'h264',
+    'libopenh264': 'h264',
+    'libfdk_aac': 'aac',
+    'libvpx': 'vp8',
+    'libvorbis': 'vorbis',
+    'libtheora': 'theora',
+    'libmp3lame': 'mp3',
+}
+
+# H.264 profile given to -profile:v -> the input profiles that a player for
+# it can also play, as ffmpeg -i shows them (lower case)
+COMPATIBLE_PROFILES = {
+    'baseline': ('baseline', 'constrained baseline'),
+    'constrained_baseline': ('constrained baseline',),
+    'main': ('constrained baseline', 'main'),
+    'high': ('constrained baseline', 'main', 'high'),
+}
+
+# H.264 level given to -level -> the most macroblocks a frame can have
+H264_LEVEL_FRAME_MBS = {
+    '30': 1620, '3.0': 1620,
+    '31': 3600, '3.1': 3600,
+    '32': 5120, '3.2': 5120,
+    '40': 8192, '4.0': 8192,
+    '41': 8192, '4.1': 8192,
+    '42': 8704, '4.2': 8704,
+}
+
+# we only copy video that every player can decode
+COPY_PIXEL_FORMATS = ('yuv420p', 'yuvj420p')
+
+# preset parameters that change the stream in ways that need it re-encoded
+VIDEO_FILTER_OPTIONS = ('-r', '-vf', '-filter:v', '-pix_fmt', '-aspect')
+AUDIO_FILTER_OPTIONS = ('-af', '-filter:a', '-aq', '-q:a')
+# preset parameters that cap the bitrate; a stream under the cap can be
+# copied
+VIDEO_BITRATE_OPTIONS = ('-b:v', '-vb', '-b', '-maxrate')
+AUDIO_BITRATE_OPTIONS = ('-b:a', '-ab')
+
+def parse_bitrate(value):
+    """Parse an ffmpeg bitrate like "160k" or "2M" into bits per second.
+
+    :returns: int, or None if value isn't a bitrate
+    """
+    multiplier = 1
+    if value[-1:] in ('k', 'K'):
+        multiplier, value = 1000, value[:-1]
+    elif value[-1:] == 'M':
+        multiplier, value = 1000000, value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        return None
+
+class EncoderOption(object):
+    """One of the encoders that a preset can use for a stream.
+
+    :param encoder: ffmpeg encoder name
+    :param parameters: arguments to use with it, as a string or a list
+    :param min_version: oldest ffmpeg version that takes those arguments
+    """
+    def __init__(self, encoder, parameters=(), min_version=None):
+        self.encoder = encoder
+        if isinstance(parameters, basestring):
+            parameters = parameters.split()
+        self.parameters = list(parameters)
+        self.min_version = min_version
+
+    def __repr__(self):
+        return '<EncoderOption %s>' % self
+
+    def __str__(self):
+        return ' '.join([self.encoder] + self.parameters)
+
+    @property
+    def codec(self):
+        """The codec that the encoder writes, named like ffmpeg -i does."""
+        return ENCODER_CODECS.get(self.encoder, self.encoder)
+
+    @property
+    def is_copy(self):
+        return self.encoder == 'copy'
+
+    def is_usable(self, capabilities):
+        """Can the ffmpeg with these capabilities.Capabilities use us?"""
+        if capabilities.encoders and not capabilities.has_encoder(
+                self.encoder):
+            return False
+        # git builds don't have a version, but they're usually recent
+        if (self.min_version is not None and
+            capabilities.version is not None and
+            capabilities.version < self.min_version):
+            return False
+        return True
+
+# copies the input stream as is, instead of encoding it
+STREAM_COPY = EncoderOption('copy')
+
+def choose_encoder(options, capabilities):
+    """Pick the first usable EncoderOption from a ranked list.
+
+    If none of them are usable, or we don't know what ffmpeg can do, the
+    last one gets picked, so lists have to end with the one that's most
+    widely available.
+    """
+    if capabilities is not None:
+        for option in options:
+            if option.is_usable(capabilities):
+                return option
+    return options[-1]
+
 class ConverterInfo(object):
     """Describes a particular output converter
 
@@ -28,11 +178,15 @@ class ConverterInfo(object):
     :attribute height: output height for this converter.  Works just like
     width
     :attribute dont_upsize: should we allow upsizing for conversions? 
+    :attribute fragmented: for mp4 output, write a fragmented file (moof/mdat
+    fragments after an empty moov) that can be streamed while it is still
+    being written, instead of running qtfaststart over it afterwards.
     """
     media_type = None
     bitrate = None
     extension = None
     audio_only = False
+    fragmented = False
 
     def __init__(self, name, width=None, height=None, dont_upsize=True):
         self.name = name
@@ -50,6 +204,80 @@ class ConverterInfo(object):
     def get_jobs(self, video, output):
         raise NotImplementedError
 
+    def supports_segments(self, video):
+        """Can we convert video in separate time segments, and join them
+        afterwards?  See get_segment_jobs() and get_concat_job().
+        """
+        return False
+
+    def get_segment_jobs(self, video, output, start, length):
+        """Like get_jobs(), but only convert length seconds of video,
+        starting at start.
+        """
+        raise NotImplementedError
+
+    def get_concat_job(self, concat_list, output):
+        """Get the command line that joins converted segments.
+
+        :param concat_list: file listing the segments, in the format of
+        ffmpeg's concat demuxer
+        """
+        raise NotImplementedError
+
+    def get_video_codec(self, video):
+        """Get the name of the video encoder we use for video, or None if
+        we don't know or the output is audio only.
+        """
+        return None
+
+    def choose_encoders(self, video):
+        """Pick the encoders to convert video with.
+
+        :returns: dict mapping stream types ('video', 'audio') to the
+        EncoderOption picked for them.  Empty if the converter doesn't
+        choose between encoders.
+        """
+        return {}
+
+    def with_encoders(self, encoders):
+        """Get a version of this converter that always uses encoders (as
+        returned by choose_encoders()).
+        """
+        return self
+
+    def plan_streams(self, video, encoders):
+        """Decide which streams of video can be copied as they are.
+
+        A stream can be copied if it already is what the encoder we picked
+        for it would make: same codec, size, profile, and so on.  Remuxing
+        it takes seconds where encoding it again takes minutes.
+
+        :param encoders: the encoders picked by choose_encoders()
+        :returns: dict mapping each stream type in encoders to 'copy', or
+        to the reason it has to be encoded.  Streams set to 'copy' should
+        use STREAM_COPY in with_encoders().
+        """
+        return {}
+
+    def get_signature(self, video):
+        """Get a signature of the output we'd make for video.
+
+        Converters that would run the same commands on video (say, two
+        phone presets with the same parameters and size) have the same
+        signature, so the output only has to be made once.
+
+        :returns: string, or None if we can't tell
+        """
+        return None
+
+    def get_missing_requirements(self, video):
+        """Check that the converter has what it needs to convert video.
+
+        :returns: list of things that are missing, like 'encoder libvpx'.
+        Empty if nothing is (or we can't tell).
+        """
+        return []
+
     def get_output_filename(self, video):
         basename = os.path.basename(video.filename)
         name, ext = os.path.splitext(basename)
@@ -64,10 +292,14 @@ class ConverterInfo(object):
         if video.duration:
             return self.bitrate * video.duration / 8
 
+    def is_fragmented_mp4(self):
+        return self.fragmented and self.extension == 'mp4'
+
     def finalize(self, temp_output, output):
         err = None
         needs_remove = False
-        if self.media_type == 'format' and self.extension == 'mp4':
+        if (self.media_type == 'format' and self.extension == 'mp4' and
+            not self.is_fragmented_mp4()):
             needs_remove = True
             logging.debug('generic mp4 format detected.  '
                           'Running qtfaststart...')
@@ -108,6 +340,31 @@ class ConverterInfo(object):
     def process_status_line(self, line):
         raise NotImplementedError
 
+    def get_progress_arguments(self, fd):
+        """Get the arguments that make the converter write structured
+        progress to the file descriptor fd.
+
+        :returns: list of arguments, or None if the converter can't do that,
+        in which case progress is scraped from the output by
+        process_status_line().
+        """
+        return None
+
+    def process_progress(self, video, values):
+        """Convert a block of structured progress into a status dict.
+
+        Only called for converters that support get_progress_arguments().
+        """
+        raise NotImplementedError
+
+    def process_error_line(self, video, line):
+        """Check a line of output for errors when progress is being reported
+        over a separate channel.
+
+        :returns: a status dict, or None
+        """
+        raise NotImplementedError
+
 class FFmpegConverterInfo(ConverterInfo):
     """Base class for all ffmpeg-based conversions.
 
@@ -115,6 +372,11 @@ class FFmpegConverterInfo(ConverterInfo):
     ffmpeg command line for the conversion.  parameters can either be a list
     of arguments, or a string in which case split() will be called to create
     the list.
+
+    Instead of putting the encoders in parameters, subclasses can list
+    EncoderOptions in video_encoders and audio_encoders, in order of
+    preference (usually the fastest first).  Each conversion uses the first
+    one that our ffmpeg supports.
     """
     DURATION_RE = re.compile(r'\W*Duration: (\d\d):(\d\d):(\d\d)\.(\d\d)'
                              '(, start:.*)?(, bitrate:.*)?')
@@ -124,9 +386,17 @@ class FFmpegConverterInfo(ConverterInfo):
                              'bitrate=(.*)')
     LAST_PROGRESS_RE = re.compile(r'frame=.* fps=.* q=.* Lsize=.* time=(.*) '
                                   'bitrate=(.*)')
+    # moov goes first (empty), then a moof/mdat fragment per keyframe
+    FRAGMENTED_MP4_FLAGS = 'frag_keyframe+empty_moov+default_base_moof'
 
     extension = None
     parameters = None
+    video_encoders = None
+    audio_encoders = None
+    # stream type -> EncoderOption; set by with_encoders()
+    encoders = None
+
+    CODEC_OPTIONS = (('video', '-vcodec'), ('audio', '-acodec'))
 
     def get_executable(self):
         return settings.get_ffmpeg_executable_path()
@@ -135,10 +405,13 @@ class FFmpegConverterInfo(ConverterInfo):
         args = ['-i', utils.convert_path_for_subprocess(video.filename)]
         args.extend(settings.customize_ffmpeg_parameters(
             self.get_parameters(video)))
-        if not (self.audio_only or video.audio_only):
+        if not (self.audio_only or video.audio_only or
+                self.is_copying('video')):
             width, height = self.get_target_size(video)
             args.append("-s")
             args.append('%ix%i' % (width, height))
+        if self.is_fragmented_mp4() and method != 'pass1':
+            args.extend(['-movflags', self.FRAGMENTED_MP4_FLAGS])
         args.extend(self.get_extra_arguments(video, output, method))
         if method is not None and method == 'pass1':
             args.append("/dev/null")
@@ -147,11 +420,83 @@ class FFmpegConverterInfo(ConverterInfo):
         return args
 
     def get_jobs(self, video, output):
+        if self.is_copying('video') or (
+            (self.audio_only or video.audio_only) and
+            self.is_copying('audio')):
+            # nothing for a first pass to look at
+            return [[self.get_executable()] +
+                    list(self.get_arguments(video, output, None))]
         pass1 = [self.get_executable()]+list(self.get_arguments(video, output, 'pass1'))
         pass2 = [self.get_executable()]+list(self.get_arguments(video, output, 'pass2'))
 
         return [pass1, pass2]
 
+    def supports_segments(self, video):
+        # copied streams can only be cut at keyframes, so the segments
+        # wouldn't line up (and remuxing is quick anyway)
+        if self.is_copying('video') or self.is_copying('audio'):
+            return False
+        return bool(video.duration)
+
+    def get_segment_jobs(self, video, output, start, length):
+        jobs = []
+        for commandline in self.get_jobs(video, output):
+            # seek on the input (which is fast), and stop after length
+            # seconds of output
+            input_index = commandline.index('-i')
+            jobs.append(commandline[:input_index] +
+                        ['-ss', '%.3f' % start] +
+                        commandline[input_index:input_index + 2] +
+                        ['-t', '%.3f' % length] +
+                        commandline[input_index + 2:])
+        return jobs
+
+    def get_concat_job(self, concat_list, output):
+        commandline = [self.get_executable(), '-f', 'concat', '-safe', '0',
+                       '-i', utils.convert_path_for_subprocess(concat_list),
+                       '-c', 'copy']
+        if self.is_fragmented_mp4():
+            commandline.extend(['-movflags', self.FRAGMENTED_MP4_FLAGS])
+        commandline.append(self.convert_output_path(output))
+        return commandline
+
+    @staticmethod
+    def _get_option(parameters, options):
+        """Get the value of the first of options that's in parameters."""
+        for option in options:
+            if option in parameters:
+                index = parameters.index(option)
+                if index + 1 < len(parameters):
+                    return parameters[index + 1]
+        return None
+
+    def get_video_codec(self, video):
+        if self.audio_only or video.audio_only:
+            return None
+        return self._get_option(self.get_parameters(video),
+                                ('-vcodec', '-c:v', '-codec:v'))
+
+    def get_missing_requirements(self, video):
+        capabilities = settings.get_ffmpeg_capabilities()
+        if capabilities is None:
+            return []
+        parameters = self.get_parameters(video)
+        missing = []
+        encoders = [self.get_video_codec(video),
+                    self._get_option(parameters,
+                                     ('-acodec', '-c:a', '-codec:a'))]
+        # an empty list means we couldn't parse it, not that there are none
+        if capabilities.encoders:
+            for encoder in encoders:
+                if (encoder is not None and encoder != 'copy' and
+                    not capabilities.has_encoder(encoder)):
+                    missing.append('encoder %s' % encoder)
+        muxer = self._get_option(parameters, ('-f',))
+        if (capabilities.muxers and muxer is not None and
+            not capabilities.has_muxer(muxer)):
+            missing.append('muxer %s' % muxer)
+        return missing
+
     def convert_output_path(self, output_path):
         """Convert our output path so that it can be passed to ffmpeg."""
         # this is a bit tricky, because output_path doesn't exist on windows
@@ -174,7 +519,138 @@ class FFmpegConverterInfo(ConverterInfo):
         else:
             return []
 
-    def get_parameters(self, video):
+    def choose_encoders(self, video):
+        if self.encoders is not None:
+            return dict(self.encoders)
+        ranked = {'video': self.video_encoders, 'audio': self.audio_encoders}
+        if self.audio_only:
+            del ranked['video']
+        encoders = {}
+        capabilities = None
+        for stream, options in ranked.items():
+            if not options:
+                continue
+            if capabilities is None:
+                capabilities = settings.get_ffmpeg_capabilities()
+            encoders[stream] = choose_encoder(options, capabilities)
+        return encoders
+
+    def with_encoders(self, encoders):
+        pinned = copy.copy(self)
+        pinned.encoders = dict(encoders)
+        return pinned
+
+    def is_copying(self, stream):
+        """Have we been pinned to copying stream (see plan_streams())?"""
+        return (self.encoders is not None and stream in self.encoders and
+                self.encoders[stream].is_copy)
+
+    def get_signature(self, video):
+        if not settings.ffmpeg_capabilities_loaded():
+            # the jobs depend on them, and we get called on the main thread
+            # when a conversion is queued; that shouldn't wait for the probe
+            return None
+        # the output path shows up in the commands, so use the same one for
+        # every converter
+        extension = self.extension or 'out'
+        output = os.path.join(tempfile.gettempdir(),
+                              'mvc-signature.%s' % extension)
+        jobs = self.get_jobs(video, output)
+        # finalize() does different things for different media types
+        data = json.dumps([jobs, extension, self.media_type == 'format',
+                           self.is_fragmented_mp4()])
+        return hashlib.sha1(data).hexdigest()
+
+    def plan_streams(self, video, encoders):
+        parameters = self.get_preset_parameters()
+        plan = {}
+        for stream, option in encoders.items():
+            if option.is_copy:
+                plan[stream] = 'copy'
+                continue
+            if stream == 'video':
+                reason = self._check_video_copy(video, option, parameters)
+            else:
+                reason = self._check_audio_copy(video, option, parameters)
+            plan[stream] = reason or 'copy'
+        return plan
+
+    @staticmethod
+    def _check_codec(input_codec, option):
+        if input_codec is None:
+            return 'no input stream'
+        if input_codec != option.codec:
+            return 'input is %s, not %s' % (input_codec, option.codec)
+        return None
+
+    def _check_profile(self, input_profile, option, profile_option):
+        profile = self._get_option(option.parameters, (profile_option,))
+        if profile is None:
+            return None
+        if input_profile is None:
+            return 'unknown input profile'
+        compatible = COMPATIBLE_PROFILES.get(profile.lower(),
+                                             (profile.lower(),))
+        if input_profile.lower() not in compatible:
+            return 'input profile is %s, not %s' % (input_profile, profile)
+        return None
+
+    def _check_options(self, parameters, filter_options, bitrate_options,
+                       input_bitrate):
+        for option in filter_options:
+            if option in parameters:
+                return 'parameters have %s' % option
+        for option in bitrate_options:
+            limit = self._get_option(parameters, (option,))
+            if limit is None:
+                continue
+            if input_bitrate is None:
+                return 'unknown input bitrate'
+            if parse_bitrate(limit) < input_bitrate:
+                return 'input bitrate is over %s %s' % (option, limit)
+        return None
+
+    def _check_video_copy(self, video, option, parameters):
+        reason = self._check_codec(video.video_codec, option)
+        if reason:
+            return reason
+        if video.width is None or video.height is None:
+            return 'unknown input size'
+        target_size = self.get_target_size(video)
+        if target_size != (video.width, video.height):
+            return 'resizing to %ix%i' % target_size
+        if video.pixel_format not in COPY_PIXEL_FORMATS:
+            return 'pixel format is %s' % video.pixel_format
+        reason = self._check_profile(video.video_profile, option,
+                                     '-profile:v')
+        if reason:
+            return reason
+        level = self._get_option(option.parameters, ('-level',))
+        if level is not None:
+            frame_mbs = ((video.width + 15) // 16) * ((video.height + 15) // 16)
+            if frame_mbs > H264_LEVEL_FRAME_MBS.get(level, 0):
+                return 'too big for level %s' % level
+        return self._check_options(parameters, VIDEO_FILTER_OPTIONS,
+                                   VIDEO_BITRATE_OPTIONS, video.video_bitrate)
+
+    def _check_audio_copy(self, video, option, parameters):
+        reason = self._check_codec(video.audio_codec, option)
+        if reason:
+            return reason
+        reason = self._check_profile(video.audio_profile, option,
+                                     '-profile:a')
+        if reason:
+            return reason
+        for option_name, value in (('-ac', video.audio_channels),
+                                   ('-ar', video.audio_sample_rate)):
+            wanted = self._get_option(parameters, (option_name,))
+            if wanted is not None and str(value) != wanted:
+                return 'parameters have %s %s' % (option_name, wanted)
+        return self._check_options(parameters, AUDIO_FILTER_OPTIONS,
+                                   AUDIO_BITRATE_OPTIONS, video.audio_bitrate)
+
+    def get_preset_parameters(self):
+        """Get parameters as a list, without the encoders."""
         if self.parameters is None:
             raise ValueError("%s: parameters is None" % self)
         elif isinstance(self.parameters, basestring):
@@ -182,6 +658,15 @@ class FFmpegConverterInfo(ConverterInfo):
         else:
             return list(self.parameters)
 
+    def get_parameters(self, video):
+        parameters = self.get_preset_parameters()
+        encoders = self.choose_encoders(video)
+        for stream, option in self.CODEC_OPTIONS:
+            if stream in encoders:
+                parameters.extend([option, encoders[stream].encoder])
+                parameters.extend(encoders[stream].parameters)
+        return parameters
+
     @staticmethod
     def _check_for_errors(line):
         if line.startswith('Unknown'):
@@ -191,11 +676,13 @@ class FFmpegConverterInfo(ConverterInfo):
                 return line
 
     @classmethod
-    def process_status_line(klass, video, line):
+    def _error_status(klass, line):
         error = klass._check_for_errors(line)
         if error:
             return {'finished': True, 'error': error}
 
+    @classmethod
+    def _duration_status(klass, line):
         match = klass.DURATION_RE.match(line)
         if match is not None:
             hours, minutes, seconds, centi = [
@@ -203,22 +690,96 @@ class FFmpegConverterInfo(ConverterInfo):
             return {'duration': hms_to_seconds(hours, minutes,
                                                seconds + 0.01 * centi)}
 
-        match = klass.FIRST_PASS.match(line)
-        if match is not None:
-            return {'pass1': 0.2}
+    @classmethod
+    def _progress_status(klass, line):
+        # "frame=... size=... time=... bitrate=..." or, for audio,
+        # "size=... time=... bitrate=...".  The last report says Lsize instead
+        # of size.
+        if 'Lsize=' in line:
+            if klass.LAST_PROGRESS_RE.match(line) is not None:
+                return {'finished': True}
+            return None
+        if 'time=10000000000.00 ' in line:
+            if klass.FIRST_PASS.match(line) is not None:
+                return {'pass1': 0.2}
+        # This is what PROGRESS_RE matches, without the backtracking
+        bitrate_start = line.rfind(' bitrate=')
+        if bitrate_start < 0:
+            return None
+        time_start = line.rfind(' time=', 0, bitrate_start)
+        if time_start < 0 or 'size=' not in line[:time_start]:
+            return None
+        return {'progress': _parse_time(line[time_start + 6:bitrate_start])}
 
-        match = klass.PROGRESS_RE.match(line)
-        if match is not None:
-            t = match.group(1)
-            if ':' in t:
-                hours, minutes, seconds = [float(m) for m in t.split(':')[:3]]
-                return {'progress': hms_to_seconds(hours, minutes, seconds)}
-            else:
-                return {'progress': float(t)}
+    @classmethod
+    def get_status_line_parser(klass):
+        # build one per class, since subclasses may change the regexes
+        if '_status_line_parser' not in klass.__dict__:
+            klass._status_line_parser = StatusLineParser({
+                'Unkn': klass._error_status,
+                'Erro': klass._error_status,
+                'Dura': klass._duration_status,
+                'fram': klass._progress_status,
+                'size': klass._progress_status,
+            })
+        return klass._status_line_parser
 
-        match = klass.LAST_PROGRESS_RE.match(line)
-        if match is not None:
-            return {'finished': True}
+    @classmethod
+    def process_status_line(klass, video, line):
+        return klass.get_status_line_parser().parse(line)
+
+    def get_progress_arguments(self, fd):
+        capabilities = settings.get_ffmpeg_capabilities()
+        if (capabilities is not None and
+            capabilities.supports_progress is False):
+            # too old; scrape the stats lines instead
+            return None
+        # -nostats keeps the frame=... lines out of the log; we get the same
+        # numbers (and more) from -progress.
+        return ['-nostats', '-progress', 'pipe:%i' % fd]
+
+    @classmethod
+    def process_error_line(klass, video, line):
+        error = klass._check_for_errors(line)
+        if error:
+            return {'finished': True, 'error': error}
+
+    @staticmethod
+    def _progress_number(value, convert=float, suffix=None):
+        if value is None:
+            return None
+        if suffix and value.endswith(suffix):
+            value = value[:-len(suffix)]
+        try:
+            return convert(value)
+        except ValueError:
+            # ffmpeg writes N/A until it knows the value
+            return None
+
+    @classmethod
+    def process_progress(klass, video, values):
+        """Convert a block of ffmpeg -progress output into a status dict.
+
+        Besides progress, the dict contains frame, fps, speed, out_time,
+        total_size and bitrate (in kbits/s) when ffmpeg knows them.
+        """
+        number = klass._progress_number
+        status = {}
+        # out_time_ms is actually in microseconds; newer ffmpegs also write
+        # out_time_us, which means the same thing.
+        out_time_us = values.get('out_time_us', values.get('out_time_ms'))
+        out_time_us = number(out_time_us, int)
+        if out_time_us is not None and out_time_us >= 0:
+            status['out_time'] = status['progress'] = out_time_us / 1000000.0
+        for key, convert, suffix in (('frame', int, None),
+                                     ('fps', float, None),
+                                     ('speed', float, 'x'),
+                                     ('total_size', int, None),
+                                     ('bitrate', float, 'kbits/s')):
+            value = number(values.get(key), convert, suffix)
+            if value is not None:
+                status[key] = value
+        return status
 
 class FFmpegConverterInfo1080p(FFmpegConverterInfo):
     def __init__(self, name):
@@ -271,6 +832,11 @@ class FFmpeg2TheoraConverterInfo(ConverterInfo):
     def get_jobs(self, video, output):
         return [[self.get_executable()]+list(self.get_arguments(video, output))]
 
+    def get_video_codec(self, video):
+        if self.audio_only or video.audio_only:
+            return None
+        return 'libtheora'
+
     def convert_output_path(self, output_path):
         """Convert our output path so that it can be passed to ffmpeg."""
         # this is a bit tricky, because output_path doesn't exist on windows
@@ -305,11 +871,13 @@ class FFmpeg2TheoraConverterInfo(ConverterInfo):
                 return line
 
     @classmethod
-    def process_status_line(klass, video, line):
+    def _error_status(klass, line):
         error = klass._check_for_errors(line)
         if error:
             return {'finished': True, 'error': error}
 
+    @classmethod
+    def _duration_status(klass, line):
         match = klass.DURATION_RE.match(line)
         if match is not None:
             hours, minutes, seconds, centi = [
@@ -317,42 +885,75 @@ class FFmpeg2TheoraConverterInfo(ConverterInfo):
             return {'duration': hms_to_seconds(hours, minutes,
                                                seconds + 0.01 * centi)}
 
-        match = klass.FIRST_PASS.match(line)
-        if match is not None:
-            t = match.group(1)
-            if ':' in t:
-                hours, minutes, seconds = [float(m) for m in t.split(':')[:3]]
-                return {'pass1': hms_to_seconds(hours, minutes, seconds)}
-            else:
-                return {'pass1': float(t)}
-
-        match = klass.PROGRESS_RE.match(line)
-        if match is not None:
-            t = match.group(1)
-            if ':' in t:
-                hours, minutes, seconds = [float(m) for m in t.split(':')[:3]]
-                return {'pass2': hms_to_seconds(hours, minutes, seconds)}
-            else:
-                return {'pass2': float(t)}
+    @classmethod
+    def _first_pass_status(klass, line):
+        # "Scanning first pass pos: 0:00:12.60 ET: 00:00:03"
+        before, sep, rest = line.partition(' pos:')
+        position, sep, rest = rest.lstrip().partition(' ET:')
+        if before == 'Scanning first pass' and sep:
+            return {'pass1': _parse_time(position)}
 
-        match = klass.LAST_PROGRESS_RE.match(line)
-        if match is not None:
+    @classmethod
+    def _progress_status(klass, line):
+        # "0:00:08.70 audio: 64kbps video: 1000kbps, ET: ..., est. size: ..."
+        # while encoding and "... time elapsed: ..." at the end.
+        position, sep, rest = line.lstrip().partition(' audio:')
+        if not sep or ' video:' not in rest:
+            return None
+        if ', ET:' in rest and ', est. size:' in rest:
+            return {'pass2': _parse_time(position)}
+        elif ', time elapsed:' in rest:
             return {'finished': True}
 
+    @classmethod
+    def get_status_line_parser(klass):
+        # build one per class, since subclasses may change the regexes
+        if '_status_line_parser' not in klass.__dict__:
+            handlers = dict.fromkeys(DIGITS, klass._progress_status)
+            handlers.update({
+                'Unkn': klass._error_status,
+                'Erro': klass._error_status,
+                'Dura': klass._duration_status,
+                'Scan': klass._first_pass_status,
+            })
+            klass._status_line_parser = StatusLineParser(handlers)
+        return klass._status_line_parser
+
+    @classmethod
+    def process_status_line(klass, video, line):
+        return klass.get_status_line_parser().parse(line)
+
 class ConverterManager(object):
-    def __init__(self):
+    """Keeps track of the converters, indexed by identifier, brand and
+    media type.
+
+    :param preset_cache_path: file to cache the compiled presets in (see
+    mvc.presets); None means compile them on every startup
+    :param load_presets: if True, startup() loads the device presets in
+    resources/converters too, not just the simple converters
+    """
+    def __init__(self, preset_cache_path=None, load_presets=False):
         self.converters = {}
-        # converter -> brand reverse map.  XXX: this code, really, really sucks
-        # and not very scalable.
-        self.brand_rmap = {}
+        # brand -> list of converters, and converter -> brand.  Converters
+        # without a brand are under None.
         self.brand_map = {}
+        self.brand_rmap = {}
+        # media_type -> list of converters
+        self.media_type_map = {}
+        self.preset_cache_path = preset_cache_path
+        self.load_presets = load_presets
 
-    def add_converter(self, converter):
+    def add_converter(self, converter, brand=None):
         self.converters[converter.identifier] = converter
+        self.brand_rmap[converter] = brand
+        self.brand_map.setdefault(brand, []).append(converter)
+        self.media_type_map.setdefault(converter.media_type, []).append(
+            converter)
 
     def startup(self):
         self.load_simple_converters()
-        #self.load_converters(resources.converter_scripts())
+        if self.load_presets:
+            self.load_converters(resources.preset_files())
 
     def brand_to_converters(self, brand):
         try:
@@ -366,39 +967,29 @@ class ConverterManager(object):
         except KeyError:
             return None
 
+    def media_type_to_converters(self, media_type):
+        return self.media_type_map.get(media_type, [])
+
     def load_simple_converters(self):
         from mvc import basicconverters
         for converter in basicconverters.converters:
             if isinstance(converter, tuple):
                 brand, realconverters = converter
                 for realconverter in realconverters:
-                    self.brand_rmap[realconverter] = brand
-                    self.brand_map.setdefault(brand, []).append(realconverter)
-                    self.add_converter(realconverter)
+                    self.add_converter(realconverter, brand)
             else:
-                self.brand_rmap[converter] = None
-                self.brand_map.setdefault(None, []).append(converter)
                 self.add_converter(converter)
 
-    def load_converters(self, converters):
-        for converter_file in converters:
-            global_dict = {}
-            execfile(converter_file, global_dict)
-            if 'converters' in global_dict:
-                for converter in global_dict['converters']:
-                    if isinstance(converter, tuple):
-                        brand, realconverters = converter
-                        for realconverter in realconverters:
-                            self.brand_rmap[realconverter] = brand
-                            self.brand_map.setdefault(brand, []).append(realconverter)
-                            self.add_converter(realconverter)
-                    else:
-                        self.brand_rmap[converter] = None
-                        self.brand_map.setdefault(None, []).append(converter)
-                        self.add_converter(converter)
-                logger.info('load_converters: loaded %i from %r',
-                            len(global_dict['converters']),
-                            converter_file)
+    def load_converters(self, paths):
+        """Load the presets in JSON files (see mvc.presets)."""
+        from mvc import presets
+        cache = presets.PresetCache(self.preset_cache_path)
+        entries = cache.get(paths)
+        for entry in entries:
+            self.add_converter(presets.make_converter(entry),
+                               entry['brand'])
+        logger.info('load_converters: loaded %i presets from %i files',
+                    len(entries), len(paths))
 
     def list_converters(self):
         return self.converters.values()
@@ -1,17 +1,227 @@
 """execute.py -- Run executable programs.
 
 mvc.execute wraps the standard subprocess module in for MVC.
+
+On Linux, children are started with posix_spawn() rather than fork().
+fork() copies the page tables of the whole process.  In a big process
+(the GTK app, say), that's most of the cost of starting ffmpeg, and we
+start a lot of ffmpegs.  glibc's posix_spawn() starts the child with vfork
+semantics instead, and still tells us if the exec failed.
 """
 
+import ctypes
+import ctypes.util
+import errno
+import logging
 import os
+import platform
+import signal
 import subprocess
 import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # win32
+
+logger = logging.getLogger(__name__)
 
 CalledProcessError = subprocess.CalledProcessError
 
+# I/O scheduling classes for the ionice argument of Popen (see ionice(1))
+IONICE_REALTIME = 1
+IONICE_BEST_EFFORT = 2
+IONICE_IDLE = 3
+
+# glibc has no wrapper for ioprio_set(), so we need the syscall number
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+
+# for setpriority()
+PRIO_PROCESS = 0
+
+# win32 process priority classes, which stand in for nice levels there
+BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+IDLE_PRIORITY_CLASS = 0x40
+
+# set to False to always start children with fork()
+use_posix_spawn = True
+
+# glibc's posix_spawn_file_actions_t is 80 bytes on 64-bit systems; leave
+# plenty of room
+SPAWN_FILE_ACTIONS_SIZE = 256
+
+# python 2's fcntl doesn't have this one; this is the Linux value
+F_DUPFD_CLOEXEC = 1030
+
+_libc = None
+_can_posix_spawn = None
+
+_devnull = None
+_devnull_lock = threading.Lock()
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+def can_set_affinity():
+    """Can we pin children to CPUs (see the cpus argument of Popen)?"""
+    return sys.platform.startswith('linux')
+
+def can_set_ionice():
+    """Can we set the I/O priority of children (see the ionice argument of
+    Popen)?
+    """
+    return (sys.platform.startswith('linux') and
+            platform.machine() in IOPRIO_SET_SYSCALLS)
+
+def set_affinity(cpus, pid=0):
+    """Restrict a process (0 means this one) to a list of CPU numbers."""
+    libc = _get_libc()
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    mask = (ctypes.c_ulong * (max(cpus) // bits + 1))()
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+    if libc.sched_setaffinity(pid, ctypes.sizeof(mask), mask) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+def get_affinity(pid=0):
+    """Get the list of CPU numbers that a process (0 means this one) can
+    run on.
+    """
+    libc = _get_libc()
+    mask = (ctypes.c_ulong * 16)() # 1024 CPUs
+    if libc.sched_getaffinity(pid, ctypes.sizeof(mask), mask) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    return [cpu for cpu in xrange(len(mask) * bits)
+            if mask[cpu // bits] & (1 << (cpu % bits))]
+
+def set_nice(level, pid=0):
+    """Set the nice level of a process (0 means this one)."""
+    libc = _get_libc()
+    if libc.setpriority(PRIO_PROCESS, pid, level) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+def set_ionice(ioclass, level=0, pid=0):
+    """Set the I/O scheduling class and level (0-7, lower is more
+    important) of a process (0 means this one).
+    """
+    libc = _get_libc()
+    if libc.syscall(IOPRIO_SET_SYSCALLS[platform.machine()],
+                    IOPRIO_WHO_PROCESS, pid,
+                    (ioclass << IOPRIO_CLASS_SHIFT) | level) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+def can_posix_spawn():
+    """Can we start children with posix_spawn() (see use_posix_spawn)?
+
+    glibc only reports exec errors from posix_spawn() since 2.24.
+    """
+    global _can_posix_spawn
+    if _can_posix_spawn is None:
+        _can_posix_spawn = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = _get_libc()
+                libc.gnu_get_libc_version.restype = ctypes.c_char_p
+                version = tuple(int(part) for part in
+                                libc.gnu_get_libc_version().split('.')[:2])
+                _can_posix_spawn = (version >= (2, 24) and
+                                    hasattr(libc, 'posix_spawnp'))
+            except (OSError, AttributeError, ValueError):
+                logger.info("can't use posix_spawn()", exc_info=True)
+    return _can_posix_spawn
+
+def _encode_arg(arg):
+    if isinstance(arg, unicode):
+        return arg.encode(sys.getfilesystemencoding() or 'utf-8')
+    if not isinstance(arg, str):
+        # same as exec*() after fork()
+        raise TypeError('expected a string, got %r' % (arg,))
+    return arg
+
+def posix_spawn(args, executable=None, env=None, fds=()):
+    """Start a program with posix_spawnp().
+
+    :param args: the command line
+    :param executable: program to run, instead of args[0]
+    :param env: environment dict; None means ours
+    :param fds: list of (fd, child_fd) tuples; the child gets each fd as
+    child_fd.  It doesn't inherit any close-on-exec file descriptors
+    besides those.
+    :returns: the child's pid
+    :raises: OSError if the program can't be started
+    """
+    libc = _get_libc()
+    args = [_encode_arg(arg) for arg in args]
+    if executable is None:
+        executable = args[0]
+    if env is None:
+        env = os.environ
+    argv = (ctypes.c_char_p * (len(args) + 1))(*args)
+    envp = (ctypes.c_char_p * (len(env) + 1))(
+        *['%s=%s' % (_encode_arg(key), _encode_arg(value))
+          for key, value in env.items()])
+    actions = ctypes.create_string_buffer(SPAWN_FILE_ACTIONS_SIZE)
+    _check_spawn(libc.posix_spawn_file_actions_init(actions))
+    temp_fds = []
+    try:
+        for fd, child_fd in fds:
+            # Go through a close-on-exec copy above 2, so that the dup2()
+            # in the child always makes a new descriptor without
+            # close-on-exec (even if fd == child_fd), and so that the
+            # stdio descriptors can't overwrite each other.
+            temp_fd = fcntl.fcntl(fd, F_DUPFD_CLOEXEC, 3)
+            temp_fds.append(temp_fd)
+            _check_spawn(libc.posix_spawn_file_actions_adddup2(
+                    actions, temp_fd, child_fd))
+        pid = ctypes.c_int()
+        _check_spawn(libc.posix_spawnp(ctypes.byref(pid),
+                                       _encode_arg(executable), actions,
+                                       None, argv, envp))
+        return pid.value
+    finally:
+        libc.posix_spawn_file_actions_destroy(actions)
+        for fd in temp_fds:
+            os.close(fd)
+
+def _check_spawn(result):
+    # the posix_spawn functions return an error number, rather than setting
+    # errno
+    if result != 0:
+        raise OSError(result, os.strerror(result))
+
+def _get_devnull():
+    """Get a file open on os.devnull, for children's stdin.
+
+    It's shared by all children, so that we don't open a new one for each.
+    """
+    global _devnull
+    with _devnull_lock:
+        if _devnull is None:
+            _devnull = open(os.devnull, 'rb')
+        return _devnull
+
 def default_popen_args():
     retval = {
-        'stdin': open(os.devnull, 'rb'),
+        'stdin': _get_devnull(),
         'stdout': subprocess.PIPE,
         'stderr': subprocess.STDOUT,
     }
@@ -20,6 +230,36 @@ def default_popen_args():
         retval['startupinfo'].dwFlags |= subprocess.STARTF_USESHOWWINDOW
     return retval
 
+def _set_inheritable(fd, inheritable):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    if inheritable:
+        flags &= ~fcntl.FD_CLOEXEC
+    else:
+        flags |= fcntl.FD_CLOEXEC
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+
+def can_pass_fds():
+    """Can we hand extra file descriptors to a child (see Popen.pass_fds)?"""
+    return fcntl is not None
+
+def can_suspend():
+    """Can we suspend and resume children (see Popen.suspend())?"""
+    return hasattr(signal, 'SIGSTOP')
+
+def child_pipe():
+    """Create a pipe for a child process to write to.
+
+    Both ends are close-on-exec, so other children that get started at the
+    same time don't keep the write end open.  Pass the write end in the
+    pass_fds argument of Popen to let the child inherit it.
+
+    :returns: (read_fd, write_fd) tuple
+    """
+    read_fd, write_fd = os.pipe()
+    _set_inheritable(read_fd, False)
+    _set_inheritable(write_fd, False)
+    return read_fd, write_fd
+
 class Popen(subprocess.Popen):
     """subprocess.Popen subclass that adds MVC default behavior.
 
@@ -31,19 +271,217 @@ class Popen(subprocess.Popen):
 
     These are just defaults though, they can be overriden by passing different
     values to the constructor
+
+    pass_fds works like in the python 3 version of subprocess: it's a list of
+    file descriptors that stay open in the child (POSIX only).
+
+    nice, ionice and cpus set how the child gets scheduled:
+      - nice gets added to our nice level.  On win32, a positive value
+        picks a lower priority class instead.
+      - ionice is an (IONICE_* class, level) tuple (Linux only)
+      - cpus is a list of CPU numbers to pin the child to (Linux only)
+    ionice and cpus get ignored where they aren't supported.
+
+    After wait() returns, started_at and ended_at hold the wall-clock times
+    the child ran between.  On platforms that have os.wait4(), rusage holds
+    the resource usage of the child (otherwise it's None).
+
+    spawned is True if the child was started with posix_spawn() rather than
+    fork() (see use_posix_spawn).
     """
-    def __init__(self, commandline, **kwargs):
+    def __init__(self, commandline, pass_fds=(), nice=None, ionice=None,
+                 cpus=None, **kwargs):
         final_args = default_popen_args()
         final_args.update(kwargs)
+        self.spawned = False
+        if pass_fds and not can_pass_fds():
+            raise ValueError("pass_fds is not supported on this platform")
+        if ionice is not None and not can_set_ionice():
+            logger.warn("can't set I/O priorities on this platform")
+            ionice = None
+        if cpus is not None and not can_set_affinity():
+            logger.warn("can't set CPU affinity on this platform")
+            cpus = None
+        if nice and sys.platform == 'win32':
+            final_args['creationflags'] = (
+                final_args.get('creationflags', 0) |
+                (IDLE_PRIORITY_CLASS if nice >= 15
+                 else BELOW_NORMAL_PRIORITY_CLASS))
+            nice = None
+        self._use_spawn = (use_posix_spawn and can_posix_spawn() and
+                           not final_args.get('preexec_fn') and
+                           not final_args.get('close_fds') and
+                           final_args.get('cwd') is None and
+                           not final_args.get('shell'))
+        self._pass_fds = list(pass_fds)
+        self._scheduling = (nice, ionice, cpus)
+        if not self._use_spawn and (pass_fds or nice or ionice is not None or
+                                    cpus is not None):
+            if ionice is not None or cpus is not None:
+                # load libc now, rather than in the child
+                _get_libc()
+            final_args['preexec_fn'] = self._make_preexec_fn(
+                pass_fds, nice, ionice, cpus, final_args.get('preexec_fn'))
+        self.rusage = None
+        self.started_at = time.time()
+        self.ended_at = None
         subprocess.Popen.__init__(self, commandline, **final_args)
 
+    def _execute_child(self, args, executable, preexec_fn, close_fds, cwd,
+                       env, universal_newlines, startupinfo, creationflags,
+                       shell, to_close, p2cread, p2cwrite, c2pread, c2pwrite,
+                       errread, errwrite):
+        if not self._use_spawn:
+            return subprocess.Popen._execute_child(
+                self, args, executable, preexec_fn, close_fds, cwd, env,
+                universal_newlines, startupinfo, creationflags, shell,
+                to_close, p2cread, p2cwrite, c2pread, c2pwrite, errread,
+                errwrite)
+        if isinstance(args, basestring):
+            args = [args]
+        if executable is not None:
+            args = [executable] + list(args[1:])
+        fds = [(fd, child_fd) for fd, child_fd in
+               ((p2cread, 0), (c2pwrite, 1), (errwrite, 2))
+               if fd is not None]
+        fds.extend((fd, fd) for fd in self._pass_fds)
+        try:
+            self.pid = posix_spawn(args, env=env, fds=fds)
+            self._child_created = True
+            self.spawned = True
+        finally:
+            # close the child's ends of the pipes, like subprocess does
+            for fd, other_end in ((p2cread, p2cwrite), (c2pwrite, c2pread),
+                                  (errwrite, errread)):
+                if fd is not None and other_end is not None:
+                    os.close(fd)
+                    to_close.remove(fd)
+        self._set_scheduling(*self._scheduling)
+
+    def _set_scheduling(self, nice, ionice, cpus):
+        """Give a posix_spawn()ed child the scheduling that preexec_fn would
+        after fork().
+
+        The child starts out with ours, for the moment it takes us to get
+        here after it exec()s.  That's long before ffmpeg starts any
+        threads, which would keep the old settings.
+        """
+        try:
+            if nice:
+                set_nice(os.nice(0) + nice, self.pid)
+            if ionice is not None:
+                set_ionice(ionice[0], ionice[1], self.pid)
+            if cpus is not None:
+                set_affinity(cpus, self.pid)
+        except OSError, e:
+            if e.errno == errno.ESRCH:
+                return # it's already gone
+            # same as an error in preexec_fn: no child, and the constructor
+            # raises
+            os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+            self._child_created = False
+            raise
+
+    def wait(self):
+        if hasattr(os, 'wait4'):
+            self._wait4()
+        returncode = subprocess.Popen.wait(self)
+        if self.ended_at is None:
+            self.ended_at = time.time()
+        return returncode
+
+    def _wait4(self):
+        # Same as subprocess.Popen.wait(), but reap the child with wait4() so
+        # that we get its resource usage.
+        while self.returncode is None:
+            try:
+                pid, sts, rusage = os.wait4(self.pid, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                # Someone else reaped the child (for example another thread
+                # in wait()).  We can't get the status.
+                pid, sts, rusage = self.pid, 0, None
+            if pid == self.pid:
+                if rusage is not None:
+                    self.rusage = rusage
+                    self.ended_at = time.time()
+                self._handle_exitstatus(sts)
+
+    def suspend(self):
+        """Stop the child from running until resume() gets called (POSIX
+        only).
+        """
+        self._signal_if_running(signal.SIGSTOP)
+
+    def resume(self):
+        self._signal_if_running(signal.SIGCONT)
+
+    def _signal_if_running(self, signum):
+        if self.returncode is not None:
+            return
+        try:
+            self.send_signal(signum)
+        except OSError, e:
+            # the child already exited, but hasn't been reaped yet
+            if e.errno != errno.ESRCH:
+                raise
+
+    def get_resource_usage(self):
+        """Get a dict describing the resources the child used.
+
+        Keys are wall, user and system (seconds), max_rss, read_bytes and
+        write_bytes (bytes).  Only wall is there if we don't have rusage.
+        The byte counts come from the block I/O counters, so reads served
+        from the page cache aren't included.
+        """
+        usage = {}
+        if self.ended_at is not None:
+            usage['wall'] = self.ended_at - self.started_at
+        if self.rusage is not None:
+            max_rss = self.rusage.ru_maxrss
+            if sys.platform != 'darwin':
+                max_rss *= 1024 # linux/BSD report it in kilobytes
+            usage.update({
+                'user': self.rusage.ru_utime,
+                'system': self.rusage.ru_stime,
+                'max_rss': max_rss,
+                # block counts are in 512-byte units
+                'read_bytes': self.rusage.ru_inblock * 512,
+                'write_bytes': self.rusage.ru_oublock * 512,
+            })
+        return usage
+
+    @staticmethod
+    def _make_preexec_fn(pass_fds, nice, ionice, cpus, preexec_fn):
+        # errors in here get raised by the constructor in the parent
+        def preexec():
+            for fd in pass_fds:
+                _set_inheritable(fd, True)
+            if nice:
+                os.nice(nice)
+            if ionice is not None:
+                set_ionice(*ionice)
+            if cpus is not None:
+                set_affinity(cpus)
+            if preexec_fn is not None:
+                preexec_fn()
+        return preexec
+
 def check_output(commandline, **kwargs):
     """MVC version of subprocess.check_output.
 
     This performs the same default behavior as the Popen class.
     """
-    final_args = default_popen_args()
-    # check_output doesn't use stdout
-    del final_args['stdout']
-    final_args.update(kwargs)
-    return subprocess.check_output(commandline, **final_args)
+    if 'stdout' in kwargs:
+        raise ValueError('stdout argument not allowed, it will be '
+                         'overridden.')
+    popen = Popen(commandline, **kwargs)
+    output = popen.communicate()[0]
+    if popen.returncode:
+        raise CalledProcessError(popen.returncode, commandline,
+                                 output=output)
+    return output
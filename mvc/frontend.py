@@ -0,0 +1,57 @@
+"""frontend.py -- What the conversion core needs from the front end.
+
+The core (converter, conversion, video, settings) doesn't import a widget
+toolkit, so that the console and other front ends without one start
+quickly.  The few things it needs from the front end go through the
+functions here, which the front end replaces by calling install().
+
+Without install(), callbacks run right away in the thread that asked for
+them, and conversions go to the platform's usual place (the desktop).
+"""
+
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+def call_now(callback, periodic=None):
+    """idle_add() for front ends without a main loop."""
+    if periodic is not None:
+        raise ValueError("can't run periodic callbacks without a main loop")
+    callback()
+
+def get_default_conversion_directory():
+    if sys.platform == 'win32':
+        from mvc.windows import specialfolders
+        return specialfolders.non_video_directory
+    return os.path.expanduser('~/Desktop')
+
+_idle_add = call_now
+_get_conversion_directory = get_default_conversion_directory
+
+def install(idle_add=None, get_conversion_directory=None):
+    """Set the front end's functions.
+
+    :param idle_add: function(callback, periodic=None) that runs callback
+    in the front end's main loop (every periodic seconds, if that's given)
+    :param get_conversion_directory: function that returns the default
+    directory for converted files
+    """
+    global _idle_add, _get_conversion_directory
+    if idle_add is not None:
+        _idle_add = idle_add
+    if get_conversion_directory is not None:
+        _get_conversion_directory = get_conversion_directory
+
+def idle_add(callback, periodic=None):
+    return _idle_add(callback, periodic)
+
+def get_conversion_directory():
+    return _get_conversion_directory()
+
+def create_conversion_directory():
+    try:
+        os.makedirs(get_conversion_directory())
+    except EnvironmentError, e:
+        logger.info('os.makedirs: %s', str(e))
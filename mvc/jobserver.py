@@ -0,0 +1,187 @@
+"""jobserver.py -- Share a make -j limit with the build that runs us.
+
+When make runs with -jN, it hands out N-1 tokens through a pipe (or, since
+make 4.4, a named FIFO), and tells its children where to find them in
+MAKEFLAGS.  Each child also has one implicit token, which it holds just by
+running.  Before it starts a job of its own, a jobserver client reads a
+token, and it writes the token back when the job finishes.
+
+With a JobServerClient, the conversions take a token before each converter
+process starts.  That way a batch of conversions stays within the -j limit
+of the build it's part of, instead of running on top of it.
+
+make only passes the jobserver to commands that it knows run make, so the
+rule that runs MVC has to start with a + (or mention $(MAKE)).
+"""
+
+import errno
+import logging
+import os
+import select
+import stat
+import threading
+
+logger = logging.getLogger(__name__)
+
+# the token that we hold by running; it never goes through the pipe
+IMPLICIT_TOKEN = object()
+
+# how often a blocked acquire() checks whether it was cancelled
+POLL_INTERVAL = 0.5
+
+def parse_makeflags(makeflags):
+    """Find the jobserver in a MAKEFLAGS value.
+
+    :returns: ('fds', read_fd, write_fd), ('fifo', path), or None if there's
+    no jobserver
+    """
+    for flag in makeflags.split():
+        for prefix in ('--jobserver-auth=', '--jobserver-fds='):
+            if not flag.startswith(prefix):
+                continue
+            value = flag[len(prefix):]
+            if value.startswith('fifo:'):
+                return ('fifo', value[len('fifo:'):])
+            try:
+                read_fd, write_fd = [int(fd) for fd in value.split(',')]
+            except ValueError:
+                logger.warn("can't parse jobserver flag %r", flag)
+                return None
+            if read_fd < 0 or write_fd < 0:
+                # make -j without a jobserver
+                return None
+            return ('fds', read_fd, write_fd)
+    return None
+
+def _is_fifo(fd):
+    try:
+        return stat.S_ISFIFO(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+class JobServerClient(object):
+    """Takes tokens from a make jobserver.
+
+    acquire() and release() are safe to call from several threads.
+
+    :param read_fd: file descriptor to read tokens from
+    :param write_fd: file descriptor to give tokens back through
+    """
+    def __init__(self, read_fd, write_fd):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.lock = threading.Lock()
+        self.implicit_free = True
+        # tokens we read and haven't given back
+        self.held = []
+        # file descriptors that we opened, and close in close()
+        self.opened_fds = []
+
+    @classmethod
+    def from_environment(cls, environ=None):
+        """Connect to the jobserver in MAKEFLAGS.
+
+        :returns: a JobServerClient, or None if make didn't give us one
+        """
+        if environ is None:
+            environ = os.environ
+        auth = parse_makeflags(environ.get('MAKEFLAGS', ''))
+        if auth is None:
+            return None
+        if auth[0] == 'fifo':
+            try:
+                fd = os.open(auth[1], os.O_RDWR | os.O_NONBLOCK)
+            except OSError:
+                logger.warn("can't open the jobserver FIFO %r", auth[1],
+                            exc_info=True)
+                return None
+            client = cls(fd, fd)
+            client.opened_fds.append(fd)
+            return client
+        read_fd, write_fd = auth[1:]
+        if not (_is_fifo(read_fd) and _is_fifo(write_fd)):
+            logger.warn('MAKEFLAGS has a jobserver, but we were not given '
+                        'its pipe (does the make rule start with +?)')
+            return None
+        # Reads have to be non-blocking, because another client can take
+        # the token between select() and read().  Setting O_NONBLOCK on
+        # make's file descriptor would change it for make and every other
+        # client too, so open the pipe again (on Linux) to get our own.
+        try:
+            own_fd = os.open('/proc/self/fd/%i' % read_fd,
+                             os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            logger.info("can't reopen the jobserver pipe; using blocking "
+                        "reads")
+            return cls(read_fd, write_fd)
+        client = cls(own_fd, write_fd)
+        client.opened_fds.append(own_fd)
+        return client
+
+    def _take_implicit(self):
+        with self.lock:
+            if self.implicit_free:
+                self.implicit_free = False
+                return True
+            return False
+
+    def acquire(self, cancelled=None):
+        """Take a token, waiting for one if needed.
+
+        :param cancelled: function that returns True if we should stop
+        waiting
+        :returns: the token, or None if cancelled
+        """
+        while True:
+            if self._take_implicit():
+                return IMPLICIT_TOKEN
+            if cancelled is not None and cancelled():
+                return None
+            try:
+                readable = select.select([self.read_fd], [], [],
+                                         POLL_INTERVAL)[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                continue
+            try:
+                token = os.read(self.read_fd, 1)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    # someone else got it first
+                    continue
+                raise
+            if not token:
+                raise IOError('the jobserver closed its pipe')
+            with self.lock:
+                self.held.append(token)
+            return token
+
+    def release(self, token):
+        """Give back a token that acquire() returned."""
+        if token is IMPLICIT_TOKEN:
+            with self.lock:
+                self.implicit_free = True
+            return
+        with self.lock:
+            self.held.remove(token)
+        os.write(self.write_fd, token)
+
+    def close(self):
+        """Give back the tokens we're still holding, and disconnect.
+
+        make complains if a child exits without returning its tokens.
+        """
+        with self.lock:
+            held, self.held = self.held, []
+        for token in held:
+            try:
+                os.write(self.write_fd, token)
+            except OSError:
+                logger.warn("can't give back a jobserver token",
+                            exc_info=True)
+        for fd in self.opened_fds:
+            os.close(fd)
+        self.opened_fds = []
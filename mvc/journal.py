@@ -0,0 +1,171 @@
+"""journal.py -- Remember conversion jobs across restarts.
+
+The ConversionManager records each job it's given, and every state change
+of it, in a SQLite database.  Each change is committed before the manager
+moves on.  If the process dies in the middle of a batch, the next run can
+see which jobs never finished, and do the following:
+
+- delete the temporary outputs they left behind
+- queue them again
+- skip the jobs that did finish
+
+States: 'waiting' (queued, not started), 'converting', 'finished',
+'failed' and 'canceled'.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED_STATES = ('waiting', 'converting')
+
+# what the journal raises when the database can't be read or written
+Error = sqlite3.Error
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER PRIMARY KEY,
+    input TEXT NOT NULL,
+    converter TEXT NOT NULL,
+    output TEXT NOT NULL,
+    temp_output TEXT,
+    state TEXT NOT NULL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_state ON job (state);
+CREATE INDEX IF NOT EXISTS job_input ON job (input, converter);
+CREATE TABLE IF NOT EXISTS transition (
+    job_id INTEGER NOT NULL REFERENCES job (id),
+    state TEXT NOT NULL,
+    time REAL NOT NULL
+);
+"""
+
+class Job(object):
+    """A row of the journal."""
+    def __init__(self, id, input, converter, output, temp_output, state,
+                 error):
+        self.id = id
+        self.input = input
+        self.converter = converter
+        self.output = output
+        self.temp_output = temp_output
+        self.state = state
+        self.error = error
+
+    def __repr__(self):
+        return '<Job %i %s %r -> %r>' % (self.id, self.state, self.input,
+                                         self.output)
+
+class JobJournal(object):
+    """Write-ahead journal of conversion jobs.
+
+    :param path: SQLite database file; it gets created if needed
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # filenames are often byte strings that aren't valid UTF-8; store
+        # them as they are
+        self.connection.text_factory = str
+        try:
+            # WAL keeps a commit to a couple of appends and an fsync
+            self.connection.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            logger.warn("can't use WAL mode for %r", path, exc_info=True)
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def add(self, input, converter, output, state='waiting'):
+        """Record a new job.
+
+        :returns: the job id
+        """
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                cursor = self.connection.execute(
+                    'INSERT INTO job (input, converter, output, state, '
+                    'created, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                    (input, converter, output, state, now, now))
+                job_id = cursor.lastrowid
+                self.connection.execute(
+                    'INSERT INTO transition (job_id, state, time) '
+                    'VALUES (?, ?, ?)', (job_id, state, now))
+        return job_id
+
+    def update(self, job_id, state, error=None, temp_output=None):
+        """Record a state change of a job."""
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                if temp_output is not None:
+                    self.connection.execute(
+                        'UPDATE job SET state=?, error=?, temp_output=?, '
+                        'updated=? WHERE id=?',
+                        (state, error, temp_output, now, job_id))
+                else:
+                    self.connection.execute(
+                        'UPDATE job SET state=?, error=?, updated=? '
+                        'WHERE id=?', (state, error, now, job_id))
+                self.connection.execute(
+                    'INSERT INTO transition (job_id, state, time) '
+                    'VALUES (?, ?, ?)', (job_id, state, now))
+
+    def _jobs(self, where, args=()):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, input, converter, output, temp_output, state, '
+                'error FROM job WHERE ' + where + ' ORDER BY id',
+                args).fetchall()
+        return [Job(*row) for row in rows]
+
+    def get(self, job_id):
+        jobs = self._jobs('id=?', (job_id,))
+        return jobs[0] if jobs else None
+
+    def unfinished(self):
+        """Get the jobs that were queued or running when we last stopped."""
+        return self._jobs('state IN (%s)' % ', '.join(
+                ['?'] * len(UNFINISHED_STATES)), UNFINISHED_STATES)
+
+    def is_finished(self, input, converter, output):
+        """Did a job for this input, converter and output finish, and is
+        the output still there?
+        """
+        for job in self._jobs('input=? AND converter=? AND state=?',
+                              (input, converter, 'finished')):
+            if job.output == output and os.path.exists(output):
+                return True
+        return False
+
+    def transitions(self, job_id):
+        """Get the (state, time) history of a job."""
+        with self.lock:
+            return self.connection.execute(
+                'SELECT state, time FROM transition WHERE job_id=? '
+                'ORDER BY rowid', (job_id,)).fetchall()
+
+    def clean_up(self, job):
+        """Delete what an interrupted job left behind."""
+        if job.temp_output and os.path.exists(job.temp_output):
+            logger.info('removing orphaned temp output %r', job.temp_output)
+            try:
+                os.unlink(job.temp_output)
+            except EnvironmentError:
+                logger.warn('error removing %r', job.temp_output,
+                            exc_info=True)
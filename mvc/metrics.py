@@ -0,0 +1,213 @@
+"""metrics.py -- Time the stages of a conversion.
+
+Each conversion goes through a few stages: probing the input
+(get_media_info()), waiting in the queue, one or more converter passes,
+finalizing the output (moving it into place, qtfaststart) and making a
+thumbnail.  We keep a latency histogram for every stage, which can be
+exported in the Prometheus text format (optionally served over HTTP on a
+local port) or as JSON.
+"""
+
+import BaseHTTPServer
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the histogram buckets.  Probing and staging
+# usually take well under a second, passes can take hours.
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300,
+                   900, 3600, 14400)
+
+class Histogram(object):
+    """Counts observations in cumulative buckets, Prometheus style."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative_counts(self):
+        """Get (upper bound, count of values <= bound) tuples."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'buckets': [[bound, count] for bound, count
+                            in self.cumulative_counts()]}
+
+def _format_number(value):
+    if isinstance(value, float) and value == int(value):
+        value = int(value)
+    return repr(value)
+
+class StageMetrics(object):
+    """Latency histograms for each conversion stage.
+
+    observe() can be called from any thread.  Conversions time their
+    stages with Conversion.stage(), which also puts them in the trace.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram(self.buckets)
+            self.histograms[stage].observe(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def to_dict(self):
+        with self.lock:
+            return dict((stage, histogram.to_dict())
+                        for stage, histogram in self.histograms.iteritems())
+
+    def to_json(self):
+        return json.dumps({'time': time.time(), 'stages': self.to_dict()},
+                          sort_keys=True)
+
+    def to_prometheus(self):
+        """Get the histograms in the Prometheus text exposition format."""
+        lines = ['# HELP mvc_stage_seconds Time spent in each stage of a '
+                 'conversion.',
+                 '# TYPE mvc_stage_seconds histogram']
+        stages = self.to_dict()
+        for stage in sorted(stages):
+            histogram = stages[stage]
+            for bound, count in histogram['buckets']:
+                lines.append('mvc_stage_seconds_bucket{stage="%s",le="%s"} %i'
+                             % (stage, _format_number(bound), count))
+            lines.append('mvc_stage_seconds_bucket{stage="%s",le="+Inf"} %i'
+                         % (stage, histogram['count']))
+            lines.append('mvc_stage_seconds_sum{stage="%s"} %s' % (
+                    stage, _format_number(histogram['sum'])))
+            lines.append('mvc_stage_seconds_count{stage="%s"} %i' % (
+                    stage, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Write the histograms as JSON to path.
+
+        The file gets replaced atomically, so a reader never sees a partial
+        dump.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.to_json())
+            if os.name == 'nt' and os.path.exists(path):
+                os.unlink(path)
+            os.rename(temp_path, path)
+        except:
+            os.unlink(temp_path)
+            raise
+
+# the metrics for this process
+stages = StageMetrics()
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] == '/metrics':
+            body = self.server.metrics.to_prometheus()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path.split('?', 1)[0] == '/metrics.json':
+            body = self.server.metrics.to_json()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('metrics: ' + format, *args)
+
+class MetricsServer(BaseHTTPServer.HTTPServer):
+    """Serves /metrics (Prometheus text) and /metrics.json from a daemon
+    thread.
+
+    :param port: port to listen on; 0 picks a free one (see server_port)
+    :param host: interface to listen on.  This defaults to localhost,
+    since there's no authentication.
+    """
+    def __init__(self, port, metrics=None, host='127.0.0.1'):
+        if metrics is None:
+            metrics = stages
+        self.metrics = metrics
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port),
+                                           _MetricsHandler)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name='Metrics server')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class MetricsDumper(object):
+    """Periodically writes the metrics as JSON to a file.
+
+    stop() writes one last dump, so the file ends up with the final numbers.
+    """
+    def __init__(self, path, interval=10, metrics=None):
+        if metrics is None:
+            metrics = stages
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._thread,
+                                       name='Metrics dumper')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _thread(self):
+        while not self.stopping.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        try:
+            self.metrics.dump(self.path)
+        except EnvironmentError:
+            logger.warn('error writing metrics to %r', self.path,
+                        exc_info=True)
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.dump()
@@ -0,0 +1,203 @@
+"""presets.py -- Converter presets defined as data.
+
+Device presets live in JSON files in resources/converters.  Each file has
+optional "defaults" that apply to all of its presets, a list of
+unbranded "presets", and a list of "brands", each with its own presets::
+
+    {"defaults": {"media_type": "apple", "extension": "mp4",
+                  "parameters": "-ac 2 -f mp4", "video_encoders": "h264",
+                  "audio_encoders": "aac"},
+     "presets": [{"name": "iPad", "size": [1024, 768]}],
+     "brands": [{"brand": "Acme", "presets": [...]}]}
+
+compile_presets() turns the files into a flat list of entries, with the
+defaults merged in, the parameters split into argument lists and the
+names checked.  PresetCache keeps the compiled list in a single file,
+along with the size and mtime of every source file.  As long as none of
+the sources change, startup reads that one file instead of parsing them
+all.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+from mvc import basicconverters
+from mvc import converter
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+# what "class" can be in a preset
+CLASSES = {
+    'ffmpeg': converter.FFmpegConverterInfo,
+    'ffmpeg2theora': converter.FFmpeg2TheoraConverterInfo,
+}
+
+# what "video_encoders" and "audio_encoders" can be
+ENCODER_LISTS = {
+    'h264': basicconverters.H264_ENCODERS,
+    'h264_baseline': basicconverters.H264_BASELINE_ENCODERS,
+    'mp4_video': basicconverters.MP4_VIDEO_ENCODERS,
+    'aac': basicconverters.AAC_ENCODERS,
+    'vp8': basicconverters.VP8_ENCODERS,
+}
+
+# what "simple" can be: the converter class to switch to when the user
+# customizes a preset
+SIMPLE_CLASSES = {
+    'mp4': basicconverters.MP4,
+}
+
+FIELDS = ('name', 'class', 'media_type', 'extension', 'parameters', 'size',
+          'audio_only', 'bitrate', 'video_encoders', 'audio_encoders',
+          'simple')
+
+class PresetError(ValueError):
+    """A preset file is broken."""
+
+def _compile_preset(path, preset, defaults, brand):
+    entry = dict(defaults)
+    entry.update(preset)
+    unknown = set(entry) - set(FIELDS)
+    if unknown:
+        raise PresetError('%s: unknown fields %s' % (
+                path, ', '.join(sorted(unknown))))
+    if 'name' not in entry:
+        raise PresetError('%s: preset without a name' % path)
+    class_name = entry.pop('class', 'ffmpeg')
+    if class_name not in CLASSES:
+        raise PresetError('%s: %s: unknown class %r' % (
+                path, entry['name'], class_name))
+    for key, table in (('video_encoders', ENCODER_LISTS),
+                       ('audio_encoders', ENCODER_LISTS),
+                       ('simple', SIMPLE_CLASSES)):
+        if entry.get(key) is not None and entry[key] not in table:
+            raise PresetError('%s: %s: unknown %s %r' % (
+                    path, entry['name'], key, entry[key]))
+    parameters = entry.get('parameters', '')
+    if isinstance(parameters, basestring):
+        parameters = parameters.split()
+    width, height = entry.pop('size', (None, None))
+    entry.update({'class': class_name, 'parameters': list(parameters),
+                  'width': width, 'height': height, 'brand': brand})
+    return entry
+
+def load_preset_file(path):
+    """Compile the presets in one file.
+
+    :returns: list of compiled entries (dicts)
+    :raises: PresetError, or EnvironmentError if the file can't be read
+    """
+    with open(path, 'rb') as f:
+        try:
+            data = json.load(f)
+        except ValueError, e:
+            raise PresetError('%s: %s' % (path, e))
+    defaults = data.get('defaults', {})
+    entries = [_compile_preset(path, preset, defaults, None)
+               for preset in data.get('presets', [])]
+    for brand in data.get('brands', []):
+        entries.extend(_compile_preset(path, preset, defaults,
+                                       brand['brand'])
+                       for preset in brand['presets'])
+    return entries
+
+def compile_presets(paths):
+    """Compile the presets in several files.
+
+    Files that can't be loaded are logged and skipped.
+    """
+    entries = []
+    for path in paths:
+        try:
+            file_entries = load_preset_file(path)
+        except (EnvironmentError, PresetError):
+            logger.exception('error loading presets from %r', path)
+            continue
+        logger.info('compiled %i presets from %r', len(file_entries), path)
+        entries.extend(file_entries)
+    return entries
+
+def make_converter(entry):
+    """Create the ConverterInfo for a compiled entry."""
+    converter_info = CLASSES[entry['class']](entry['name'], entry['width'],
+                                             entry['height'])
+    converter_info.media_type = entry.get('media_type')
+    converter_info.extension = entry.get('extension')
+    converter_info.parameters = entry['parameters']
+    if entry.get('audio_only'):
+        converter_info.audio_only = True
+    if entry.get('bitrate'):
+        converter_info.bitrate = entry['bitrate']
+    for key in ('video_encoders', 'audio_encoders'):
+        if entry.get(key) is not None:
+            setattr(converter_info, key, ENCODER_LISTS[entry[key]])
+    if entry.get('simple') is not None:
+        converter_info.simple = SIMPLE_CLASSES[entry['simple']]
+    return converter_info
+
+class PresetCache(object):
+    """Compiled presets, stored in a JSON file.
+
+    :param path: the cache file; None means don't cache
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def _stamps(paths):
+        stamps = []
+        for path in sorted(paths):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamps.append([os.path.abspath(path), st.st_mtime, st.st_size])
+        return stamps
+
+    def _load(self, stamps):
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+        except (EnvironmentError, ValueError):
+            logger.warn('error loading the preset cache %r', self.path,
+                        exc_info=True)
+            return None
+        if (data.get('version') != CACHE_VERSION or
+            data.get('sources') != stamps):
+            return None
+        return data.get('entries')
+
+    def _save(self, stamps, entries):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                json.dump({'version': CACHE_VERSION, 'sources': stamps,
+                           'entries': entries}, f)
+            if os.path.exists(self.path) and os.name == 'nt':
+                os.remove(self.path)
+            os.rename(temp_path, self.path)
+        except EnvironmentError:
+            logger.warn('error saving the preset cache %r', self.path,
+                        exc_info=True)
+
+    def get(self, paths, compile_presets=compile_presets):
+        """Get the compiled presets from paths, compiling them if the cache
+        is missing or out of date.
+        """
+        stamps = self._stamps(paths)
+        entries = self._load(stamps)
+        if entries is None:
+            entries = compile_presets(paths)
+            self._save(stamps, entries)
+        return entries
@@ -5,8 +5,9 @@ import sys
 def image_path(name):
     return os.path.join(resources_dir(), 'images', name)
 
-def converter_scripts():
-    return glob.glob(os.path.join(resources_dir(), 'converters', '*.py'))
+def preset_files():
+    return sorted(glob.glob(os.path.join(resources_dir(), 'converters',
+                                         '*.json')))
 
 
 def resources_dir():
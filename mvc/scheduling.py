@@ -0,0 +1,121 @@
+"""scheduling.py -- How conversion processes share the machine.
+
+A SchedulingClass says how a converter process should be scheduled: its
+nice level, its I/O priority, and how many CPUs to pin it to.  The
+ConversionManager picks a class for each conversion, either the one for
+the conversion's priority or the default for the whole queue.
+
+Pinned conversions get their CPUs from a CoreAllocator, which hands out
+separate groups of CPUs while there are free ones.  Two encoders on the
+same cores keep evicting each other's data from the caches; on separate
+groups, each keeps its own.
+"""
+
+import collections
+import logging
+import multiprocessing
+
+from mvc import execute
+
+logger = logging.getLogger(__name__)
+
+class SchedulingClass(object):
+    """How to schedule a converter process.
+
+    :param name: name for logs and the command line
+    :param nice: added to our nice level (see execute.Popen)
+    :param ionice: (execute.IONICE_* class, level) tuple
+    :param cores: how many CPUs to pin each conversion to; None means don't
+    pin
+    """
+    def __init__(self, name, nice=None, ionice=None, cores=None):
+        self.name = name
+        self.nice = nice
+        self.ionice = ionice
+        self.cores = cores
+
+    def __repr__(self):
+        return '<SchedulingClass %s nice=%r ionice=%r cores=%r>' % (
+            self.name, self.nice, self.ionice, self.cores)
+
+    def with_cores(self, cores):
+        """Get a copy of this class that pins to cores CPUs."""
+        return SchedulingClass(self.name, self.nice, self.ionice, cores)
+
+    def get_popen_args(self, cpus=None):
+        """Get the keyword arguments for execute.Popen.
+
+        :param cpus: the CPUs that the CoreAllocator gave the conversion
+        """
+        args = {}
+        if self.nice:
+            args['nice'] = self.nice
+        if self.ionice is not None:
+            args['ionice'] = self.ionice
+        if cpus is not None:
+            args['cpus'] = cpus
+        return args
+
+CLASSES = collections.OrderedDict([
+        ('normal', SchedulingClass('normal')),
+        # stays out of the way of the desktop, but still gets its share of
+        # the disk
+        ('background', SchedulingClass(
+                    'background', nice=10,
+                    ionice=(execute.IONICE_BEST_EFFORT, 7))),
+        # only runs when nothing else wants the CPU or the disk
+        ('idle', SchedulingClass('idle', nice=19,
+                                 ionice=(execute.IONICE_IDLE, 0))),
+        ])
+
+class CoreAllocator(object):
+    """Hands out groups of CPUs to pin conversions to.
+
+    The CPUs are split into groups of consecutive CPU numbers.  Each
+    allocation gets the group with the fewest conversions on it, so
+    conversions only share a group when there are more of them than
+    groups.
+
+    :param cpus: list of the CPU numbers to use; None means the ones that
+    we're allowed to run on
+    """
+    def __init__(self, cpus=None):
+        if cpus is None:
+            cpus = self.get_cpus()
+        self.cpus = sorted(cpus)
+        # tuple of CPUs -> how many conversions are using it
+        self.users = {}
+
+    @staticmethod
+    def get_cpus():
+        if execute.can_set_affinity():
+            try:
+                return execute.get_affinity()
+            except OSError:
+                logger.warn("can't get our CPU affinity", exc_info=True)
+        try:
+            return range(multiprocessing.cpu_count())
+        except NotImplementedError:
+            return [0]
+
+    def allocate(self, cores):
+        """Get a list of cores CPUs to pin a conversion to.
+
+        :returns: list of CPU numbers, or None if there's no point in
+        pinning (cores is as many as we have)
+        """
+        if cores >= len(self.cpus):
+            return None
+        groups = [tuple(self.cpus[start:start + cores])
+                  for start in xrange(0, len(self.cpus) - cores + 1, cores)]
+        group = min(groups, key=lambda g: (self.users.get(g, 0), g))
+        self.users[group] = self.users.get(group, 0) + 1
+        return list(group)
+
+    def release(self, cpus):
+        """Give back CPUs that allocate() returned."""
+        group = tuple(cpus)
+        if self.users.get(group, 0) <= 1:
+            self.users.pop(group, None)
+        else:
+            self.users[group] -= 1
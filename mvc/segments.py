@@ -0,0 +1,154 @@
+"""segments.py -- Checkpoints for conversions that run in segments.
+
+A long conversion can be split into fixed-length time segments.  Each
+segment gets encoded into a scratch directory on its own, and the segments
+are joined at the end.  Each finished segment gets recorded in a manifest.
+When the conversion is retried, or resumed after a restart, it only
+encodes the segments that are missing.
+
+The scratch directory is named after the job (input, converter, output and
+the converter arguments), so a retry of the same job finds it again.  If
+the arguments change, the old segments are useless and get thrown away.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'segments.json'
+
+def job_key(*parts):
+    """Get a short, filename-safe key for a job."""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf8')
+        digest.update(part)
+        digest.update('\0')
+    return digest.hexdigest()[:16]
+
+def plan_segments(duration, segment_length):
+    """Split duration seconds into (index, start, length) tuples.
+
+    A short leftover at the end gets merged into the last segment, rather
+    than becoming a segment of its own.
+    """
+    count = max(int(math.floor(duration / segment_length)), 1)
+    if duration - count * segment_length > segment_length / 2.0:
+        count += 1
+    segments = []
+    for index in xrange(count):
+        start = index * segment_length
+        if index == count - 1:
+            length = duration - start
+        else:
+            length = segment_length
+        segments.append((index, start, length))
+    return segments
+
+class SegmentCheckpoint(object):
+    """Tracks the segments of one job in its scratch directory.
+
+    :param scratch_root: directory to put the job's scratch directory in
+    :param key: job key (see job_key())
+    :param extension: file extension for the segments
+    :param duration: length of the input in seconds
+    :param segment_length: seconds per segment
+    """
+    def __init__(self, scratch_root, key, extension, duration,
+                 segment_length):
+        self.key = key
+        self.directory = os.path.join(scratch_root, key)
+        self.extension = extension
+        self.segments = plan_segments(duration, segment_length)
+        self.manifest = {'key': key, 'duration': duration,
+                         'segment_length': segment_length, 'done': []}
+        self._load()
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    def _load(self):
+        try:
+            with open(self._manifest_path()) as f:
+                manifest = json.load(f)
+        except EnvironmentError:
+            manifest = None
+        except ValueError:
+            logger.warn('corrupt segment manifest in %r', self.directory)
+            manifest = None
+        if manifest is not None:
+            if all(manifest.get(key) == self.manifest[key]
+                   for key in ('key', 'duration', 'segment_length')):
+                self.manifest['done'] = [
+                    index for index in manifest.get('done', [])
+                    if os.path.exists(self.path(index))]
+                logger.info('resuming %s: %i of %i segments done',
+                            self.key, len(self.manifest['done']),
+                            len(self.segments))
+                return
+            logger.info('segment plan for %s changed; starting over',
+                        self.key)
+        self.remove()
+        os.makedirs(self.directory)
+
+    def _save(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(self.manifest, f)
+            if os.name == 'nt' and os.path.exists(self._manifest_path()):
+                os.unlink(self._manifest_path())
+            os.rename(temp_path, self._manifest_path())
+        except:
+            os.unlink(temp_path)
+            raise
+
+    def path(self, index):
+        """Where a finished segment lives."""
+        return os.path.join(self.directory, '%s-%05i.%s' % (
+                self.key, index, self.extension))
+
+    def partial_path(self, index):
+        """Where a segment gets written while it's being converted."""
+        return os.path.join(self.directory, '%s-%05i.partial.%s' % (
+                self.key, index, self.extension))
+
+    def is_done(self, index):
+        return index in self.manifest['done']
+
+    def done_count(self):
+        return len(self.manifest['done'])
+
+    def mark_done(self, index):
+        """Record that a segment finished converting (into
+        partial_path(index)).
+        """
+        os.rename(self.partial_path(index), self.path(index))
+        if index not in self.manifest['done']:
+            self.manifest['done'].append(index)
+        self._save()
+
+    def write_concat_list(self):
+        """Write the list of segments for ffmpeg's concat demuxer.
+
+        :returns: the path of the list
+        """
+        path = os.path.join(self.directory, 'concat.txt')
+        with open(path, 'wb') as f:
+            for index, start, length in self.segments:
+                segment_path = self.path(index)
+                if isinstance(segment_path, unicode):
+                    segment_path = segment_path.encode('utf8')
+                f.write("file '%s'\n" % segment_path.replace("'", "'\\''"))
+        return path
+
+    def remove(self):
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory, ignore_errors=True)
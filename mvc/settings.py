@@ -2,9 +2,11 @@ import logging
 import os
 import sys
 
-from mvc import execute
+from mvc import capabilities
 
 ffmpeg_version = None
+# capabilities.CapabilityLoader for our ffmpeg
+capability_loader = None
 
 _search_path_extra = []
 def add_to_search_path(directory):
@@ -38,6 +40,20 @@ def memoize(func):
         return cache[0]
     return wrapper
 
+def get_user_data_directory():
+    """Get the directory where MVC keeps data between runs (caches,
+    histories, etc).  It might not exist yet.
+    """
+    if sys.platform == 'win32':
+        from mvc.windows import specialfolders
+        return os.path.join(specialfolders.app_data_directory,
+                            'Miro Video Converter')
+    elif sys.platform == 'darwin':
+        return os.path.expanduser(
+            '~/Library/Application Support/Miro Video Converter')
+    else:
+        return os.path.expanduser('~/.miro-video-converter')
+
 @memoize
 def get_ffmpeg_executable_path():
     return which("ffmpeg")
@@ -46,20 +62,46 @@ def get_ffmpeg_executable_path():
        return avconv
     return which("ffmpeg")
 
+def start_ffmpeg_probe():
+    """Start finding out what our ffmpeg can do, in the background.
+
+    See get_ffmpeg_capabilities().
+    """
+    global capability_loader
+    if capability_loader is not None:
+        return
+    cache = capabilities.CapabilityCache(os.path.join(
+            get_user_data_directory(), 'ffmpeg-capabilities.json'))
+    capability_loader = capabilities.CapabilityLoader(
+        get_ffmpeg_executable_path(), cache)
+    capability_loader.start()
+
+def get_ffmpeg_capabilities():
+    """Get the capabilities.Capabilities of our ffmpeg.
+
+    This waits for start_ffmpeg_probe() to finish (and starts it if it
+    hasn't been).
+
+    :returns: Capabilities, or None if we don't have a working ffmpeg
+    """
+    start_ffmpeg_probe()
+    return capability_loader.get()
+
+def ffmpeg_capabilities_loaded():
+    """Has start_ffmpeg_probe() finished (so that get_ffmpeg_capabilities()
+    returns right away)?
+    """
+    return capability_loader is not None and capability_loader.loaded.is_set()
+
 def get_ffmpeg_version():
+    """Get our ffmpeg's version as a tuple of ints, or None if we can't
+    tell (for example for a git build).
+    """
     global ffmpeg_version
     if ffmpeg_version is None:
-        commandline = [get_ffmpeg_executable_path(), '-version']
-        p = execute.Popen(commandline, stderr=open(os.devnull, "wb"))
-        stdout, _ = p.communicate()
-        lines = stdout.split('\n')
-        version = lines[0].rsplit(' ', 1)[1].split('.')
-        def maybe_int(v):
-            try:
-                return int(v)
-            except ValueError:
-                return v
-        ffmpeg_version = tuple(maybe_int(v) for v in version)
+        ffmpeg_capabilities = get_ffmpeg_capabilities()
+        if ffmpeg_capabilities is not None:
+            ffmpeg_version = ffmpeg_capabilities.version
     return ffmpeg_version
 
 def customize_ffmpeg_parameters(params):
@@ -72,7 +114,8 @@ def customize_ffmpeg_parameters(params):
     :returns: list of modified parameters that will get passed to
         ffmpeg
     """
-    if get_ffmpeg_version() < (0, 8):
+    version = get_ffmpeg_version()
+    if version is not None and version < (0, 8):
         # Fallback for older versions of FFmpeg (Ubuntu Natty, in particular).
         # see also #18969
         params = ['-vpre' if i == '-preset' else i for i in params]
@@ -0,0 +1,326 @@
+"""simulation.py -- Play out conversion batches on a virtual clock.
+
+This runs the real ConversionManager scheduling code, but the conversions
+are simulated from synthetic job profiles instead of running a converter.
+Like test/testdata/fake_converter.py, a simulated conversion spends a
+little while starting up.  After that it either fails or converts at the
+speed its profile gives for its converter.  Because the clock is virtual,
+a batch of 100,000 jobs plays out in seconds, which makes it practical to
+compare queue policies and concurrency limits.
+
+Usage: python -m mvc.simulation [-n JOBS] [-s SIMULTANEOUS] [--policy NAME]
+"""
+
+import collections
+import heapq
+import itertools
+import json
+import optparse
+import random
+import time
+
+from mvc import conversion
+from mvc import metrics
+
+# converter -> wall-clock seconds per second of media, for generated jobs
+DEFAULT_COSTS = {'mp4': 0.5, 'webm': 1.5, 'ogv': 0.8, 'mp3': 0.05}
+
+# seconds that a converter takes to get going (fake_converter.py sleeps
+# for half a second)
+DEFAULT_STARTUP = 0.5
+
+class JobProfile(object):
+    """What a simulated conversion does.
+
+    :param duration: seconds of media
+    :param converter: converter identifier
+    :param cost: wall-clock seconds of converting per second of media
+    :param failure_rate: chance that the conversion fails during startup
+    :param arrival: when the job gets submitted, in simulated seconds
+    """
+    def __init__(self, duration, converter, cost, failure_rate=0.0,
+                 arrival=0.0, startup=DEFAULT_STARTUP):
+        self.duration = duration
+        self.converter = converter
+        self.cost = cost
+        self.failure_rate = failure_rate
+        self.arrival = arrival
+        self.startup = startup
+
+    def __repr__(self):
+        return '<JobProfile %s %.1fs at %.1f>' % (self.converter,
+                                                  self.duration, self.arrival)
+
+def generate_jobs(count, seed=0, costs=DEFAULT_COSTS, failure_rate=0.01,
+                  arrival_rate=None, median_duration=300.0):
+    """Generate a list of synthetic job profiles.
+
+    Media durations are log-normally distributed around median_duration,
+    which gives the mix of short clips and the occasional very long
+    recording that real batches have.
+
+    :param arrival_rate: jobs per second, arriving as a Poisson process;
+    None means the whole batch is submitted at once
+    """
+    rng = random.Random(seed)
+    converters = sorted(costs)
+    jobs = []
+    arrival = 0.0
+    for i in xrange(count):
+        converter = rng.choice(converters)
+        duration = median_duration * rng.lognormvariate(0, 1)
+        if arrival_rate:
+            arrival += rng.expovariate(arrival_rate)
+        jobs.append(JobProfile(duration, converter, costs[converter],
+                               failure_rate, arrival))
+    return jobs
+
+class VirtualClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class SimulatedConversion(object):
+    """Stands in for a Conversion, as far as the ConversionManager can
+    tell.
+    """
+    def __init__(self, simulator, profile, index):
+        self.simulator = simulator
+        self.profile = profile
+        self.index = index
+        self.status = 'initialized'
+        self.error = None
+        self.queued_at = None
+        self.priority = 0
+        self.scheduling = None
+        self.cpus = None
+        self.slot = None
+        self.create_thumbnail = False
+        self.listeners = set()
+        self.started_at = None
+        self.finished_at = None
+        self.will_fail = (simulator.rng.random() < profile.failure_rate)
+        self.estimated_duration = (profile.startup +
+                                   profile.duration * profile.cost)
+
+    def __unicode__(self):
+        return u'<SimulatedConversion %i (%s)>' % (self.index,
+                                                   self.profile.converter)
+
+    @property
+    def eta(self):
+        if self.started_at is None:
+            return self.estimated_duration
+        return max(self.started_at + self.estimated_duration -
+                   self.simulator.clock(), 0.0)
+
+    def run(self):
+        self.started_at = self.simulator.clock()
+        self.status = 'converting'
+        if self.will_fail:
+            self.simulator.schedule(self.profile.startup, self.finish,
+                                    'failed')
+        else:
+            self.simulator.schedule(self.estimated_duration, self.finish,
+                                    'finished')
+
+    def finish(self, status):
+        if self.status != 'converting':
+            # stopped while it was running
+            return
+        self.status = status
+        if status == 'failed':
+            self.error = 'simulated failure'
+        self.finished_at = self.simulator.clock()
+        self.simulator.manager.conversion_finished(self)
+
+    def stop(self):
+        self.error = 'manually stopped'
+        self.status = 'canceled'
+        if self.started_at is None:
+            self.simulator.manager.remove(self)
+        else:
+            self.finished_at = self.simulator.clock()
+            self.simulator.manager.conversion_finished(self)
+
+class ShortestFirstManager(conversion.ConversionManager):
+    """Starts the waiting conversion with the smallest estimated duration
+    first.
+    """
+    def __init__(self, *args, **kwargs):
+        conversion.ConversionManager.__init__(self, *args, **kwargs)
+        self.waiting = []
+        self.counter = itertools.count()
+
+    def add_waiting(self, conversion):
+        heapq.heappush(self.waiting, (conversion.estimated_duration,
+                                      self.counter.next(), conversion))
+
+    def pop_waiting(self):
+        return heapq.heappop(self.waiting)[2]
+
+    def peek_waiting(self):
+        return self.waiting[0][2]
+
+    def remove(self, conversion):
+        for i, entry in enumerate(self.waiting):
+            if entry[2] is conversion:
+                del self.waiting[i]
+                heapq.heapify(self.waiting)
+                self.trace_scheduler('remove', conversion)
+                return
+        raise ValueError('%r is not waiting' % (conversion,))
+
+    def estimate_completion(self):
+        # the base class wants the waiting conversions themselves
+        waiting, self.waiting = self.waiting, [e[2] for e in self.waiting]
+        try:
+            return conversion.ConversionManager.estimate_completion(self)
+        finally:
+            self.waiting = waiting
+
+class LongestFirstManager(ShortestFirstManager):
+    """Starts the waiting conversion with the largest estimated duration
+    first, which tends to finish a batch sooner.
+    """
+    def add_waiting(self, conversion):
+        heapq.heappush(self.waiting, (-conversion.estimated_duration,
+                                      self.counter.next(), conversion))
+
+POLICIES = collections.OrderedDict([
+        ('fifo', conversion.ConversionManager),
+        ('shortest', ShortestFirstManager),
+        ('longest', LongestFirstManager),
+        ])
+
+class Simulator(object):
+    """Runs job profiles through a ConversionManager on a virtual clock.
+
+    :param manager: the ConversionManager to test.  Its clock and metrics
+    get replaced, so the process-wide metrics aren't touched.
+    """
+    def __init__(self, manager, seed=0):
+        self.manager = manager
+        self.clock = VirtualClock()
+        manager.clock = self.clock
+        manager.metrics = metrics.StageMetrics()
+        self.rng = random.Random(seed)
+        self.events = []
+        self.counter = itertools.count()
+        self.conversions = []
+
+    def schedule(self, delay, callback, *args):
+        heapq.heappush(self.events, (self.clock.now + delay,
+                                     self.counter.next(), callback, args))
+
+    def submit(self, profile):
+        c = SimulatedConversion(self, profile, len(self.conversions))
+        self.conversions.append(c)
+        self.schedule(max(profile.arrival - self.clock.now, 0.0),
+                      self.manager.run_conversion, c)
+        return c
+
+    def run(self, until=None):
+        """Process events until there are none left (or until the virtual
+        time until).
+
+        :returns: how many events were processed
+        """
+        processed = 0
+        while self.events:
+            when, _, callback, args = self.events[0]
+            if until is not None and when > until:
+                break
+            heapq.heappop(self.events)
+            self.clock.now = when
+            callback(*args)
+            processed += 1
+        return processed
+
+    def get_results(self):
+        """Summarize the simulated batch."""
+        done = [c for c in self.conversions if c.finished_at is not None]
+        waits = sorted(c.started_at - c.queued_at for c in done)
+        turnarounds = sorted(c.finished_at - c.profile.arrival for c in done)
+        busy = sum(c.finished_at - c.started_at for c in done)
+        makespan = max(c.finished_at for c in done) if done else 0.0
+        slots = self.manager.simultaneous or max(len(done), 1)
+        statuses = {}
+        for c in self.conversions:
+            statuses[c.status] = statuses.get(c.status, 0) + 1
+        return {'jobs': len(self.conversions),
+                'statuses': statuses,
+                'makespan': makespan,
+                'mean_wait': sum(waits) / len(waits) if waits else 0.0,
+                'p50_wait': percentile(waits, 0.5),
+                'p95_wait': percentile(waits, 0.95),
+                'mean_turnaround': (sum(turnarounds) / len(turnarounds)
+                                    if turnarounds else 0.0),
+                'p95_turnaround': percentile(turnarounds, 0.95),
+                'utilization': (busy / (slots * makespan) if makespan
+                                else 0.0)}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+def simulate(jobs, policy='fifo', simultaneous=4, seed=0):
+    """Run a list of JobProfiles through a fresh manager.
+
+    :returns: the results dict from Simulator.get_results()
+    """
+    manager = POLICIES[policy](simultaneous)
+    simulator = Simulator(manager, seed)
+    for job in jobs:
+        simulator.submit(job)
+    simulator.run()
+    return simulator.get_results()
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [-n JOBS] [-s SIMULTANEOUS] [--policy NAME]',
+        prog='python -m mvc.simulation')
+    parser.add_option('-n', '--jobs', type='int', default=10000,
+                      help='how many jobs to simulate (default: %default)')
+    parser.add_option('-s', '--simultaneous', type='int', action='append',
+                      help='concurrency limit; can be given more than once '
+                      'to compare limits (default: 4)')
+    parser.add_option('--policy', action='append', choices=list(POLICIES),
+                      help='queue policy: %s; can be given more than once '
+                      '(default: all of them)' % ', '.join(POLICIES))
+    parser.add_option('--failure-rate', type='float', default=0.01,
+                      help='chance that a job fails (default: %default)')
+    parser.add_option('--arrival-rate', type='float',
+                      help='jobs submitted per second (default: all at '
+                      'once)')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('-j', '--json', action='store_true',
+                      help='Output JSON documents, rather than text.')
+    (options, args) = parser.parse_args()
+
+    jobs = generate_jobs(options.jobs, options.seed,
+                         failure_rate=options.failure_rate,
+                         arrival_rate=options.arrival_rate)
+    for simultaneous in options.simultaneous or [4]:
+        for policy in options.policy or list(POLICIES):
+            start = time.time()
+            results = simulate(jobs, policy, simultaneous, options.seed)
+            results['policy'] = policy
+            results['simultaneous'] = simultaneous
+            results['real_time'] = time.time() - start
+            if options.json:
+                print json.dumps(results)
+            else:
+                print ('%-8s x%-3i makespan %9.0fs  wait mean %8.0fs '
+                       'p95 %8.0fs  utilization %3.0f%%  (%.1fs)' % (
+                        policy, simultaneous, results['makespan'],
+                        results['mean_wait'], results['p95_wait'],
+                        results['utilization'] * 100,
+                        results['real_time']))
+
+if __name__ == '__main__':
+    main()
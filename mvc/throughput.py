@@ -0,0 +1,141 @@
+"""throughput.py -- Remember how fast conversions run.
+
+We keep a history of the encode speed we observed (seconds of output per
+wall-clock second) for each converter, output resolution and host.  The
+conversion manager uses it to predict how long a job will take before it
+starts, and to smooth out the ETA while it runs.
+"""
+
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# weight of the newest sample in the moving average
+SMOOTHING = 0.3
+
+# output heights that we group resolutions by
+HEIGHT_BUCKETS = (240, 360, 480, 576, 720, 1080, 1440, 2160)
+
+def resolution_bucket(width, height):
+    """Get the name of the resolution bucket for an output size.
+
+    Sizes are grouped by height, so 800x480 and 854x480 land in the same
+    bucket.  None means audio only.
+    """
+    if width is None or height is None:
+        return 'audio'
+    for bucket in HEIGHT_BUCKETS:
+        if height <= bucket:
+            return '%ip' % bucket
+    return 'larger'
+
+def get_bucket(converter, video):
+    if converter.audio_only or video.audio_only:
+        return 'audio'
+    return resolution_bucket(*converter.get_target_size(video))
+
+class ThroughputHistory(object):
+    """Persistent history of observed encode speeds.
+
+    :param path: JSON file to load the history from and save it to, or None
+    to keep it in memory only
+    :param host: host name to file samples under, defaults to this machine
+    """
+    def __init__(self, path, host=None):
+        self.path = path
+        if host is None:
+            host = socket.gethostname()
+        self.host = host
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def _key(self, converter_id, bucket):
+        return '%s/%s/%s' % (self.host, converter_id, bucket)
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+            self.entries = dict(data['entries'])
+        except (EnvironmentError, ValueError, KeyError, TypeError):
+            logger.warn('error loading throughput history from %r',
+                        self.path, exc_info=True)
+            self.entries = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps({'version': 1, 'entries': self.entries})
+        directory = os.path.dirname(self.path)
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if os.path.exists(self.path) and os.name == 'nt':
+                os.remove(self.path)
+            os.rename(temp_path, self.path)
+        except EnvironmentError:
+            logger.warn('error saving throughput history to %r', self.path,
+                        exc_info=True)
+
+    def record(self, converter, video, output_seconds, wall_seconds):
+        """Record that a conversion of output_seconds of media took
+        wall_seconds.
+        """
+        if output_seconds <= 0 or wall_seconds <= 0:
+            return
+        speed = float(output_seconds) / wall_seconds
+        key = self._key(converter.identifier, get_bucket(converter, video))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = {'speed': speed, 'samples': 0}
+            else:
+                entry['speed'] = (SMOOTHING * speed +
+                                  (1 - SMOOTHING) * entry['speed'])
+            entry['samples'] += 1
+
+    def get_speed(self, converter, video):
+        """Get the expected speed for converting video with converter.
+
+        If we haven't seen that converter at that resolution on this host,
+        fall back to the average of other converters at that resolution.
+
+        :returns: output seconds per wall-clock second, or None if we don't
+        know
+        """
+        bucket = get_bucket(converter, video)
+        with self.lock:
+            entry = self.entries.get(self._key(converter.identifier, bucket))
+            if entry is not None:
+                return entry['speed']
+            suffix = '/' + bucket
+            prefix = self.host + '/'
+            speeds = [e['speed'] for k, e in self.entries.iteritems()
+                      if k.startswith(prefix) and k.endswith(suffix)]
+        if speeds:
+            return sum(speeds) / len(speeds)
+        return None
+
+    def estimate_duration(self, converter, video):
+        """Predict how many wall-clock seconds converting video will take.
+
+        :returns: seconds, or None if we don't know
+        """
+        if not video.duration:
+            return None
+        speed = self.get_speed(converter, video)
+        if not speed:
+            return None
+        return video.duration / speed
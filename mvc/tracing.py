@@ -0,0 +1,104 @@
+"""tracing.py -- Record a timeline of a conversion batch.
+
+When tracing is enabled (see enable()), the conversion stages, the
+converter processes and the ConversionManager's scheduling decisions get
+recorded as Chrome trace events.  Load the file that save() writes in
+chrome://tracing or Perfetto to see how the jobs overlapped.
+
+Conversions are drawn on one track per slot (slot 1 up to the manager's
+simultaneous limit), so gaps in a track are times when that slot was idle.
+"""
+
+import json
+import os
+import threading
+import time
+
+# the process-wide tracer, or None if tracing is off
+tracer = None
+
+def enable():
+    """Turn tracing on, and return the Tracer."""
+    global tracer
+    if tracer is None:
+        tracer = Tracer()
+    return tracer
+
+def disable():
+    global tracer
+    tracer = None
+
+class Tracer(object):
+    """Collects trace events.  All methods can be called from any thread.
+
+    Times are time.time() values; they get converted to microseconds since
+    the tracer started.
+    """
+    def __init__(self):
+        self.start_time = time.time()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.events = []
+        # track name -> tid
+        self.tracks = {}
+
+    def _timestamp(self, t):
+        return int((t - self.start_time) * 1000000)
+
+    def _tid(self, track):
+        # must be called with the lock held
+        if track not in self.tracks:
+            self.tracks[track] = tid = len(self.tracks) + 1
+            self.events.append({'ph': 'M', 'name': 'thread_name',
+                                'pid': self.pid, 'tid': tid,
+                                'args': {'name': track}})
+            self.events.append({'ph': 'M', 'name': 'thread_sort_index',
+                                'pid': self.pid, 'tid': tid,
+                                'args': {'sort_index': tid}})
+        return self.tracks[track]
+
+    def complete(self, name, start, end, track, category='stage', args=None):
+        """Record a span that ran from start to end."""
+        event = {'ph': 'X', 'name': name, 'cat': category,
+                 'ts': self._timestamp(start),
+                 'dur': max(self._timestamp(end) - self._timestamp(start), 0),
+                 'pid': self.pid}
+        if args:
+            event['args'] = args
+        with self.lock:
+            event['tid'] = self._tid(track)
+            self.events.append(event)
+
+    def instant(self, name, track, category='scheduler', args=None, t=None):
+        """Record something that happened at one point in time."""
+        if t is None:
+            t = time.time()
+        event = {'ph': 'i', 's': 't', 'name': name, 'cat': category,
+                 'ts': self._timestamp(t), 'pid': self.pid}
+        if args:
+            event['args'] = args
+        with self.lock:
+            event['tid'] = self._tid(track)
+            self.events.append(event)
+
+    def counter(self, name, values, t=None):
+        """Record the values of a counter, like the number of running
+        conversions.
+
+        :param values: dict of series name -> number
+        """
+        if t is None:
+            t = time.time()
+        event = {'ph': 'C', 'name': name, 'ts': self._timestamp(t),
+                 'pid': self.pid, 'args': values}
+        with self.lock:
+            self.events.append(event)
+
+    def to_dict(self):
+        with self.lock:
+            events = list(self.events)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            json.dump(self.to_dict(), f)
@@ -1,12 +1,20 @@
 import json
 import operator
 import optparse
-import time
 import sys
 
 import mvc
-from mvc.widgets import app
-from mvc.widgets import initialize
+from mvc import concurrency
+from mvc import jobserver
+from mvc import journal
+from mvc import metrics
+from mvc import scheduling
+from mvc import settings
+from mvc import tracing
+from mvc import video
+from mvc.utils import size_string
+from mvc import frontend
+from mvc.conversion import PROGRESS_DETAILS, total_resource_usage
 
 parser = optparse.OptionParser(
     usage='%prog [-l] [--list-converters] [-c <converter> <filenames..>]',
@@ -20,8 +28,62 @@ parser.add_option('-l', '--list-converters', action='store_true',
                   help="Print a list of supported converter types.")
 parser.add_option('-c', '--converter', dest='converter',
                   help="Specify the type of conversion to make.")
+parser.add_option('--log-dir', dest='log_dir',
+                  help="Write the full converter output for each file to "
+                  "a compressed log in this directory.")
+parser.add_option('--metrics-port', dest='metrics_port', type='int',
+                  help="Serve stage timing histograms on "
+                  "http://localhost:PORT/metrics (Prometheus text format).")
+parser.add_option('--metrics-file', dest='metrics_file',
+                  help="Write stage timing histograms as JSON to this file "
+                  "every 10 seconds, and when done.")
+parser.add_option('--journal', dest='journal',
+                  help="Record the jobs in this file.  If a previous run "
+                  "with the same journal was interrupted, its unfinished "
+                  "jobs get converted first, and files that it already "
+                  "converted are skipped.")
+parser.add_option('--segment-length', dest='segment_length', type='float',
+                  help="Convert inputs longer than this many seconds in "
+                  "segments of this length.  If a conversion is "
+                  "interrupted, running it again only converts the "
+                  "missing segments.")
+parser.add_option('--scratch-dir', dest='scratch_dir',
+                  help="Keep the segments in this directory (default: "
+                  ".mvc-segments in the output directory).")
+parser.add_option('--scheduling', dest='scheduling',
+                  choices=list(scheduling.CLASSES),
+                  help="How the converters share the machine: %s "
+                  "(default: normal)." % ', '.join(scheduling.CLASSES))
+parser.add_option('--cores-per-job', dest='cores_per_job', type='int',
+                  help="Pin each converter to its own group of this many "
+                  "CPUs.")
+parser.add_option('--adaptive', dest='adaptive', action='store_true',
+                  help="Run more or fewer conversions at once, depending on "
+                  "the load, the free memory and how fast they go.")
+parser.add_option('--min-simultaneous', dest='min_simultaneous', type='int',
+                  default=1,
+                  help="With --adaptive, the fewest conversions to run at "
+                  "once (default: %default).")
+parser.add_option('--max-simultaneous', dest='max_simultaneous', type='int',
+                  help="With --adaptive, the most conversions to run at "
+                  "once (default: the number of CPUs).")
+parser.add_option('--jobserver', dest='jobserver', action='store_true',
+                  help="When run from make -jN, take a job slot from make "
+                  "for each converter process, so that the whole build "
+                  "stays within N jobs.  The make rule has to start "
+                  "with a +.")
+parser.add_option('--no-stream-copy', dest='stream_copy',
+                  action='store_false', default=True,
+                  help="Always encode, even streams that are already what "
+                  "the converter makes.")
+parser.add_option('--trace', dest='trace',
+                  help="Write a timeline of the batch to this file, in the "
+                  "Chrome trace event format.")
 
 class Application(mvc.Application):
+    # -l and bad options exit right away, which would leave the probe's
+    # thread running while the interpreter shuts down
+    probe_at_startup = False
 
     def run(self):
         (options, args) = parser.parse_args()
@@ -53,7 +115,44 @@ class Application(mvc.Application):
                 parser.print_help()
             sys.exit(1)
 
+        if options.log_dir:
+            self.conversion_manager.log_dir = options.log_dir
+        self.conversion_manager.segment_length = options.segment_length
+        self.conversion_manager.scratch_dir = options.scratch_dir
+        self.conversion_manager.stream_copy = options.stream_copy
+        if options.scheduling or options.cores_per_job:
+            scheduling_class = scheduling.CLASSES[
+                options.scheduling or 'normal']
+            if options.cores_per_job:
+                scheduling_class = scheduling_class.with_cores(
+                    options.cores_per_job)
+            self.conversion_manager.default_scheduling = scheduling_class
+        if options.adaptive:
+            adaptive = concurrency.AdaptiveConcurrency(
+                options.min_simultaneous, options.max_simultaneous)
+            # start from our usual limit, and adjust from there
+            self.conversion_manager.simultaneous = adaptive.clamp(
+                self.conversion_manager.simultaneous or adaptive.maximum)
+            self.conversion_manager.concurrency = adaptive
+        if options.jobserver:
+            client = jobserver.JobServerClient.from_environment()
+            if client is None:
+                print >> sys.stderr, ("WARNING: --jobserver given, but make "
+                                      "didn't pass us a jobserver")
+            self.conversion_manager.jobserver = client
+
+        metrics_server = metrics_dumper = None
+        if options.metrics_port is not None:
+            metrics_server = metrics.MetricsServer(options.metrics_port)
+            metrics_server.start()
+        if options.metrics_file:
+            metrics_dumper = metrics.MetricsDumper(options.metrics_file)
+            metrics_dumper.start()
+        if options.trace:
+            tracing.enable()
+
         any_failed = False
+        conversions = []
 
         def changed(c):
             if c.status == 'failed':
@@ -68,18 +167,39 @@ class Application(mvc.Application):
                     'percent': (c.progress_percent * 100 if c.progress_percent
                                 else 0),
                     }
+                for key in PROGRESS_DETAILS:
+                    if getattr(c, key) is not None:
+                        output[key] = getattr(c, key)
+                if c.eta is not None:
+                    output['eta'] = c.eta
+                if c.estimated_duration is not None:
+                    output['estimated_duration'] = c.estimated_duration
+                if c.stream_plan:
+                    output['streams'] = c.stream_plan
+                queue_eta = self.conversion_manager.estimate_completion()
+                if queue_eta is not None:
+                    output['queue_eta'] = queue_eta
                 if c.error is not None:
                     output['error'] = c.error
+                if c.log_path is not None:
+                    output['log'] = c.log_path
+                if c.status in ('finished', 'failed', 'canceled'):
+                    output['resources'] = c.get_resource_usage()
                 print json.dumps(output)
             else:
                 if c.status == 'initialized':
                     line = 'starting (output: %s)' % (c.output,)
                 elif c.status == 'converting':
+                    verb = 'converting'
+                    if c.copied_streams:
+                        verb += ', copying %s' % ' and '.join(
+                            c.copied_streams)
                     if c.progress_percent is not None:
-                        line = 'converting (%i%% complete, %is remaining)' % (
-                            c.progress_percent * 100, c.eta)
+                        line = '%s (%i%% complete, %is remaining)' % (
+                            verb, c.progress_percent * 100, c.eta)
                     else:
-                        line = 'converting (0% complete, unknown remaining)'
+                        line = '%s (0%% complete, unknown remaining)' % (
+                            verb,)
                 elif c.status == 'staging':
                     line = 'staging'
                 elif c.status == 'failed':
@@ -90,10 +210,25 @@ class Application(mvc.Application):
                     line = c.status
                 print '%s: %s' % (c.video.filename, line)
 
+        # we're going to convert something, so we need the probe.  Waiting
+        # for it also lets equivalent conversions get deduplicated (see
+        # FFmpegConverterInfo.get_signature()).
+        settings.get_ffmpeg_capabilities()
+
+        if options.journal:
+            self.conversion_manager.journal = journal.JobJournal(
+                options.journal)
+            for c in self.conversion_manager.resume_jobs(
+                self.converter_manager.get_by_id):
+                conversions.append(c)
+                changed(c)
+                c.listen(changed)
+
+        converter = self.converter_manager.get_by_id(options.converter)
         for filename in args:
             try:
-                print ">>", app
-                c = app.start_conversion(filename, options.converter)
+                c = self.conversion_manager.get_conversion(
+                    video.VideoFile(filename), converter)
             except ValueError:
                 message = 'could not parse %r' % filename
                 if options.json:
@@ -103,19 +238,71 @@ class Application(mvc.Application):
                 else:
                     print 'ERROR:', message
                 continue
+            if self.conversion_manager.is_duplicate(c):
+                if options.json:
+                    print json.dumps({'status': 'skipped',
+                                      'filename': filename,
+                                      'output': c.output})
+                else:
+                    print '%s: skipped (already converted to %s)' % (
+                        filename, c.output)
+                continue
+            self.conversion_manager.run_conversion(c)
+            conversions.append(c)
             changed(c)
             c.listen(changed)
 
         # XXX real mainloop
         while self.conversion_manager.running:
+            self.conversion_manager.notifications.wait(1)
             self.conversion_manager.check_notifications()
-            time.sleep(1)
         self.conversion_manager.check_notifications() # one last time
 
+        if metrics_dumper is not None:
+            metrics_dumper.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if self.conversion_manager.jobserver is not None:
+            self.conversion_manager.jobserver.close()
+        if options.trace:
+            tracing.tracer.save(options.trace)
+        self.print_summary(conversions, options)
         sys.exit(0 if not any_failed else 1)
 
+    def print_summary(self, conversions, options):
+        """Print the resources used by the whole batch."""
+        if not conversions:
+            return
+        total = total_resource_usage(c.get_resource_usage()
+                                     for c in conversions)
+        statuses = {}
+        for c in conversions:
+            statuses[c.status] = statuses.get(c.status, 0) + 1
+        if options.json:
+            print json.dumps({'summary': {'conversions': len(conversions),
+                                          'statuses': statuses,
+                                          'resources': total}})
+            return
+        print 'summary: %i conversions (%s)' % (
+            len(conversions), ', '.join('%i %s' % (count, status)
+                                        for status, count
+                                        in sorted(statuses.items())))
+        if 'user' in total:
+            print ('  cpu: %.1fs user, %.1fs system; wall: %.1fs; '
+                   'max rss: %s; read: %s; written: %s' % (
+                    total['user'], total['system'], total.get('wall', 0),
+                    size_string(total['max_rss']),
+                    size_string(total['read_bytes']),
+                    size_string(total['write_bytes'])))
+        elif 'wall' in total:
+            print '  wall: %.1fs' % total['wall']
+
+def main():
+    # no widget toolkit here: the defaults in mvc.frontend do
+    frontend.create_conversion_directory()
+    application = Application()
+    application.startup()
+    application.run()
+
 if __name__ == "__main__":
-    initialize(None)
-    app.widgetapp = Application()
-    app.widgetapp.startup()
-    app.widgetapp.run()
+    main()
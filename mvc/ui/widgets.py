@@ -29,8 +29,10 @@ from mvc.widgets import app
 from mvc.converter import ConverterInfo
 from mvc.video import VideoFile
 from mvc.resources import image_path
-from mvc.utils import size_string, round_even, convert_path_for_subprocess
+from mvc.utils import (size_string, duration_string, round_even,
+                       convert_path_for_subprocess)
 from mvc import openfiles
+from mvc import scheduling
 
 BUTTON_FONT = widgetutil.font_scale_from_osx_points(15.0)
 LARGE_FONT = widgetutil.font_scale_from_osx_points(13.0)
@@ -870,7 +872,7 @@ class ConversionCellRenderer(widgetset.CustomCellRenderer):
 
     def layout_bottom(self, layout_manager, hotspot):
         layout_manager.set_text_color(TEXT_COLOR)
-        if self.status in ('converting', 'staging'):
+        if self.status in ('converting', 'staging', 'paused'):
             box = cellpack.HBox(spacing=5)
             stack = cellpack.Stack()
             stack.pack(cellpack.Alignment(self.progressbar_base,
@@ -885,15 +887,23 @@ class ConversionCellRenderer(widgetset.CustomCellRenderer):
             box.pack(cellpack.Alignment(stack,
                                         yalign=0.5,
                                         xscale=0, yscale=0))
-            textbox = layout_manager.textbox("%d%%" % (
-                        100 * percent))
+            text = "%d%%" % (100 * percent)
+            if self.status == 'converting' and self.eta:
+                text += " - %s left" % duration_string(self.eta)
+            elif self.status == 'paused':
+                text += " - Paused"
+            textbox = layout_manager.textbox(text)
             box.pack(textbox)
             return box
         elif self.status == 'initialized': # queued
             vbox = cellpack.VBox()
             vbox.pack_space(2)
+            text = "Queued"
+            if self.conversion.estimated_duration is not None:
+                text += " (about %s)" % duration_string(
+                    self.conversion.estimated_duration)
             vbox.pack(IconWithText(self.queued,
-                                   layout_manager.textbox("Queued")))
+                                   layout_manager.textbox(text)))
             return vbox
         elif self.status in ('finished', 'failed', 'canceled'):
             vbox = cellpack.VBox(spacing=5)
@@ -1030,6 +1040,9 @@ class TextDialog(widgetset.Dialog):
 class Application(mvc.Application):
     def __init__(self, simultaneous=None):
         mvc.Application.__init__(self, simultaneous)
+        # keep the converters from making the UI sluggish
+        self.conversion_manager.default_scheduling = (
+            scheduling.CLASSES['background'])
         self.create_signal('window-shown')
         self.sent_window_shown = False
 
@@ -1093,7 +1106,7 @@ class Application(mvc.Application):
             options = []
             more_devices = None
             for c in converters[type_]:
-                if isinstance(c, str):
+                if isinstance(c, basestring):
                     rconverters = self.converter_manager.brand_to_converters(c)
                     values = []
                     for r in rconverters:
@@ -1171,7 +1184,8 @@ class Application(mvc.Application):
         vbox.pack_start(bottom)
         self.window.set_content_widget(vbox)
 
-        idle_add(self.conversion_manager.check_notifications, 1)
+        self.conversion_manager.notifications.wakeup = (
+            lambda: idle_add(self.conversion_manager.check_notifications))
 
         self.window.connect('file-drag-motion', self.drag_motion)
         self.window.connect('file-drag-received', self.drag_data_received)
@@ -1271,7 +1285,7 @@ class Application(mvc.Application):
         has_conversions = any(self.model.conversions())
         all_done = self.model.all_conversions_done()
         for c in self.model.conversions():
-            if c.status == 'converting':
+            if c.status in ('converting', 'paused'):
                 can_cancel = True
                 break
             elif c.status == 'initialized':
@@ -1484,9 +1498,8 @@ class Application(mvc.Application):
             self.model.remove(iter_)
             self.update_table_size()
         elif name == 'show-log':
-            lines = ''.join(conversion.lines)
             d = TextDialog('Log', '', self.window)
-            d.set_text(lines)
+            d.set_text(conversion.get_log())
             try:
                 d.run()
             finally:
@@ -72,6 +72,25 @@ def line_reader(handle):
             c = handle.read(1)
     return _readlines()
 
+def progress_reader(handle):
+    """Builds a generator that reads ffmpeg's -progress output.
+
+    -progress writes blocks of key=value lines, each one terminated by a
+    "progress=continue" or "progress=end" line.  This yields a dict for every
+    block (including the progress key).
+    """
+    def _readblocks():
+        block = {}
+        for line in line_reader(handle):
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            block[key.strip()] = value.strip()
+            if key == 'progress':
+                yield block
+                block = {}
+    return _readblocks()
+
 
 class Matrix(object):
     """2 Dimensional matrix.
@@ -204,6 +223,16 @@ def size_string(nbytes):
     else:
         return "%(size)s B" % {"size": nbytes}
 
+def duration_string(seconds):
+    """Format a number of seconds for the user, like 1:05 or 1:02:03."""
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return '%i:%02i:%02i' % (hours, minutes, seconds)
+    else:
+        return '%i:%02i' % (minutes, seconds)
+
 def convert_path_for_subprocess(path):
     """Convert a path to a form suitable for passing to a subprocess.
 
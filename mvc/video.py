@@ -3,9 +3,12 @@ import os
 import re
 import tempfile
 import threading
+import time
 
 from mvc import execute
-from mvc.widgets import idle_add
+from mvc import metrics
+from mvc import tracing
+from mvc.frontend import idle_add
 from mvc.settings import get_ffmpeg_executable_path
 from mvc.utils import hms_to_seconds, convert_path_for_subprocess
 
@@ -20,12 +23,21 @@ class VideoFile(object):
         self.width = None
         self.height = None
         self.duration = None
+        # stream details, for deciding whether a stream can be copied as is
+        # (see extract_stream_details())
+        self.video_profile = None
+        self.pixel_format = None
+        self.video_bitrate = None
+        self.audio_profile = None
+        self.audio_sample_rate = None
+        self.audio_channels = None
+        self.audio_bitrate = None
         self.thumbnails = {}
         self.parse()
 
     def parse(self):
         self.__dict__.update(
-            get_media_info(self.filename))
+            get_media_info(self.filename, details=True))
 
     @property
     def audio_only(self):
@@ -149,8 +161,71 @@ def parse_ffmpeg_output(output):
 # afterwards.
 SIZE_RE = re.compile(" (\\d+)x(\\d+)[ ,]")
 
+# "h264 (High) (avc1 / 0x31637661)": the profile is the part in parentheses
+# that isn't a codec tag.  Decoder names ("mp3 (mp3float)") go there too,
+# but they're lower case identifiers.
+PROFILE_RE = re.compile(r"\(([^()/]+)\)")
+DECODER_NAME_RE = re.compile(r"^[a-z0-9_]+$")
+BITRATE_RE = re.compile(r"(\d+) kb/s")
+SAMPLE_RATE_RE = re.compile(r"(\d+) Hz")
+CHANNELS_RE = re.compile(r"(\d+) channels")
+CHANNEL_LAYOUTS = {
+    'mono': 1,
+    'stereo': 2,
+    'quad': 4,
+    '5.0': 5,
+    '5.1': 6,
+    '6.1': 7,
+    '7.1': 8,
+}
+
+def extract_stream_details(kind, data):
+    """Get the details of a stream that extract_info() leaves out.
+
+    :param kind: 'video' or 'audio'
+    :param data: the part of the stream line after "Video: " or "Audio: "
+    :returns: dict with the keys that could be parsed, out of
+    video_profile, pixel_format and video_bitrate for video, and
+    audio_profile, audio_sample_rate, audio_channels and audio_bitrate for
+    audio.  Bitrates are in bits per second.
+    """
+    details = {}
+    fields = data.split(', ')
+    match = PROFILE_RE.search(fields[0])
+    if match and not DECODER_NAME_RE.match(match.group(1)):
+        details[kind + '_profile'] = match.group(1)
+    match = BITRATE_RE.search(data)
+    if match:
+        details[kind + '_bitrate'] = int(match.group(1)) * 1000
+    if kind == 'video':
+        if len(fields) > 1:
+            # "yuv420p(tv, bt709)" gets split up, but we only want the
+            # part before the parentheses
+            pixel_format = fields[1].split('(')[0]
+            if pixel_format != 'none' and not SIZE_RE.search(
+                    ' %s ' % pixel_format):
+                details['pixel_format'] = pixel_format
+    else:
+        match = SAMPLE_RATE_RE.search(data)
+        if match:
+            details['audio_sample_rate'] = int(match.group(1))
+        match = CHANNELS_RE.search(data)
+        if match:
+            details['audio_channels'] = int(match.group(1))
+        else:
+            for field in fields[1:]:
+                layout = field.split('(')[0]
+                if layout in CHANNEL_LAYOUTS:
+                    details['audio_channels'] = CHANNEL_LAYOUTS[layout]
+                    break
+    return details
 
-def extract_info(ast):
+def extract_info(ast, details=False):
+    """Get the media info out of parsed ffmpeg output.
+
+    :param details: also include the stream details from
+    extract_stream_details()
+    """
     info = {}
     # logging.info("get_media_info: %s", ast.pformat())
 
@@ -215,6 +290,8 @@ def extract_info(ast):
                 if match:
                     info["width"] = int(match.group(1))
                     info["height"] = int(match.group(2))
+                if details:
+                    info.update(extract_stream_details('video', data))
             elif 'Audio:' in stream:
                 stream_number, video, data = stream.split(': ', 2)
                 audio_codec = data.split(', ')[0]
@@ -223,6 +300,8 @@ def extract_info(ast):
                     if 'drm' in drmp:
                         info.setdefault('has_drm', []).append('audio')
                 info['audio_codec'] = audio_codec
+                if details:
+                    info.update(extract_stream_details('audio', data))
     return info
 
 def get_ffmpeg_output(filepath):
@@ -242,19 +321,30 @@ def get_ffmpeg_output(filepath):
 
     return output
 
-def get_media_info(filepath):
+def get_media_info(filepath, details=False):
     """Takes a file path and returns a dict of information about
     this media file that it extracted from ffmpeg -i.
 
     :param filepath: absolute path to the media file in question
+    :param details: also include the stream details (see
+    extract_stream_details())
 
     :returns: dict of media info possibly containing: height, width,
     container, audio_codec, video_codec
     """
     logger.info('get_media_info: %r', filepath)
-    output = get_ffmpeg_output(filepath)
-    ast = parse_ffmpeg_output(output.splitlines())
-    info = extract_info(ast)
+    start = time.time()
+    try:
+        output = get_ffmpeg_output(filepath)
+        ast = parse_ffmpeg_output(output.splitlines())
+        info = extract_info(ast, details)
+    finally:
+        end = time.time()
+        metrics.stages.observe('probe', end - start)
+        if tracing.tracer is not None:
+            tracing.tracer.complete('probe', start, end,
+                                    threading.currentThread().getName(),
+                                    args={'filename': filepath})
     logger.info('get_media_info: %r', info)
     return info
 
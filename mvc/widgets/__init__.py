@@ -1,7 +1,7 @@
-import logging
-import os
 import sys
 
+from mvc import frontend
+
 if sys.platform == 'darwin':
     import osx as plat
     from .osx import widgetset
@@ -20,10 +20,11 @@ get_conversion_directory = plat.get_conversion_directory
 def get_conversion_directory():
     return plat.get_conversion_directory()
 
+# the conversion core calls these through mvc.frontend
+frontend.install(idle_add=idle_add,
+                 get_conversion_directory=get_conversion_directory)
+
 def initialize(app):
-    try:
-        os.makedirs(get_conversion_directory())
-    except EnvironmentError, e:
-        logging.info('os.makedirs: %s', str(e))
+    frontend.create_conversion_directory()
     if app:
         plat.initialize(app)
@@ -25,7 +25,7 @@ setup_args = {
     ],
     'package_data': {
         'mvc.resources': [
-            'converters/*.py',
+            'converters/*.json',
             'images/*.*',
         ],
     },
@@ -0,0 +1,225 @@
+"""encode.py -- Benchmark the converters end to end.
+
+The inputs are generated with ffmpeg's lavfi sources (testsrc for video,
+sine for audio), so they are the same on every machine and no private
+media is needed.  They get cached in the --input-dir between runs.
+
+Every registered converter (or the ones given with -c) is run against every
+input through a ConversionManager, with --simultaneous conversions at a
+time.  For each preset we report:
+
+- encode fps: input frames per wall-clock second of the converter passes
+- CPU-seconds per second of output (user + system time of the passes)
+- output size
+- total wall time
+
+Usage: python test/benchmarks/encode.py [-j] [-c CONVERTER]... [-s N]
+           [--sizes 320x240,1280x720] [--durations 10,60]
+"""
+
+import json
+import optparse
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import mvc
+except ImportError:
+    mvc_path = os.path.join(os.path.dirname(__file__), '..', '..')
+    sys.path.append(mvc_path)
+
+from mvc import conversion
+from mvc import converter
+from mvc import execute
+from mvc import video
+from mvc.settings import get_ffmpeg_executable_path
+
+# frame rate of the generated inputs
+FRAME_RATE = 25
+
+def input_path(input_dir, size, duration):
+    return os.path.join(input_dir, 'testsrc-%s-%is.mkv' % (size, duration))
+
+def generate_input(path, size, duration):
+    """Generate a test input: the testsrc pattern with a sine tone.
+
+    Uses encoders that every ffmpeg build has, so that the inputs can be
+    made anywhere.
+    """
+    commandline = [get_ffmpeg_executable_path(), '-y',
+                   '-f', 'lavfi',
+                   '-i', 'testsrc=size=%s:rate=%i:duration=%i' % (
+                       size, FRAME_RATE, duration),
+                   '-f', 'lavfi',
+                   '-i', 'sine=frequency=440:sample_rate=44100:duration=%i' % (
+                       duration,),
+                   '-c:v', 'mpeg4', '-q:v', '2',
+                   '-c:a', 'mp2', '-b:a', '192k',
+                   path]
+    execute.check_output(commandline)
+
+def get_inputs(input_dir, sizes, durations):
+    """Get the list of input paths, generating the ones that are missing."""
+    if not os.path.exists(input_dir):
+        os.makedirs(input_dir)
+    paths = []
+    for size in sizes:
+        for duration in durations:
+            path = input_path(input_dir, size, duration)
+            if not os.path.exists(path):
+                print >> sys.stderr, 'generating %s' % path
+                generate_input(path, size, duration)
+            paths.append(path)
+    return paths
+
+def run_batch(conversion_manager, jobs, output_dir):
+    """Convert every (video, converter) pair in jobs.
+
+    :returns: (list of conversions, wall time of the whole batch)
+    """
+    conversions = []
+    start = time.time()
+    for v, c in jobs:
+        conversions.append(conversion_manager.run_conversion(
+                conversion_manager.get_conversion(v, c,
+                                                  output_dir=output_dir)))
+    while conversion_manager.running:
+        conversion_manager.notifications.wait(1)
+        conversion_manager.check_notifications()
+    conversion_manager.check_notifications()
+    return conversions, time.time() - start
+
+def conversion_result(c):
+    usage = c.get_resource_usage()
+    result = {'converter': c.converter.identifier,
+              'input': os.path.basename(c.video.filename),
+              'status': c.status,
+              'duration': c.video.duration,
+              'wall': usage.get('wall')}
+    if c.status != 'finished':
+        result['error'] = c.error
+        return result
+    result['output_size'] = os.path.getsize(c.output)
+    if usage.get('wall') and c.video.duration:
+        result['fps'] = c.video.duration * FRAME_RATE / usage['wall']
+    if 'user' in usage and c.video.duration:
+        result['cpu_per_second'] = ((usage['user'] + usage['system']) /
+                                    c.video.duration)
+    return result
+
+def summarize(results):
+    """Add up the per-conversion results for each converter."""
+    summaries = {}
+    for result in results:
+        summary = summaries.setdefault(result['converter'], {
+                'converter': result['converter'], 'conversions': 0,
+                'failed': 0, 'wall': 0.0, 'duration': 0.0, 'cpu': 0.0,
+                'output_size': 0})
+        summary['conversions'] += 1
+        if result['status'] != 'finished':
+            summary['failed'] += 1
+            continue
+        summary['wall'] += result['wall'] or 0.0
+        summary['duration'] += result['duration'] or 0.0
+        summary['cpu'] += (result.get('cpu_per_second', 0.0) *
+                           (result['duration'] or 0.0))
+        summary['output_size'] += result['output_size']
+    for summary in summaries.itervalues():
+        if summary['wall']:
+            summary['fps'] = summary['duration'] * FRAME_RATE / summary['wall']
+        if summary['duration']:
+            summary['cpu_per_second'] = summary['cpu'] / summary['duration']
+        del summary['cpu']
+    return [summaries[key] for key in sorted(summaries)]
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [-j] [-c CONVERTER]... [-s N] [--sizes SIZES] '
+        '[--durations SECONDS]')
+    parser.add_option('-j', '--json', action='store_true',
+                      help='Output JSON documents, rather than text.')
+    parser.add_option('-c', '--converter', action='append',
+                      dest='converters', default=[],
+                      help='only benchmark this converter (can be given '
+                      'more than once; default: all of them)')
+    parser.add_option('-s', '--simultaneous', type='int', default=1,
+                      help='how many conversions to run at once '
+                      '(default: %default)')
+    parser.add_option('--sizes', default='320x240,1280x720',
+                      help='comma-separated input sizes (default: %default)')
+    parser.add_option('--durations', default='10',
+                      help='comma-separated input durations in seconds '
+                      '(default: %default)')
+    parser.add_option('--input-dir',
+                      default=os.path.join(tempfile.gettempdir(),
+                                           'mvc-benchmark-inputs'),
+                      help='where to keep the generated inputs '
+                      '(default: %default)')
+    parser.add_option('--keep-outputs', dest='keep_outputs',
+                      action='store_true',
+                      help="don't delete the converted files")
+    (options, args) = parser.parse_args()
+
+    if get_ffmpeg_executable_path() is None:
+        parser.error("can't find ffmpeg")
+
+    converter_manager = converter.ConverterManager()
+    converter_manager.startup()
+    if options.converters:
+        try:
+            converters = [converter_manager.get_by_id(identifier)
+                          for identifier in options.converters]
+        except KeyError, e:
+            parser.error('unknown converter: %s' % e)
+    else:
+        converters = sorted(converter_manager.list_converters(),
+                            key=lambda c: c.identifier)
+
+    inputs = get_inputs(options.input_dir,
+                        options.sizes.split(','),
+                        [int(d) for d in options.durations.split(',')])
+    videos = [video.VideoFile(path) for path in inputs]
+    jobs = [(v, c) for c in converters for v in videos]
+
+    output_dir = tempfile.mkdtemp(prefix='mvc-benchmark-')
+    try:
+        conversion_manager = conversion.ConversionManager(
+            simultaneous=options.simultaneous)
+        conversions, total_wall = run_batch(conversion_manager, jobs,
+                                            output_dir)
+        results = [conversion_result(c) for c in conversions]
+    finally:
+        if options.keep_outputs:
+            print >> sys.stderr, 'outputs are in %s' % output_dir
+        else:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    summaries = summarize(results)
+    if options.json:
+        for result in results:
+            print json.dumps(result)
+        for summary in summaries:
+            print json.dumps({'summary': summary})
+        print json.dumps({'total_wall': total_wall,
+                          'simultaneous': options.simultaneous})
+    else:
+        print '%-24s %5s %9s %9s %10s %9s' % (
+            'converter', 'runs', 'fps', 'cpu/s', 'size', 'wall')
+        for summary in summaries:
+            print '%-24s %5i %9s %9s %10i %8.1fs%s' % (
+                summary['converter'], summary['conversions'],
+                '%.1f' % summary['fps'] if 'fps' in summary else '-',
+                '%.2f' % summary['cpu_per_second']
+                if 'cpu_per_second' in summary else '-',
+                summary['output_size'], summary['wall'],
+                ' (%i failed)' % summary['failed']
+                if summary['failed'] else '')
+        print 'total wall time: %.1fs with %i simultaneous' % (
+            total_wall, options.simultaneous)
+    sys.exit(1 if any(s['failed'] for s in summaries) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""micro.py -- Micro-benchmarks for the Python hot paths.
+
+None of these need ffmpeg: converter output comes from the logs in
+test/testdata/logs, and the MP4 files for qtfaststart are generated.
+
+Each benchmark runs its operation NUMBER times per round and reports the
+best round as seconds per operation.  Results can be saved as a baseline
+and later runs compared against it:
+
+    python test/benchmarks/micro.py --save baseline.json
+    (change things)
+    python test/benchmarks/micro.py --compare baseline.json
+
+When comparing, the exit status is 1 if any benchmark got slower by more
+than the threshold.
+
+Usage: python test/benchmarks/micro.py [-j] [-r ROUNDS] [--save FILE]
+                                       [--compare FILE] [BENCHMARK...]
+"""
+
+import json
+import optparse
+import os.path
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+try:
+    import mvc
+except ImportError:
+    mvc_path = os.path.join(os.path.dirname(__file__), '..', '..')
+    sys.path.append(mvc_path)
+
+from mvc import converter
+from mvc import conversion
+from mvc import execute
+from mvc import signals
+from mvc import utils
+from mvc import video
+from mvc.qtfaststart import processor
+
+from statusline import load_corpus
+
+# name -> (setup function, number of operations per round)
+BENCHMARKS = {}
+ORDER = []
+
+def benchmark(name, number):
+    """Register a benchmark.
+
+    The decorated function does the setup, and returns a function that
+    runs the operation once.  It can also return (function, cleanup).
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, number)
+        ORDER.append(name)
+        return setup
+    return register
+
+def corpus_lines(family):
+    lines = []
+    for name, klass, log_lines in load_corpus():
+        if klass is family:
+            lines.extend(log_lines)
+    return lines
+
+def probe_outputs():
+    """Get the input sections of the logs, which is what ffmpeg -i
+    prints.
+    """
+    outputs = []
+    for name, klass, lines in load_corpus():
+        if klass is not converter.FFmpegConverterInfo:
+            continue
+        header = []
+        for line in lines:
+            if line.startswith('Output #0'):
+                break
+            header.append(line)
+        outputs.append(header)
+    return outputs
+
+@benchmark('line_reader', 2)
+def bench_line_reader():
+    data = ''.join(line + '\r' for line in
+                   corpus_lines(converter.FFmpegConverterInfo))
+    def run():
+        for line in utils.line_reader(StringIO(data)):
+            pass
+    return run
+
+@benchmark('status_line.ffmpeg', 20)
+def bench_status_line_ffmpeg():
+    lines = corpus_lines(converter.FFmpegConverterInfo)
+    process = converter.FFmpegConverterInfo.process_status_line
+    def run():
+        for line in lines:
+            process(None, line)
+    return run
+
+@benchmark('status_line.ffmpeg2theora', 20)
+def bench_status_line_ffmpeg2theora():
+    lines = corpus_lines(converter.FFmpeg2TheoraConverterInfo)
+    process = converter.FFmpeg2TheoraConverterInfo.process_status_line
+    def run():
+        for line in lines:
+            process(None, line)
+    return run
+
+@benchmark('extract_info', 1000)
+def bench_extract_info():
+    outputs = probe_outputs()
+    def run():
+        for output in outputs:
+            video.extract_info(video.parse_ffmpeg_output(output))
+    return run
+
+def atom(kind, payload):
+    return struct.pack('>L4s', len(payload) + 8, kind) + payload
+
+def make_mp4(path, chunks, chunk_size):
+    """Write an MP4 with the moov atom after mdat, the way encoders leave
+    it.
+
+    The moov has a single track with an stco table pointing at each chunk.
+    """
+    ftyp = atom('ftyp', 'isom\x00\x00\x02\x00isomiso2mp41')
+    mdat_start = len(ftyp) + 8
+    offsets = [mdat_start + i * chunk_size for i in xrange(chunks)]
+    stco = atom('stco', struct.pack('>2L', 0, chunks) +
+                struct.pack('>%iL' % chunks, *offsets))
+    moov = atom('moov', atom('trak', atom('mdia', atom('minf',
+                                                       atom('stbl', stco)))))
+    with open(path, 'wb') as f:
+        f.write(ftyp)
+        f.write(struct.pack('>L4s', chunks * chunk_size + 8, 'mdat'))
+        chunk = '\x00' * chunk_size
+        for i in xrange(chunks):
+            f.write(chunk)
+        f.write(moov)
+
+@benchmark('qtfaststart.process', 20)
+def bench_qtfaststart():
+    temp_dir = tempfile.mkdtemp()
+    source = os.path.join(temp_dir, 'input.mp4')
+    output = os.path.join(temp_dir, 'output.mp4')
+    # 8MB of media in 2000 chunks
+    make_mp4(source, 2000, 4096)
+    def run():
+        processor.process(source, output)
+    def cleanup():
+        shutil.rmtree(temp_dir)
+    return run, cleanup
+
+@benchmark('SignalEmitter.emit', 10000)
+def bench_emit():
+    emitter = signals.SignalEmitter('changed')
+    class Listener(object):
+        def on_changed(self, emitter, value):
+            pass
+    listeners = [Listener() for i in xrange(10)]
+    for listener in listeners[:5]:
+        emitter.connect('changed', listener.on_changed)
+    for listener in listeners[5:]:
+        emitter.connect_weak('changed', listener.on_changed)
+    def run():
+        emitter.emit('changed', 1)
+    return run
+
+@benchmark('Cache.get', 10000)
+def bench_cache():
+    class SquareCache(utils.Cache):
+        def create_new_value(self, key, invalidator=None):
+            return key * key
+    cache = SquareCache(100)
+    # a working set a bit bigger than the cache, so that it has to shrink
+    # every so often
+    keys = [i % 120 for i in xrange(10000)]
+    position = [0]
+    def run():
+        cache.get(keys[position[0] % len(keys)])
+        position[0] += 1
+    return run
+
+def _bench_popen(use_posix_spawn):
+    # a few hundred MB of heap, like a front end that's been running for a
+    # while; fork() has to copy the page tables for all of it
+    ballast = [' ' * 4096 for i in xrange(64 * 1024)]
+    old_use_posix_spawn = execute.use_posix_spawn
+    execute.use_posix_spawn = use_posix_spawn
+    def run():
+        execute.Popen(['true']).wait()
+    def cleanup():
+        execute.use_posix_spawn = old_use_posix_spawn
+        del ballast[:]
+    return run, cleanup
+
+@benchmark('execute.Popen (posix_spawn)', 50)
+def bench_popen_spawn():
+    return _bench_popen(True)
+
+@benchmark('execute.Popen (fork)', 50)
+def bench_popen_fork():
+    return _bench_popen(False)
+
+class FakeConversion(object):
+    def __init__(self):
+        self.status = 'initialized'
+        self.queued_at = None
+        self.priority = 0
+        self.scheduling = None
+        self.cpus = None
+        self.slot = None
+        self.create_thumbnail = False
+        self.estimated_duration = 10.0
+        self.eta = 5.0
+
+    def run(self):
+        self.status = 'converting'
+
+@benchmark('ConversionManager.queue', 10)
+def bench_conversion_manager():
+    def run():
+        manager = conversion.ConversionManager(simultaneous=4)
+        conversions = [FakeConversion() for i in xrange(300)]
+        for c in conversions:
+            manager.run_conversion(c)
+        for c in conversions[-30:]:
+            manager.remove(c)
+            c.status = 'canceled'
+        while manager.in_progress:
+            manager.estimate_completion()
+            c = iter(manager.in_progress).next()
+            c.status = 'finished'
+            manager.conversion_finished(c)
+    return run
+
+def run_benchmark(name, rounds):
+    """Run a benchmark, and return the best time per operation."""
+    setup, number = BENCHMARKS[name]
+    result = setup()
+    if isinstance(result, tuple):
+        run, cleanup = result
+    else:
+        run, cleanup = result, None
+    try:
+        best = None
+        for i in xrange(rounds):
+            start = time.time()
+            for j in xrange(number):
+                run()
+            elapsed = (time.time() - start) / number
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * scale >= 1:
+            return '%.2f%s' % (seconds * scale, unit)
+    return '%.0fns' % (seconds * 1e9)
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [-j] [-r ROUNDS] [--save FILE] [--compare FILE] '
+        '[BENCHMARK...]')
+    parser.add_option('-r', '--rounds', type='int', default=5,
+                      help='run each benchmark this many rounds, and report '
+                      'the best one (default: %default)')
+    parser.add_option('-j', '--json', action='store_true',
+                      help='Output JSON documents, rather than text.')
+    parser.add_option('-l', '--list', action='store_true',
+                      help='List the benchmarks.')
+    parser.add_option('--save', dest='save',
+                      help='Save the results as a baseline to this file.')
+    parser.add_option('--compare', dest='compare',
+                      help='Compare the results against a baseline file.')
+    parser.add_option('--threshold', type='float', default=0.1,
+                      help='when comparing, how much slower (as a fraction) '
+                      'counts as a regression (default: %default)')
+    (options, args) = parser.parse_args()
+
+    if options.list:
+        for name in ORDER:
+            print name
+        return
+    names = args or ORDER
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %r' % name)
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    regressions = 0
+    for name in names:
+        per_op = results[name] = run_benchmark(name, options.rounds)
+        output = {'name': name, 'seconds_per_op': per_op,
+                  'ops_per_sec': 1.0 / max(per_op, 1e-12)}
+        change = None
+        if name in baseline:
+            change = per_op / baseline[name] - 1.0
+            output['baseline_seconds_per_op'] = baseline[name]
+            output['change'] = change
+            if change > options.threshold:
+                regressions += 1
+        if options.json:
+            print json.dumps(output)
+        else:
+            line = '%-28s %10s/op' % (name, format_time(per_op))
+            if change is not None:
+                line += '  (%+.1f%% vs baseline%s)' % (
+                    change * 100,
+                    ', REGRESSION' if change > options.threshold else '')
+            print line
+
+    if options.save:
+        with open(options.save, 'wb') as f:
+            json.dump({'time': time.time(), 'python': sys.version,
+                       'results': results}, f, indent=2, sort_keys=True)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""startup.py -- Time how long it takes to start up without a GUI.
+
+Each scenario runs in a fresh Python process, ROUNDS times, and the best
+and median wall-clock times get reported:
+
+- core: import converter, conversion, video and settings
+- app: also create an Application and start it (which loads the presets)
+- console: run python -m mvc.ui.console -l
+
+The core and app scenarios also check that no widget toolkit (gtk,
+gobject, AppKit) got imported along the way; if one did, the exit status
+is 1.
+
+Usage: python test/benchmarks/startup.py [-r ROUNDS] [-j] [SCENARIO...]
+"""
+
+import json
+import optparse
+import os.path
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+TOOLKIT_MODULES = ('gtk', 'gobject', 'AppKit', 'Foundation', 'mvc.widgets')
+
+CHECK_TOOLKIT = """
+import json, sys
+print json.dumps(sorted(name for name in sys.modules
+                        if name.split('.')[0] in %r or
+                        name.startswith('mvc.widgets')))
+""" % (TOOLKIT_MODULES,)
+
+SCENARIOS = [
+    ('core', ['-c', 'from mvc import converter, conversion, video, settings'
+              + CHECK_TOOLKIT]),
+    ('app', ['-c', 'import mvc\nmvc.Application().startup()'
+             + CHECK_TOOLKIT]),
+    ('console', ['-m', 'mvc.ui.console', '-l']),
+]
+
+def run(args):
+    """Run python with args.
+
+    :returns: (seconds, stdout)
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    start = time.time()
+    p = subprocess.Popen([sys.executable] + args, stdout=subprocess.PIPE,
+                         stderr=open(os.devnull, 'wb'), cwd=ROOT, env=env)
+    stdout, _ = p.communicate()
+    elapsed = time.time() - start
+    if p.returncode != 0:
+        raise RuntimeError('%r exited with %s' % (args, p.returncode))
+    return elapsed, stdout
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [-r ROUNDS] [-j] [SCENARIO...]')
+    parser.add_option('-r', '--rounds', type='int', default=10,
+                      help='start each scenario this many times '
+                      '(default: %default)')
+    parser.add_option('-j', '--json', action='store_true',
+                      help='Output JSON documents, rather than text.')
+    (options, args) = parser.parse_args()
+
+    toolkit_loaded = False
+    for name, python_args in SCENARIOS:
+        if args and name not in args:
+            continue
+        times = []
+        toolkit = []
+        for i in xrange(options.rounds):
+            elapsed, stdout = run(python_args)
+            times.append(elapsed)
+            if name != 'console':
+                toolkit = json.loads(stdout.splitlines()[-1])
+        times.sort()
+        best, median = times[0], times[len(times) // 2]
+        toolkit_loaded = toolkit_loaded or bool(toolkit)
+        if options.json:
+            print json.dumps({'scenario': name, 'best': best,
+                              'median': median, 'toolkit_modules': toolkit})
+        else:
+            print '%s: best %.3fs, median %.3fs%s' % (
+                name, best, median,
+                ', LOADED %s' % ', '.join(toolkit) if toolkit else '')
+    sys.exit(1 if toolkit_loaded else 0)
+
+if __name__ == '__main__':
+    main()
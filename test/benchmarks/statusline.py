@@ -0,0 +1,127 @@
+"""statusline.py -- Replay recorded converter logs through the status line
+parsers.
+
+Every log in test/testdata/logs is split into lines the same way
+Conversion.process_output() does it, then fed through process_status_line()
+for the matching converter family.  As a reference, the lines also go through
+the old approach of trying every regex in turn; the two must produce the same
+status dicts.
+
+Usage: python test/benchmarks/statusline.py [-r REPEAT] [-j]
+"""
+
+import glob
+import json
+import optparse
+import os.path
+import sys
+import time
+from StringIO import StringIO
+
+try:
+    import mvc
+except ImportError:
+    mvc_path = os.path.join(os.path.dirname(__file__), '..', '..')
+    sys.path.append(mvc_path)
+
+from mvc import converter
+from mvc.utils import hms_to_seconds, line_reader
+
+LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'testdata', 'logs')
+
+def regex_chain(klass, progress_key):
+    """Build the try-every-regex status line parser, for comparison."""
+    def parse_time(t):
+        if ':' in t:
+            hours, minutes, seconds = [float(m) for m in t.split(':')[:3]]
+            return hms_to_seconds(hours, minutes, seconds)
+        return float(t)
+
+    def process_status_line(video, line):
+        error = klass._check_for_errors(line)
+        if error:
+            return {'finished': True, 'error': error}
+        match = klass.DURATION_RE.match(line)
+        if match is not None:
+            hours, minutes, seconds, centi = [
+                int(m) for m in match.groups()[:4]]
+            return {'duration': hms_to_seconds(hours, minutes,
+                                               seconds + 0.01 * centi)}
+        match = klass.FIRST_PASS.match(line)
+        if match is not None:
+            if klass is converter.FFmpegConverterInfo:
+                return {'pass1': 0.2}
+            return {'pass1': parse_time(match.group(1))}
+        match = klass.PROGRESS_RE.match(line)
+        if match is not None:
+            return {progress_key: parse_time(match.group(1))}
+        match = klass.LAST_PROGRESS_RE.match(line)
+        if match is not None:
+            return {'finished': True}
+    return process_status_line
+
+def load_corpus():
+    """Returns a list of (name, converter class, lines) tuples."""
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(LOG_DIR, '*.log'))):
+        name = os.path.basename(path)
+        if name.startswith('ffmpeg2theora'):
+            klass = converter.FFmpeg2TheoraConverterInfo
+        else:
+            klass = converter.FFmpegConverterInfo
+        with open(path, 'rb') as f:
+            lines = list(line_reader(StringIO(f.read())))
+        corpus.append((name, klass, lines))
+    return corpus
+
+def replay(parsers, lines, repeat):
+    """Run lines through each parser repeat times.
+
+    The parsers take turns, so that they see the same machine load.
+
+    :returns: list of (best lines/sec, results from the last run) tuples, one
+    for each parser
+    """
+    best = [None] * len(parsers)
+    results = [None] * len(parsers)
+    for i in xrange(repeat):
+        for j, parse in enumerate(parsers):
+            start = time.time()
+            results[j] = [parse(None, line) for line in lines]
+            elapsed = time.time() - start
+            if best[j] is None or elapsed < best[j]:
+                best[j] = elapsed
+    return [(len(lines) / max(elapsed, 1e-9), result)
+            for elapsed, result in zip(best, results)]
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [-r REPEAT] [-j]')
+    parser.add_option('-r', '--repeat', type='int', default=20,
+                      help='replay each log this many times, and report '
+                      'the best run (default: %default)')
+    parser.add_option('-j', '--json', action='store_true',
+                      help='Output JSON documents, rather than text.')
+    (options, args) = parser.parse_args()
+
+    mismatches = 0
+    for name, klass, lines in load_corpus():
+        progress_key = ('pass2' if klass is converter.FFmpeg2TheoraConverterInfo
+                        else 'progress')
+        ((reference, expected), (dispatch, results)) = replay(
+            [regex_chain(klass, progress_key), klass.process_status_line],
+            lines, options.repeat)
+        different = sum(1 for a, b in zip(expected, results) if a != b)
+        mismatches += different
+        if options.json:
+            print json.dumps({'log': name, 'lines': len(lines),
+                              'lines_per_sec': dispatch,
+                              'regex_chain_lines_per_sec': reference,
+                              'mismatches': different})
+        else:
+            print '%s: %i lines, %.0f lines/sec (regex chain: %.0f, %.1fx)%s' % (
+                name, len(lines), dispatch, reference, dispatch / reference,
+                ', %i MISMATCHES' % different if different else '')
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()
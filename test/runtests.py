@@ -9,6 +9,19 @@ from test_video import *
 from test_converter import *
 from test_conversion import *
 from test_utils import *
+from test_throughput import *
+from test_execute import *
+from test_metrics import *
+from test_tracing import *
+from test_simulation import *
+from test_journal import *
+from test_segments import *
+from test_scheduling import *
+from test_concurrency import *
+from test_jobserver import *
+from test_capabilities import *
+from test_presets import *
+from test_frontend import *
 
 if __name__ == "__main__":
     import unittest
@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+
+from mvc import capabilities
+
+import base
+
+VERSION_OUTPUT = """\
+ffmpeg version 4.4.2-0ubuntu0.22.04.1 Copyright (c) 2000-2021 the FFmpeg developers
+built with gcc 11 (Ubuntu 11.2.0-19ubuntu1)
+"""
+
+ENCODERS_OUTPUT = """\
+Encoders:
+ V..... = Video
+ A..... = Audio
+ S..... = Subtitle
+ .F.... = Frame-level multithreading
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ V..... mpeg4                MPEG-4 part 2
+ A....D aac                  AAC (Advanced Audio Coding)
+ S..... srt                  SubRip subtitle
+"""
+
+MUXERS_OUTPUT = """\
+File formats:
+ D. = Demuxing supported
+ .E = Muxing supported
+ --
+  E mp4             MP4 (MPEG-4 Part 14)
+ D  mov,mp4,m4a,3gp,3g2,mj2 QuickTime / MOV
+  E ogg             Ogg
+ DE matroska,webm   Matroska / WebM
+"""
+
+FILTERS_OUTPUT = """\
+Filters:
+  T.. = Timeline support
+  ... = Source or sink filter
+ ..C scale             V->V       Scale the input video size.
+ T.. volume            A->A       Change input volume.
+ ... nullsink          V->|       Do absolutely nothing with the input video.
+"""
+
+OPTIONS_OUTPUT = """\
+Global options (affect whole program instead of just one file:
+-loglevel loglevel  set logging level
+-progress url       write program-readable progress information
+-y                  overwrite output files
+"""
+
+class ParseTest(base.Test):
+
+    def test_version(self):
+        self.assertEqual(capabilities.parse_version(VERSION_OUTPUT),
+                         (4, 4, 2))
+        self.assertEqual(capabilities.parse_version(
+                'ffmpeg version n6.0 Copyright'), (6, 0))
+        self.assertEqual(capabilities.parse_version(
+                'avconv version 0.8.3-4:0.8.3-0ubuntu0.12.04.1, Copyright'),
+                         (0, 8, 3))
+
+    def test_git_version(self):
+        self.assertEqual(capabilities.parse_version(
+                'ffmpeg version N-109421-g5e1b4e4 Copyright'), None)
+        self.assertEqual(capabilities.parse_version(''), None)
+
+    def test_encoders(self):
+        self.assertEqual(capabilities.parse_encoders(ENCODERS_OUTPUT),
+                         {'libx264': 'video', 'mpeg4': 'video',
+                          'aac': 'audio', 'srt': 'subtitle'})
+
+    def test_muxers(self):
+        self.assertEqual(capabilities.parse_muxers(MUXERS_OUTPUT),
+                         set(['mp4', 'ogg', 'matroska', 'webm']))
+
+    def test_filters(self):
+        self.assertEqual(capabilities.parse_filters(FILTERS_OUTPUT),
+                         set(['scale', 'volume', 'nullsink']))
+
+    def test_options(self):
+        self.assertEqual(capabilities.parse_options(OPTIONS_OUTPUT),
+                         set(['-loglevel', '-progress', '-y']))
+
+class CapabilitiesTest(base.Test):
+
+    def test_supports_progress(self):
+        caps = capabilities.Capabilities((4, 4), options=set(['-progress']))
+        self.assertTrue(caps.supports_progress)
+        caps = capabilities.Capabilities((4, 4), options=set(['-y']))
+        self.assertFalse(caps.supports_progress)
+        # without -h long, go by the version
+        self.assertEqual(capabilities.Capabilities(
+                (0, 8)).supports_progress, False)
+        self.assertEqual(capabilities.Capabilities(
+                (1, 2)).supports_progress, True)
+        self.assertEqual(capabilities.Capabilities().supports_progress, None)
+
+    def test_round_trip(self):
+        caps = capabilities.Capabilities(
+            (4, 4, 2), {'libx264': 'video'}, set(['mp4']), set(['scale']),
+            set(['-progress']))
+        copy = capabilities.Capabilities.from_dict(caps.to_dict())
+        self.assertEqual(copy.version, (4, 4, 2))
+        self.assertTrue(copy.has_encoder('libx264'))
+        self.assertFalse(copy.has_encoder('libvpx'))
+        self.assertTrue(copy.has_muxer('mp4'))
+        self.assertTrue(copy.has_filter('scale'))
+        self.assertTrue(copy.supports_progress)
+
+class CapabilityCacheTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'caps.json')
+        self.executable = os.path.join(self.temp_dir, 'ffmpeg')
+        with open(self.executable, 'wb') as f:
+            f.write('#!/bin/sh\n')
+        self.probed = []
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def probe(self, executable):
+        self.probed.append(executable)
+        return capabilities.Capabilities((4, 4), {'libx264': 'video'})
+
+    def test_cached(self):
+        cache = capabilities.CapabilityCache(self.path)
+        caps = cache.get(self.executable, probe=self.probe)
+        self.assertEqual(caps.version, (4, 4))
+        cache.get(self.executable, probe=self.probe)
+        self.assertEqual(len(self.probed), 1)
+        # a new cache reads the file instead of probing
+        cache = capabilities.CapabilityCache(self.path)
+        caps = cache.get(self.executable, probe=self.probe)
+        self.assertTrue(caps.has_encoder('libx264'))
+        self.assertEqual(len(self.probed), 1)
+
+    def test_upgraded(self):
+        cache = capabilities.CapabilityCache(self.path)
+        cache.get(self.executable, probe=self.probe)
+        with open(self.executable, 'ab') as f:
+            f.write('exit 0\n')
+        cache = capabilities.CapabilityCache(self.path)
+        cache.get(self.executable, probe=self.probe)
+        self.assertEqual(len(self.probed), 2)
+
+    def test_corrupt(self):
+        with open(self.path, 'wb') as f:
+            f.write('{not json')
+        cache = capabilities.CapabilityCache(self.path)
+        cache.get(self.executable, probe=self.probe)
+        self.assertEqual(len(self.probed), 1)
+
+class CapabilityLoaderTest(base.Test):
+
+    def test_missing_executable(self):
+        loader = capabilities.CapabilityLoader(
+            '/nonexistent/ffmpeg', capabilities.CapabilityCache(None))
+        loader.start()
+        self.assertEqual(loader.get(5), None)
+
+    def test_no_executable(self):
+        loader = capabilities.CapabilityLoader(
+            None, capabilities.CapabilityCache(None))
+        self.assertEqual(loader.get(), None)
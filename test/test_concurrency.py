@@ -0,0 +1,225 @@
+import os.path
+import shutil
+import sys
+import tempfile
+
+import mock
+
+from mvc import concurrency
+from mvc import conversion
+
+import base
+
+MB = 1024 * 1024
+
+class FakeConversion(object):
+    def __init__(self, width=1280, height=720, codec='libx264',
+                 identifier='mp4'):
+        self.priority = 0
+        self.status = 'initialized'
+        self.queued_at = None
+        self.slot = None
+        self.scheduling = None
+        self.cpus = None
+        self.create_thumbnail = False
+        self.progress = None
+        self.started_at = None
+        self.max_rss = None
+        self.video = mock.Mock(width=width, height=height,
+                               audio_only=width is None)
+        self.converter = mock.Mock(identifier=identifier, audio_only=False)
+        self.converter.get_target_size.return_value = (width, height)
+        self.converter.get_video_codec.return_value = codec
+
+    def run(self):
+        self.status = 'converting'
+
+    def get_resource_usage(self):
+        return {'max_rss': self.max_rss}
+
+class GetAvailableMemoryTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'meminfo')
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir)
+
+    def write_meminfo(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def test_mem_available(self):
+        if not sys.platform.startswith('linux'):
+            return
+        self.write_meminfo('MemTotal:       16000000 kB\n'
+                           'MemFree:         1000000 kB\n'
+                           'MemAvailable:    8000000 kB\n')
+        self.assertEqual(concurrency.get_available_memory(self.path),
+                         8000000 * 1024)
+
+    def test_old_kernel(self):
+        if not sys.platform.startswith('linux'):
+            return
+        self.write_meminfo('MemTotal:       16000000 kB\n'
+                           'MemFree:         1000000 kB\n'
+                           'Buffers:          200000 kB\n'
+                           'Cached:          3000000 kB\n')
+        self.assertEqual(concurrency.get_available_memory(self.path),
+                         4200000 * 1024)
+
+    def test_missing(self):
+        self.assertEqual(concurrency.get_available_memory(self.path), None)
+
+class AdaptiveConcurrencyTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.manager = conversion.ConversionManager(simultaneous=2)
+        self.adaptive = concurrency.AdaptiveConcurrency(
+            minimum=1, maximum=4, max_load=4.0, memory_reserve=100 * MB,
+            interval=10, hold_time=60)
+        self.load = 1.0
+        self.memory = 4096 * MB
+        self.adaptive.get_load_average = lambda: self.load
+        self.adaptive.get_available_memory = lambda: self.memory
+        self.manager.concurrency = self.adaptive
+        self.now = 0.0
+        self.manager.clock = lambda: self.now
+        self.conversions = [self.manager.run_conversion(FakeConversion())
+                            for i in xrange(6)]
+        self.adaptive.update(self.manager, self.now)
+
+    def advance(self, seconds, speed):
+        """Let time pass, with each running conversion converting at
+        speed.
+        """
+        self.now += seconds
+        for c in self.manager.in_progress:
+            c.progress = (c.progress or 0.0) + seconds * speed
+
+    def test_probe_and_keep(self):
+        self.advance(10, 1.0)
+        self.assertTrue(self.adaptive.update(self.manager, self.now))
+        self.assertEqual(self.manager.simultaneous, 3)
+        self.manager.start_waiting()
+        self.assertEqual(len(self.manager.in_progress), 3)
+        # 3 conversions at 1x is faster than 2 were, so we keep the slot
+        self.advance(10, 1.0)
+        self.assertFalse(self.adaptive.update(self.manager, self.now))
+        self.assertEqual(self.manager.simultaneous, 3)
+        # and try another one next time
+        self.advance(10, 1.0)
+        self.assertTrue(self.adaptive.update(self.manager, self.now))
+        self.assertEqual(self.manager.simultaneous, 4)
+
+    def test_probe_and_revert(self):
+        self.advance(10, 1.0)
+        self.adaptive.update(self.manager, self.now)
+        self.manager.start_waiting()
+        # 3 conversions at 0.6x isn't faster than 2 at 1x
+        self.advance(10, 0.6)
+        self.assertTrue(self.adaptive.update(self.manager, self.now))
+        self.assertEqual(self.manager.simultaneous, 2)
+        # and we don't try again for a while
+        self.advance(10, 0.6)
+        self.assertFalse(self.adaptive.update(self.manager, self.now))
+        self.now += 60
+        self.assertTrue(self.adaptive.update(self.manager, self.now))
+        self.assertEqual(self.manager.simultaneous, 3)
+
+    def test_interval(self):
+        self.advance(5, 1.0)
+        self.assertFalse(self.adaptive.update(self.manager, self.now))
+        self.assertEqual(self.manager.simultaneous, 2)
+
+    def test_high_load(self):
+        self.load = 6.0
+        self.advance(10, 1.0)
+        self.adaptive.update(self.manager, self.now)
+        self.assertEqual(self.manager.simultaneous, 1)
+        # never below the minimum
+        self.advance(10, 1.0)
+        self.adaptive.update(self.manager, self.now)
+        self.assertEqual(self.manager.simultaneous, 1)
+
+    def test_low_memory(self):
+        self.memory = 50 * MB
+        self.advance(10, 1.0)
+        self.adaptive.update(self.manager, self.now)
+        self.assertEqual(self.manager.simultaneous, 1)
+
+    def test_maximum(self):
+        self.manager.simultaneous = 4
+        self.manager.start_waiting()
+        self.advance(10, 1.0)
+        self.assertFalse(self.adaptive.update(self.manager, self.now))
+        self.assertEqual(self.manager.simultaneous, 4)
+
+    def test_not_busy(self):
+        self.manager.simultaneous = 10
+        self.adaptive.maximum = 20
+        self.manager.start_waiting()
+        self.advance(10, 1.0)
+        # fewer conversions than slots; another slot wouldn't help
+        self.assertFalse(self.adaptive.update(self.manager, self.now))
+
+class FootprintTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.adaptive = concurrency.AdaptiveConcurrency(maximum=4)
+        self.memory = 1024 * MB
+        self.adaptive.get_available_memory = lambda: self.memory
+        self.manager = conversion.ConversionManager(simultaneous=4)
+        self.manager.concurrency = self.adaptive
+        self.manager.clock = lambda: 100.0
+
+    def test_estimate(self):
+        small = self.adaptive.estimate_footprint(FakeConversion(640, 360))
+        large = self.adaptive.estimate_footprint(FakeConversion(1920, 1080))
+        theora = self.adaptive.estimate_footprint(
+            FakeConversion(1920, 1080, 'libtheora'))
+        audio = self.adaptive.estimate_footprint(FakeConversion(None, None))
+        self.assertEqual(audio, concurrency.BASE_FOOTPRINT)
+        self.assertTrue(audio < small < large)
+        self.assertTrue(theora < large)
+
+    def test_record(self):
+        c = FakeConversion(640, 360)
+        estimate = self.adaptive.estimate_footprint(c)
+        c.max_rss = 2 * estimate
+        self.adaptive.record_footprint(c)
+        self.assertAlmostEqual(self.adaptive.estimate_footprint(c),
+                               2 * estimate, -3)
+        # a smaller peak doesn't lower it
+        c.max_rss = estimate / 2
+        self.adaptive.record_footprint(c)
+        self.assertAlmostEqual(self.adaptive.estimate_footprint(c),
+                               2 * estimate, -3)
+
+    def test_admission(self):
+        first = self.manager.run_conversion(FakeConversion(1920, 1080))
+        # the first one always starts
+        self.memory = 10 * MB
+        self.assertTrue(first in self.manager.in_progress)
+        second = self.manager.run_conversion(FakeConversion(1920, 1080))
+        self.assertEqual(list(self.manager.waiting), [second])
+        # once there's room, it starts on the next check
+        self.memory = 4096 * MB
+        self.manager.adjust_concurrency()
+        self.assertTrue(second in self.manager.in_progress)
+
+    def test_starting_conversions_count(self):
+        footprint = self.adaptive.estimate_footprint(
+            FakeConversion(1920, 1080))
+        self.adaptive.memory_reserve = 0
+        self.memory = footprint * 2.5
+        conversions = [self.manager.run_conversion(FakeConversion(1920, 1080))
+                       for i in xrange(4)]
+        # the free memory doesn't show the conversions that just started
+        # yet, so only one more fits besides the first
+        self.assertEqual(len(self.manager.in_progress), 2)
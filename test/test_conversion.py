@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
+import gzip
 import json
 import os.path
 import shutil
 import sys
 import tempfile
 import time
+from StringIO import StringIO
 
 from mvc import video
 from mvc import converter
 from mvc import conversion
+from mvc import jobserver
+from mvc import metrics
+from mvc import scheduling
 
 import base
+import mock
 
 
 class FakeConverterInfo(converter.ConverterInfo):
@@ -25,6 +31,9 @@ class FakeConverterInfo(converter.ConverterInfo):
                 os.path.dirname(__file__), 'testdata', 'fake_converter.py'),
                 video.filename, output]
 
+    def get_jobs(self, video, output):
+        return [[self.get_executable()] + self.get_arguments(video, output)]
+
     def process_status_line(self, video, line):
         return json.loads(line)
 
@@ -73,7 +82,7 @@ class ConversionManagerTest(base.Test):
         return c
 
     def test_initial(self):
-        self.assertEqual(self.manager.notify_queue, set())
+        self.assertTrue(self.manager.notifications.is_empty())
         self.assertEqual(self.manager.in_progress, set())
         self.assertFalse(self.manager.running)
 
@@ -122,6 +131,56 @@ class ConversionManagerTest(base.Test):
         self.assertEqual(c.error, '%r does not exist' % missing)
         self.assertFalse(os.path.exists(c.output))
 
+    def test_encoders_recorded(self):
+        option = converter.EncoderOption('fake', '-fast')
+        pinned = []
+        def with_encoders(encoders):
+            pinned.append(encoders)
+            return self.converter
+        self.converter.choose_encoders = lambda video: {'video': option}
+        self.converter.with_encoders = with_encoders
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        c = self.start_conversion(filename)
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(c.encoders, {'video': option})
+        self.assertEqual(pinned, [{'video': option}])
+
+    def test_stream_plan(self):
+        video_option = converter.EncoderOption('fake')
+        audio_option = converter.EncoderOption('fake_audio')
+        pinned = []
+        def with_encoders(encoders):
+            pinned.append(dict(encoders))
+            return self.converter
+        self.converter.choose_encoders = lambda video: {
+            'video': video_option, 'audio': audio_option}
+        self.converter.plan_streams = lambda video, encoders: {
+            'video': 'copy', 'audio': 'input is vorbis, not fake_audio'}
+        self.converter.with_encoders = with_encoders
+        filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        c = self.start_conversion(filename)
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(c.encoders, {'video': converter.STREAM_COPY,
+                                      'audio': audio_option})
+        self.assertEqual(c.copied_streams, ['video'])
+        # the jobs come from the converter pinned to copy the video
+        self.assertEqual(pinned, [{'video': converter.STREAM_COPY,
+                                   'audio': audio_option}])
+        # turned off, everything gets encoded
+        self.manager.stream_copy = False
+        os.remove(c.output)
+        c = self.start_conversion(filename)
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(c.stream_plan, None)
+        self.assertEqual(c.encoders, {'video': video_option,
+                                      'audio': audio_option})
+        self.assertEqual(pinned[1:], [{'video': video_option,
+                                       'audio': audio_option}])
+
     def test_multiple_simultaneous_conversions(self):
         filename = os.path.join(self.temp_dir, 'webm-0.webm')
         shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
@@ -188,3 +247,552 @@ class ConversionManagerTest(base.Test):
         self.spin(1)
         self.assertEqual(c.status, 'canceled')
         self.assertEqual(c.error, 'manually stopped')
+
+
+class ConversionLogTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.manager = conversion.ConversionManager()
+        self.temp_dir = tempfile.mkdtemp()
+        vf = mock.Mock(filename=os.path.join(self.temp_dir, 'input.webm'),
+                       duration=5.0)
+        self.conversion = self.manager.get_conversion(
+            vf, FakeConverterInfo('Fake'), output_dir=self.temp_dir)
+        self.output_lines = ['{"line": %i}' % i
+                             for i in range(conversion.MAX_LOG_LINES * 2)]
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def run_output(self):
+        self.conversion.popen = mock.Mock()
+        self.conversion.popen.stdout = StringIO('\n'.join(self.output_lines))
+        self.conversion.open_log()
+        self.conversion.process_output()
+        self.conversion.close_log()
+
+    def test_keeps_last_lines(self):
+        self.run_output()
+        self.assertEqual(list(self.conversion.lines),
+                         self.output_lines[-conversion.MAX_LOG_LINES:])
+        self.assertEqual(self.conversion.log_path, None)
+        self.assertEqual(self.conversion.get_log(), ''.join(
+                line + '\n'
+                for line in self.output_lines[-conversion.MAX_LOG_LINES:]))
+
+    def test_log_dir(self):
+        self.manager.log_dir = self.temp_dir
+        self.run_output()
+        self.assertEqual(len(self.conversion.lines),
+                         conversion.MAX_LOG_LINES)
+        self.assertEqual(os.path.dirname(self.conversion.log_path),
+                         self.temp_dir)
+        expected = ''.join(line + '\n' for line in self.output_lines)
+        self.assertEqual(gzip.open(self.conversion.log_path).read(),
+                         expected)
+        self.assertEqual(self.conversion.get_log(), expected)
+
+
+class NotificationBusTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.bus = conversion.NotificationBus(max_rate=10)
+        self.wakeups = []
+        self.bus.wakeup = lambda: self.wakeups.append(time.time())
+        self.conversion = mock.Mock(status='converting')
+
+    def test_first_post_is_immediate(self):
+        self.bus.post(self.conversion)
+        self.assertEqual(len(self.wakeups), 1)
+        self.assertEqual(self.bus.collect(), [self.conversion])
+        self.assertTrue(self.bus.is_empty())
+
+    def test_coalesce(self):
+        self.bus.post(self.conversion)
+        self.assertEqual(self.bus.collect(), [self.conversion])
+        for i in range(5):
+            self.bus.post(self.conversion)
+        # too soon after the last one
+        self.assertEqual(self.bus.collect(), [])
+        self.assertFalse(self.bus.is_empty())
+        self.bus.wait(1)
+        self.assertEqual(self.bus.collect(), [self.conversion])
+        self.assertEqual(len(self.wakeups), 2)
+
+    def test_status_change_is_immediate(self):
+        self.bus.post(self.conversion)
+        self.bus.collect()
+        self.bus.post(self.conversion)
+        self.conversion.status = 'finished'
+        self.bus.post(self.conversion)
+        self.assertEqual(self.bus.collect(), [self.conversion])
+        self.assertEqual(self.bus.delivered, {})
+
+    def test_wakeup_once_until_collected(self):
+        other = mock.Mock(status='converting')
+        self.bus.post(self.conversion)
+        self.bus.post(other)
+        self.assertEqual(len(self.wakeups), 1)
+        self.assertEqual(set(self.bus.collect()), set([self.conversion, other]))
+
+    def test_wakeup_while_not_running(self):
+        manager = conversion.ConversionManager()
+        manager.notifications.wakeup = self.bus.wakeup
+        manager.notifications.post(self.conversion)
+        self.assertEqual(len(self.wakeups), 1)
+        manager.check_notifications()
+        manager.running = True
+        other = mock.Mock(status='converting', listeners=[])
+        manager.notifications.post(other)
+        self.assertEqual(len(self.wakeups), 2)
+
+
+class EstimateCompletionTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.manager = conversion.ConversionManager(simultaneous=2)
+
+    def make_conversion(self, status, eta=None, estimated_duration=None):
+        return mock.Mock(status=status, eta=eta,
+                         estimated_duration=estimated_duration)
+
+    def test_empty(self):
+        self.assertEqual(self.manager.estimate_completion(), 0.0)
+
+    def test_queue(self):
+        self.manager.in_progress.add(self.make_conversion('converting', 10))
+        self.manager.in_progress.add(self.make_conversion('converting', 30))
+        for duration in (20, 5, 5):
+            self.manager.waiting.append(self.make_conversion(
+                'initialized', estimated_duration=duration))
+        # slot 1: 10 + 20, slot 2: 30, then 5 + 5 in slot 1 or 2
+        self.assertEqual(self.manager.estimate_completion(), 35)
+
+    def test_unknown(self):
+        self.manager.in_progress.add(self.make_conversion('converting', 10))
+        self.manager.waiting.append(self.make_conversion('initialized'))
+        self.assertEqual(self.manager.estimate_completion(), None)
+
+
+class ResourceUsageTest(base.Test):
+
+    def test_total_resource_usage(self):
+        self.assertEqual(conversion.total_resource_usage([
+                    {'wall': 1.0, 'user': 0.5, 'max_rss': 100,
+                     'read_bytes': 512},
+                    {'wall': 2.0, 'user': 1.5, 'max_rss': 50,
+                     'read_bytes': 1024, 'passes': [{'wall': 2.0}]},
+                    ]),
+                         {'wall': 3.0, 'user': 2.0, 'max_rss': 100,
+                          'read_bytes': 1536})
+
+    def test_empty(self):
+        self.assertEqual(conversion.total_resource_usage([]), {})
+
+
+class StageTest(base.Test):
+
+    def test_stage(self):
+        manager = conversion.ConversionManager()
+        manager.metrics = metrics.StageMetrics()
+        converter = mock.Mock()
+        converter.get_output_filename.return_value = 'output.fake'
+        c = conversion.Conversion(mock.Mock(filename='input.avi'), converter,
+                                  manager, output_dir=tempfile.gettempdir())
+        def fail():
+            with c.stage('finalize'):
+                raise ValueError
+        # the time gets recorded even if the stage raises
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(manager.metrics.to_dict()['finalize']['count'], 1)
+
+
+class PauseTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.manager = conversion.ConversionManager()
+        converter = mock.Mock()
+        converter.get_output_filename.return_value = 'output.fake'
+        self.conversion = conversion.Conversion(
+            mock.Mock(filename='input.avi'), converter, self.manager,
+            output_dir=tempfile.gettempdir())
+        self.conversion.popen = mock.Mock()
+        self.conversion.can_pause = lambda: True
+
+    def test_pause_resume(self):
+        c = self.conversion
+        c.status = 'converting'
+        c.started_at = 100.0
+        self.assertTrue(c.pause())
+        self.assertEqual(c.status, 'paused')
+        self.assertTrue(c.popen.suspend.called)
+        self.assertFalse(c.unpaused.is_set())
+        # pretend we were paused for 5 seconds
+        c.paused_at -= 5
+        self.assertTrue(c.resume())
+        self.assertEqual(c.status, 'converting')
+        self.assertTrue(c.popen.resume.called)
+        self.assertTrue(c.unpaused.is_set())
+        self.assertTrue(104.9 < c.started_at < 105.1)
+
+    def test_only_pause_converting(self):
+        self.assertFalse(self.conversion.pause())
+        self.assertEqual(self.conversion.status, 'initialized')
+        self.assertFalse(self.conversion.resume())
+
+    def test_stop_while_paused(self):
+        c = self.conversion
+        c.status = 'converting'
+        c.started_at = time.time()
+        c.pause()
+        self.manager.in_progress.add(c)
+        c.stop()
+        self.assertTrue(c.unpaused.is_set())
+        self.assertTrue(c.popen is None)
+        self.assertEqual(c.status, 'canceled')
+
+
+class SameOutputConverterInfo(FakeConverterInfo):
+    """Makes the same output as every other SameOutputConverterInfo."""
+
+    def get_signature(self, video):
+        return 'same'
+
+class DedupeTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, 'webm-0.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        self.filename)
+        self.video = mock.Mock(filename=self.filename, duration=5.0,
+                               width=1920, height=912, audio_only=False)
+        self.manager = conversion.ConversionManager()
+        self.manager.dedupe = True
+        patcher = mock.patch('mvc.conversion.get_thumbnail_synchronous')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def queue(self, name, output_dir):
+        c = self.manager.get_conversion(
+            self.video, SameOutputConverterInfo(name),
+            output_dir=os.path.join(self.temp_dir, output_dir))
+        if not os.path.exists(c.output_dir):
+            os.makedirs(c.output_dir)
+        return self.manager.run_conversion(c)
+
+    def spin(self, timeout=5):
+        finish_by = time.time() + timeout
+        while time.time() < finish_by and self.manager.running:
+            self.manager.check_notifications()
+            time.sleep(0.1)
+
+    def test_dedupe(self):
+        phone = self.queue('Phone', 'phone')
+        tablet = self.queue('Tablet', 'tablet')
+        same_dir = self.queue('Phone 2', 'phone')
+        self.assertEqual(self.manager.in_progress, set([phone]))
+        self.assertEqual(phone.followers, [tablet, same_dir])
+        self.assertTrue(self.manager.is_duplicate(tablet))
+        self.spin()
+        for c in (phone, tablet, same_dir):
+            self.assertEqual(c.status, 'finished')
+            self.assertEqual(file(c.output).read(), 'blank')
+        self.assertEqual(tablet.leader, phone)
+        self.assertEqual(same_dir.output, phone.output)
+        self.assertEqual(len(os.listdir(os.path.dirname(phone.output))), 1)
+
+    def test_followers_take_slots(self):
+        self.manager.simultaneous = 1
+        running = []
+        start_conversion = self.manager._start_conversion
+        def _start_conversion(conversion):
+            start_conversion(conversion)
+            running.append(len(self.manager.in_progress))
+        self.manager._start_conversion = _start_conversion
+        phone = self.queue('Phone', 'phone')
+        followers = [self.queue('Tablet', 'tablet'),
+                     self.queue('Laptop', 'laptop')]
+        self.spin()
+        for c in followers:
+            self.assertEqual(c.status, 'finished')
+            self.assertEqual(c.leader, phone)
+        self.assertEqual(running, [1, 1, 1])
+
+    def test_leader_canceled(self):
+        phone = self.queue('Phone', 'phone')
+        tablet = self.queue('Tablet', 'tablet')
+        while phone.popen is None:
+            time.sleep(0.01)
+        phone.stop()
+        self.assertEqual(tablet.leader, None)
+        self.assertTrue(tablet in self.manager.in_progress)
+        self.spin()
+        self.assertEqual(tablet.status, 'finished')
+
+    def test_leader_failed(self):
+        self.video.filename = os.path.join(self.temp_dir, 'error.webm')
+        phone = self.queue('Phone', 'phone')
+        tablet = self.queue('Tablet', 'tablet')
+        self.spin()
+        self.assertEqual(phone.status, 'failed')
+        self.assertEqual(tablet.status, 'failed')
+        self.assertFalse(os.path.exists(tablet.output))
+
+class FakeFFmpegConverterInfo(converter.FFmpegConverterInfo):
+    """Runs testdata/fake_ffmpeg.py instead of ffmpeg."""
+
+    extension = 'fake'
+    parameters = '-f fake'
+
+    def get_executable(self):
+        return sys.executable
+
+    def fake_ffmpeg(self, commandline):
+        return [sys.executable, '-u', os.path.join(
+                os.path.dirname(__file__), 'testdata', 'fake_ffmpeg.py')
+                ] + commandline[1:]
+
+    def get_jobs(self, video, output):
+        return [self.fake_ffmpeg(commandline) for commandline in
+                converter.FFmpegConverterInfo.get_jobs(self, video, output)]
+
+    def get_concat_job(self, concat_list, output):
+        return self.fake_ffmpeg(converter.FFmpegConverterInfo.get_concat_job(
+                self, concat_list, output))
+
+    def get_progress_arguments(self, fd):
+        return None
+
+class SegmentedConversionTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        filename = os.path.join(self.temp_dir, 'in.webm')
+        shutil.copyfile(os.path.join(self.testdata_dir, 'webm-0.webm'),
+                        filename)
+        self.video = mock.Mock(filename=filename, duration=5.0, width=640,
+                               height=480, audio_only=False)
+        self.manager = conversion.ConversionManager()
+        self.manager.segment_length = 2.0
+        for target in ('mvc.conversion.get_thumbnail_synchronous',
+                       'mvc.settings.get_ffmpeg_capabilities'):
+            patcher = mock.patch(target, return_value=None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def run_conversion(self, converter_info):
+        c = self.manager.get_conversion(self.video, converter_info,
+                                        output_dir=self.temp_dir)
+        self.manager.run_conversion(c)
+        finish_by = time.time() + 10
+        while time.time() < finish_by and self.manager.running:
+            self.manager.check_notifications()
+            time.sleep(0.1)
+        self.assertFalse(self.manager.running)
+        return c
+
+    def test_segmented(self):
+        c = self.run_conversion(FakeFFmpegConverterInfo('Fake'))
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(file(c.output).read(),
+                         '0.000 2.000\n2.000 3.000\n')
+        # the scratch directory is cleaned up
+        self.assertEqual(sorted(os.listdir(self.temp_dir)),
+                         ['in.fake', 'in.webm'])
+
+    def test_resume_throughput(self):
+        self.manager.throughput_history = mock.Mock()
+        c = self.run_conversion(FakeFFmpegConverterInfo('Fake'))
+        self.assertEqual(c.encoded_duration, 5.0)
+        os.remove(c.output)
+        # a retry that finds the first segment done only encodes the rest
+        def make_checkpoint(*args):
+            checkpoint = real_checkpoint(*args)
+            with open(checkpoint.partial_path(0), 'w') as f:
+                f.write('0.000 2.000\n')
+            checkpoint.mark_done(0)
+            return checkpoint
+        real_checkpoint = conversion.segments.SegmentCheckpoint
+        with mock.patch('mvc.segments.SegmentCheckpoint', make_checkpoint):
+            c = self.run_conversion(FakeFFmpegConverterInfo('Fake'))
+        self.assertEqual(c.status, 'finished')
+        self.assertEqual(c.encoded_duration, 3.0)
+        recorded = [call[0][2] for call in
+                    self.manager.throughput_history.record.call_args_list]
+        self.assertEqual(recorded, [5.0, 3.0])
+
+    def test_exception(self):
+        converter_info = FakeFFmpegConverterInfo('Fake')
+        converter_info.get_segment_jobs = mock.Mock(
+            side_effect=NotImplementedError)
+        c = self.run_conversion(converter_info)
+        self.assertEqual(c.status, 'failed')
+        self.assertEqual(c.error, 'NotImplementedError')
+        self.assertEqual(self.manager.in_progress, set())
+
+class FakeConversion(object):
+    def __init__(self, priority=0, eta=10.0):
+        self.priority = priority
+        self.eta = eta
+        self.scheduling = None
+        self.cpus = None
+        self.status = 'initialized'
+        self.queued_at = None
+        self.slot = None
+        self.create_thumbnail = False
+        self.estimated_duration = eta
+
+    def run(self):
+        self.status = 'converting'
+
+    def pause(self):
+        self.status = 'paused'
+        return True
+
+    def resume(self):
+        self.status = 'converting'
+        return True
+
+    def finish(self, manager):
+        self.status = 'finished'
+        manager.conversion_finished(self)
+
+
+class PreemptionTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.manager = conversion.ConversionManager(simultaneous=2)
+        self.manager.preempt = True
+
+    def test_waiting_order(self):
+        low, high, normal = (FakeConversion(-1), FakeConversion(5),
+                             FakeConversion(0))
+        self.manager.simultaneous = 0
+        for c in (low, normal, high):
+            self.manager.run_conversion(c)
+        other = FakeConversion(0)
+        self.manager.run_conversion(other)
+        self.assertEqual(list(self.manager.waiting),
+                         [high, normal, other, low])
+
+    def test_preempt(self):
+        short, long = FakeConversion(eta=10), FakeConversion(eta=100)
+        self.manager.run_conversion(short)
+        self.manager.run_conversion(long)
+        urgent = self.manager.run_conversion(FakeConversion(priority=1))
+        # the one with more left to do gets paused
+        self.assertEqual(long.status, 'paused')
+        self.assertEqual(self.manager.preempted, [long])
+        self.assertEqual(self.manager.in_progress, set([short, urgent]))
+        self.assertEqual(urgent.status, 'converting')
+        self.assertEqual(urgent.slot, 2)
+        # when a slot frees up, the paused conversion goes before the ones
+        # waiting
+        waiting = self.manager.run_conversion(FakeConversion())
+        self.assertEqual(list(self.manager.waiting), [waiting])
+        urgent.finish(self.manager)
+        self.assertEqual(long.status, 'converting')
+        self.assertEqual(self.manager.preempted, [])
+        self.assertEqual(list(self.manager.waiting), [waiting])
+        self.assertTrue(self.manager.running)
+
+    def test_no_preempt_for_same_priority(self):
+        self.manager.run_conversion(FakeConversion())
+        self.manager.run_conversion(FakeConversion())
+        c = self.manager.run_conversion(FakeConversion())
+        self.assertEqual(self.manager.preempted, [])
+        self.assertEqual(list(self.manager.waiting), [c])
+
+    def test_preempt_off(self):
+        self.manager.preempt = False
+        self.manager.run_conversion(FakeConversion())
+        self.manager.run_conversion(FakeConversion())
+        c = self.manager.run_conversion(FakeConversion(priority=1))
+        self.assertEqual(self.manager.preempted, [])
+        self.assertEqual(list(self.manager.waiting), [c])
+
+    def test_no_preempt_with_jobserver(self):
+        # make -j1: no tokens in the pipe, just the implicit one
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        self.manager.jobserver = jobserver.JobServerClient(read_fd, write_fd)
+        first = self.manager.run_conversion(FakeConversion())
+        self.manager.run_conversion(FakeConversion())
+        urgent = self.manager.run_conversion(FakeConversion(priority=1))
+        self.assertEqual(self.manager.preempted, [])
+        self.assertEqual(list(self.manager.waiting), [urgent])
+        first.finish(self.manager)
+        self.assertEqual(urgent.status, 'converting')
+
+    def test_higher_priority_waiting_goes_first(self):
+        first = self.manager.run_conversion(FakeConversion(eta=10))
+        preempted = self.manager.run_conversion(FakeConversion(eta=100))
+        self.manager.run_conversion(FakeConversion(priority=1))
+        self.assertEqual(self.manager.preempted, [preempted])
+        self.manager.preempt = False
+        urgent = self.manager.run_conversion(FakeConversion(priority=2))
+        first.finish(self.manager)
+        self.assertEqual(urgent.status, 'converting')
+        self.assertEqual(preempted.status, 'paused')
+
+    def test_stop_preempted(self):
+        self.manager.run_conversion(FakeConversion())
+        self.manager.run_conversion(FakeConversion())
+        self.manager.run_conversion(FakeConversion(priority=1))
+        preempted = self.manager.preempted[0]
+        preempted.status = 'canceled'
+        self.manager.conversion_finished(preempted)
+        self.assertEqual(self.manager.preempted, [])
+        self.assertEqual(len(self.manager.in_progress), 2)
+
+
+class SchedulingTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.manager = conversion.ConversionManager()
+        self.manager.cores = scheduling.CoreAllocator(range(4))
+        self.background = scheduling.CLASSES['background'].with_cores(2)
+        self.manager.default_scheduling = self.background
+
+    def test_by_priority(self):
+        idle = scheduling.CLASSES['idle']
+        self.manager.scheduling_by_priority[-1] = idle
+        self.assertEqual(self.manager.run_conversion(
+                FakeConversion(-1)).scheduling, idle)
+        c = self.manager.run_conversion(FakeConversion())
+        self.assertEqual(c.scheduling, self.background)
+
+    def test_own_scheduling(self):
+        c = FakeConversion()
+        c.scheduling = scheduling.CLASSES['normal']
+        self.manager.run_conversion(c)
+        self.assertEqual(c.scheduling, scheduling.CLASSES['normal'])
+        self.assertEqual(c.cpus, None)
+
+    def test_cpus(self):
+        first = self.manager.run_conversion(FakeConversion())
+        second = self.manager.run_conversion(FakeConversion())
+        self.assertEqual((first.cpus, second.cpus), ([0, 1], [2, 3]))
+        first.finish(self.manager)
+        self.assertEqual(first.cpus, None)
+        self.assertEqual(self.manager.run_conversion(FakeConversion()).cpus,
+                         [0, 1])
@@ -1,7 +1,11 @@
 import argparse
+import copy
 import os.path
+import shutil
+import tempfile
 
 from mvc.video import VideoFile
+from mvc import capabilities
 from mvc import converter
 from mvc import settings
 
@@ -31,6 +35,7 @@ def make_ffmpeg_arg_parser():
         "-lag-in-frames",
         "-level",
         "-maxrate",
+        "-movflags",
         "-preset",
         "-profile:v",
         "-r",
@@ -83,6 +88,11 @@ class ConverterManagerTest(base.Test):
     def test_startup(self):
         self.manager.startup()
         self.assertTrue(self.manager.converters)
+        # the device presets are opt-in
+        self.assertRaises(KeyError, self.manager.get_by_id, 'droid')
+        manager = converter.ConverterManager(load_presets=True)
+        manager.startup()
+        self.assertTrue(manager.get_by_id('droid'))
 
     def test_add_converter(self):
         self.manager.add_converter(TEST_CONVERTER)
@@ -183,6 +193,128 @@ class FFmpegConverterInfoTest(ConverterInfoTestMixin, base.Test):
                                                   dont_upsize=False),
                          (800, 600))
 
+    def test_get_arguments_fragmented_mp4(self):
+        self.converter_info.extension = 'mp4'
+        self.converter_info.fragmented = True
+        output = os.path.join(self.testdata_dir, 'output.mp4')
+        pass1 = self.converter_info.get_arguments(self.video, output, 'pass1')
+        pass2 = self.converter_info.get_arguments(self.video, output, 'pass2')
+        self.assertFalse('-movflags' in pass1)
+        index = pass2.index('-movflags')
+        self.assertEqual(pass2[index + 1],
+                         converter.FFmpegConverterInfo.FRAGMENTED_MP4_FLAGS)
+
+    def test_get_segment_jobs(self):
+        output = os.path.join(self.testdata_dir, 'output.mp4')
+        jobs = self.converter_info.get_jobs(self.video, output)
+        segment_jobs = self.converter_info.get_segment_jobs(self.video,
+                                                            output, 60, 30)
+        self.assertEqual(len(segment_jobs), len(jobs))
+        for job, segment_job in zip(jobs, segment_jobs):
+            index = job.index('-i')
+            self.assertEqual(segment_job,
+                             job[:index] + ['-ss', '60.000'] +
+                             job[index:index + 2] + ['-t', '30.000'] +
+                             job[index + 2:])
+
+    def test_get_video_codec(self):
+        video = mock.Mock(audio_only=False)
+        self.converter_info.parameters = '-f webm -vcodec libvpx -b:v 2M'
+        self.assertEqual(self.converter_info.get_video_codec(video), 'libvpx')
+        self.converter_info.parameters = '-c:v libx264 -crf 22'
+        self.assertEqual(self.converter_info.get_video_codec(video),
+                         'libx264')
+        self.converter_info.parameters = '-f mp3'
+        self.assertEqual(self.converter_info.get_video_codec(video), None)
+        video.audio_only = True
+        self.converter_info.parameters = '-vcodec libvpx'
+        self.assertEqual(self.converter_info.get_video_codec(video), None)
+
+    def test_choose_encoders(self):
+        video = mock.Mock(audio_only=False)
+        self.converter_info.parameters = '-f mp4'
+        self.converter_info.video_encoders = [
+            converter.EncoderOption('libx264', '-preset fast'),
+            converter.EncoderOption('mpeg4', '-q:v 3')]
+        self.converter_info.audio_encoders = [
+            converter.EncoderOption('aac', min_version=(3, 0)),
+            converter.EncoderOption('aac', '-strict experimental')]
+        caps = capabilities.Capabilities(
+            (2, 8), {'mpeg4': 'video', 'aac': 'audio'})
+        with mock.patch('mvc.settings.get_ffmpeg_capabilities',
+                        return_value=caps):
+            encoders = self.converter_info.choose_encoders(video)
+            self.assertEqual(str(encoders['video']), 'mpeg4 -q:v 3')
+            self.assertEqual(str(encoders['audio']),
+                             'aac -strict experimental')
+            self.assertEqual(self.converter_info.get_parameters(video),
+                             ['-f', 'mp4', '-vcodec', 'mpeg4', '-q:v', '3',
+                              '-acodec', 'aac', '-strict', 'experimental'])
+        # a converter pinned to a choice keeps it when ffmpeg changes
+        pinned = self.converter_info.with_encoders(encoders)
+        caps = capabilities.Capabilities(
+            (4, 4), {'libx264': 'video', 'aac': 'audio'})
+        with mock.patch('mvc.settings.get_ffmpeg_capabilities',
+                        return_value=caps):
+            self.assertEqual(self.converter_info.get_video_codec(video),
+                             'libx264')
+            self.assertEqual(pinned.get_video_codec(video), 'mpeg4')
+        # without ffmpeg, the last (most common) choice
+        with mock.patch('mvc.settings.get_ffmpeg_capabilities',
+                        return_value=None):
+            self.assertEqual(self.converter_info.get_video_codec(video),
+                             'mpeg4')
+
+    def test_get_missing_requirements(self):
+        video = mock.Mock(audio_only=False)
+        self.converter_info.parameters = ('-f webm -vcodec libvpx '
+                                          '-acodec libvorbis')
+        caps = capabilities.Capabilities(
+            (4, 4), {'libx264': 'video', 'libvorbis': 'audio'},
+            set(['mp4', 'webm']))
+        with mock.patch('mvc.settings.get_ffmpeg_capabilities',
+                        return_value=caps):
+            self.assertEqual(
+                self.converter_info.get_missing_requirements(video),
+                ['encoder libvpx'])
+            self.converter_info.parameters = '-f ogg -c:v libx264 -c:a copy'
+            self.assertEqual(
+                self.converter_info.get_missing_requirements(video),
+                ['muxer ogg'])
+        # without a working ffmpeg, we can't tell
+        with mock.patch('mvc.settings.get_ffmpeg_capabilities',
+                        return_value=None):
+            self.assertEqual(
+                self.converter_info.get_missing_requirements(video), [])
+
+    def test_get_concat_job(self):
+        output = os.path.join(self.testdata_dir, 'output.mp4')
+        with tempfile.NamedTemporaryFile(suffix='.txt') as concat_list:
+            job = self.converter_info.get_concat_job(concat_list.name,
+                                                     output)
+            self.assertEqual(job[1:], ['-f', 'concat', '-safe', '0',
+                                       '-i', concat_list.name,
+                                       '-c', 'copy', output])
+
+    def test_finalize_fragmented_mp4(self):
+        # fragmented output is already streamable, so finalize() should just
+        # move it into place rather than handing it to qtfaststart (which
+        # would choke on this non-mp4 data).
+        self.converter_info.media_type = 'format'
+        self.converter_info.extension = 'mp4'
+        self.converter_info.fragmented = True
+        temp_dir = tempfile.mkdtemp()
+        try:
+            temp_output = os.path.join(temp_dir, 'temp')
+            output = os.path.join(temp_dir, 'output.mp4')
+            with open(temp_output, 'wb') as f:
+                f.write('fragmented')
+            self.converter_info.finalize(temp_output, output)
+            self.assertFalse(os.path.exists(temp_output))
+            self.assertEqual(open(output, 'rb').read(), 'fragmented')
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_process_status_line_nothing(self):
         self.assertStatusLineOutput(
             '  built on Mar 31 2012 09:58:16 with gcc 4.6.3')
@@ -204,6 +336,12 @@ class FFmpegConverterInfoTest(ConverterInfoTestMixin, base.Test):
             'bitrate= 971.4kbits/s ',
             progress=8.7)
 
+    def test_process_status_line_first_pass(self):
+        self.assertStatusLineOutput(
+            'frame=  257 fps= 45 q=27.0 size=       0kB '
+            'time=10000000000.00 bitrate=   0.0kbits/s ',
+            pass1=0.2)
+
     def test_process_status_line_finished(self):
         self.assertStatusLineOutput(
             'frame=16238 fps= 37 q=-1.0 Lsize=  110266kB time=00:11:16.50 '
@@ -230,10 +368,187 @@ class FFmpegConverterInfoTest(ConverterInfoTestMixin, base.Test):
         line = 'Error while decoding stream: something'
         self.assertStatusLineOutput(line)
 
+    def test_get_progress_arguments(self):
+        self.assertEqual(self.converter_info.get_progress_arguments(3),
+                         ['-nostats', '-progress', 'pipe:3'])
+
+    def test_process_progress(self):
+        self.assertEqual(self.converter_info.process_progress(self.video, {
+                    'frame': '257',
+                    'fps': '45.00',
+                    'bitrate': ' 971.4kbits/s',
+                    'total_size': '1057792',
+                    'out_time_ms': '8700000',
+                    'out_time': '00:00:08.700000',
+                    'speed': '1.5x',
+                    'progress': 'continue'}),
+                         {'frame': 257, 'fps': 45.0, 'bitrate': 971.4,
+                          'total_size': 1057792, 'out_time': 8.7,
+                          'progress': 8.7, 'speed': 1.5})
+
+    def test_process_progress_not_available(self):
+        self.assertEqual(self.converter_info.process_progress(self.video, {
+                    'frame': '0',
+                    'bitrate': 'N/A',
+                    'total_size': 'N/A',
+                    'out_time_ms': '-9223372036854775807',
+                    'speed': 'N/A',
+                    'progress': 'continue'}),
+                         {'frame': 0})
+
+    def test_process_error_line(self):
+        line = 'Unknown encoder \'libfoo\''
+        self.assertEqual(self.converter_info.process_error_line(self.video,
+                                                                line),
+                         {'finished': True, 'error': line})
+        self.assertEqual(self.converter_info.process_error_line(
+                self.video, 'frame=  257 fps= 45 q=27.0 size=    1033kB '
+                'time=00:00:08.70 bitrate= 971.4kbits/s '), None)
+
+class FFmpeg2TheoraConverterInfoTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.converter_info = converter.FFmpeg2TheoraConverterInfo(
+            'FFmpeg2Theora Test')
+
+    def assertStatusLineOutput(self, line, **output):
+        if not output:
+            output = None
+        self.assertEqual(self.converter_info.process_status_line(None, line),
+                         output)
+
+    def test_process_status_line_nothing(self):
+        self.assertStatusLineOutput('  Pixel Aspect Ratio: 1.00/1 ')
+
+    def test_process_status_line_duration(self):
+        self.assertStatusLineOutput(
+            '  Duration: 00:10:00.04, start: 0.000000, bitrate: 2201 kb/s',
+            duration=600.04)
+
+    def test_process_status_line_first_pass(self):
+        self.assertStatusLineOutput(
+            'Scanning first pass pos: 0:00:12.60 ET: 00:00:03',
+            pass1=12.6)
+
+    def test_process_status_line_progress(self):
+        self.assertStatusLineOutput(
+            '  0:00:08.70 audio: 64kbps video: 1000kbps, ET: 00:01:00, '
+            'est. size: 1.2 MB',
+            pass2=8.7)
+
+    def test_process_status_line_finished(self):
+        self.assertStatusLineOutput(
+            '  0:10:00.04 audio: 0kbps video: 1001kbps, '
+            'time elapsed: 00:03:20',
+            finished=True)
+
+    def test_process_status_line_error(self):
+        line = 'Unknown option --foo'
+        self.assertStatusLineOutput(line, finished=True, error=line)
+
+class StreamPlanTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        # mp4-0.mp4, as ffmpeg 7 probes it
+        self.video = mock.Mock(
+            filename=os.path.join(self.testdata_dir, 'mp4-0.mp4'),
+            audio_only=False, video_codec='h264', width=640, height=480,
+            video_profile='Constrained Baseline', pixel_format='yuv420p',
+            video_bitrate=993000, audio_codec='aac', audio_profile='LC',
+            audio_sample_rate=44100, audio_channels=2, audio_bitrate=125000)
+        self.converter_info = converter.FFmpegConverterInfo('Tablet', 1024,
+                                                            768)
+        self.converter_info.parameters = ('-ac 2 -ab 160k -maxrate 10000000 '
+                                          '-vb 1200k -f mp4')
+        self.converter_info.video_encoders = [
+            converter.EncoderOption('libx264',
+                                    '-profile:v baseline -level 30')]
+        self.converter_info.audio_encoders = [converter.EncoderOption('aac')]
+        patcher = mock.patch('mvc.settings.get_ffmpeg_capabilities',
+                             return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def plan(self):
+        return self.converter_info.plan_streams(
+            self.video, self.converter_info.choose_encoders(self.video))
+
+    def test_copy(self):
+        self.assertEqual(self.plan(), {'video': 'copy', 'audio': 'copy'})
+        pinned = self.converter_info.with_encoders(
+            {'video': converter.STREAM_COPY, 'audio': converter.STREAM_COPY})
+        self.assertFalse(pinned.supports_segments(self.video))
+        jobs = pinned.get_jobs(self.video, '/tmp/output.mp4')
+        # a single pass, without resizing
+        self.assertEqual(len(jobs), 1)
+        arguments = jobs[0][1:]
+        self.assertEqual(arguments[arguments.index('-vcodec') + 1], 'copy')
+        self.assertEqual(arguments[arguments.index('-acodec') + 1], 'copy')
+        self.assertFalse('-s' in arguments)
+        self.assertFalse('-pass' in arguments)
+
+    def test_copy_one_stream(self):
+        self.video.audio_channels = 6
+        self.assertEqual(self.plan(), {'video': 'copy',
+                                       'audio': 'parameters have -ac 2'})
+        self.video.audio_channels = 2
+        self.video.video_profile = 'High'
+        self.assertEqual(self.plan(), {
+                'video': 'input profile is High, not baseline',
+                'audio': 'copy'})
+
+    def test_encode(self):
+        for attribute, value, reason in (
+            ('video_codec', 'vp8', 'input is vp8, not h264'),
+            ('pixel_format', 'yuv422p', 'pixel format is yuv422p'),
+            ('video_bitrate', 5000000, 'input bitrate is over -vb 1200k'),
+            ('video_bitrate', None, 'unknown input bitrate'),
+            ):
+            old_value = getattr(self.video, attribute)
+            setattr(self.video, attribute, value)
+            self.assertEqual(self.plan()['video'], reason)
+            setattr(self.video, attribute, old_value)
+        self.converter_info.width, self.converter_info.height = 480, 320
+        self.assertEqual(self.plan()['video'], 'resizing to 426x320')
+        self.converter_info.width, self.converter_info.height = 1280, 720
+        self.video.width, self.video.height = 1280, 720
+        self.assertEqual(self.plan()['video'], 'too big for level 30')
+
+    def test_signature(self):
+        patcher = mock.patch('mvc.settings.ffmpeg_capabilities_loaded',
+                             return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        def make(name, width, height, extension='mp4'):
+            converter_info = copy.copy(self.converter_info)
+            converter_info.name = name
+            converter_info.width, converter_info.height = width, height
+            converter_info.extension = extension
+            return converter_info.get_signature(self.video)
+        signature = make('Galaxy Y', 320, 240)
+        self.assertEqual(make('Galaxy Mini', 320, 240), signature)
+        self.assertNotEqual(make('Galaxy Ace', 480, 320), signature)
+        self.assertNotEqual(make('Galaxy Y', 320, 240, 'm4v'), signature)
+
+    def test_signature_before_probe(self):
+        with mock.patch('mvc.settings.ffmpeg_capabilities_loaded',
+                        return_value=False):
+            self.assertEqual(self.converter_info.get_signature(self.video),
+                             None)
+
 class TestConverterDefinitions(base.Test):
     def setUp(self):
         base.Test.setUp(self)
-        self.manager = converter.ConverterManager()
+        # an ffmpeg that has every encoder, so the presets use their first
+        # choices
+        caps = capabilities.Capabilities((4, 4))
+        patcher = mock.patch('mvc.settings.get_ffmpeg_capabilities',
+                             return_value=caps)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = converter.ConverterManager(load_presets=True)
         self.manager.startup()
         self.input_path = os.path.join(self.testdata_dir, 'mp4-0.mp4')
         self.output_path = os.path.join(self.testdata_dir, 'output.mp4')
@@ -308,7 +623,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -342,7 +657,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -362,7 +677,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -392,8 +707,9 @@ class TestConverterDefinitions(base.Test):
             'crf': '22',
             'f': 'mp4',
             'i': self.input_path,
+            'movflags': 'frag_keyframe+empty_moov+default_base_moof',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             's': '542x320',
             'strict': 'experimental',
             'vcodec': 'libx264',
@@ -411,7 +727,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -456,7 +772,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -476,7 +792,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -509,7 +825,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '320x188',
             'strict': 'experimental',
@@ -529,7 +845,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -550,7 +866,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -570,7 +886,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -602,7 +918,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -622,7 +938,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -642,7 +958,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -662,7 +978,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -697,7 +1013,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -717,7 +1033,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -737,7 +1053,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -758,7 +1074,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '320x188',
             'strict': 'experimental',
@@ -801,7 +1117,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -821,7 +1137,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -841,7 +1157,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -861,7 +1177,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -881,7 +1197,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -901,7 +1217,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -921,7 +1237,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -941,7 +1257,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -961,7 +1277,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1010,7 +1326,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1053,7 +1369,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '320x188',
             'strict': 'experimental',
@@ -1073,7 +1389,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1106,7 +1422,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1127,7 +1443,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1144,7 +1460,7 @@ class TestConverterDefinitions(base.Test):
             'f': 'mp4',
             'i': self.input_path,
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             's': '542x320',
             'strict': 'experimental',
             'vcodec': 'libx264',
@@ -1162,7 +1478,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1197,7 +1513,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1217,7 +1533,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1238,7 +1554,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1258,7 +1574,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1279,7 +1595,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1299,7 +1615,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -1320,7 +1636,7 @@ class TestConverterDefinitions(base.Test):
             'level': '30',
             'maxrate': '10000000',
             'output_file': self.output_path,
-            'preset': 'slow',
+            'preset': 'fast',
             'profile:v': 'baseline',
             's': '542x320',
             'strict': 'experimental',
@@ -0,0 +1,165 @@
+import distutils.spawn
+import errno
+import os
+import subprocess
+import sys
+import time
+
+from mvc import execute
+
+import base
+
+class PopenTest(base.Test):
+
+    def test_resource_usage(self):
+        popen = execute.Popen([sys.executable, '-c',
+                               'x = " " * (16 * 1024 * 1024)'])
+        popen.communicate()
+        self.assertEqual(popen.returncode, 0)
+        usage = popen.get_resource_usage()
+        self.assertTrue(usage['wall'] > 0)
+        if hasattr(os, 'wait4'):
+            self.assertTrue(usage['user'] + usage['system'] > 0)
+            self.assertTrue(usage['max_rss'] > 16 * 1024 * 1024)
+            self.assertTrue('read_bytes' in usage)
+            self.assertTrue('write_bytes' in usage)
+        else:
+            self.assertEqual(popen.rusage, None)
+
+    def test_wait_twice(self):
+        popen = execute.Popen([sys.executable, '-c', 'import sys; sys.exit(3)'])
+        self.assertEqual(popen.wait(), 3)
+        self.assertEqual(popen.wait(), 3)
+
+    def test_pass_fds(self):
+        if not execute.can_pass_fds():
+            return
+        read_fd, write_fd = execute.child_pipe()
+        try:
+            popen = execute.Popen([sys.executable, '-c',
+                                   'import os; os.write(%i, "hi")' % write_fd],
+                                  pass_fds=[write_fd])
+            os.close(write_fd)
+            popen.wait()
+            self.assertEqual(os.read(read_fd, 100), 'hi')
+        finally:
+            os.close(read_fd)
+
+    def test_suspend(self):
+        if not execute.can_suspend():
+            return
+        popen = execute.Popen([sys.executable, '-c',
+                               'import sys, time\n'
+                               'for i in range(20):\n'
+                               '    print i\n'
+                               '    sys.stdout.flush()\n'
+                               '    time.sleep(0.05)\n'])
+        popen.stdout.readline()
+        popen.suspend()
+        time.sleep(0.5)
+        popen.resume()
+        popen.wait()
+        self.assertEqual(popen.returncode, 0)
+        # the time spent stopped comes on top of the second it sleeps
+        self.assertTrue(popen.get_resource_usage()['wall'] > 1.4)
+
+    def test_suspend_after_exit(self):
+        if not execute.can_suspend():
+            return
+        popen = execute.Popen([sys.executable, '-c', 'pass'])
+        popen.wait()
+        popen.suspend()
+        popen.resume()
+
+    def test_nice(self):
+        if sys.platform == 'win32':
+            return
+        popen = execute.Popen([sys.executable, '-c',
+                               'import os; print os.nice(0)'], nice=5)
+        output = popen.communicate()[0]
+        self.assertEqual(int(output), os.nice(0) + 5)
+
+    def test_affinity(self):
+        if not execute.can_set_affinity():
+            return
+        cpu = execute.get_affinity()[-1]
+        popen = execute.Popen(['grep', 'Cpus_allowed_list',
+                               '/proc/self/status'], cpus=[cpu])
+        output = popen.communicate()[0]
+        self.assertEqual(output.split(), ['Cpus_allowed_list:', str(cpu)])
+
+    def test_ionice(self):
+        # ionice(1) without arguments prints its own I/O priority
+        if (not execute.can_set_ionice() or
+            distutils.spawn.find_executable('ionice') is None):
+            return
+        popen = execute.Popen(['ionice'], ionice=(execute.IONICE_IDLE, 0))
+        self.assertEqual(popen.communicate()[0].strip(), 'idle')
+
+    def test_spawn_matches_fork(self):
+        if not execute.can_posix_spawn():
+            return
+        args = [sys.executable, '-c',
+                'import os, sys\n'
+                'sys.stderr.write("err")\n'
+                'print sys.stdin.read(), os.environ["MVC_TEST"]\n'
+                'sys.exit(4)\n']
+        results = []
+        old_use_posix_spawn = execute.use_posix_spawn
+        try:
+            for use_posix_spawn in (True, False):
+                execute.use_posix_spawn = use_posix_spawn
+                env = dict(os.environ, MVC_TEST='env')
+                popen = execute.Popen(args, stdin=subprocess.PIPE,
+                                      stderr=subprocess.PIPE, env=env)
+                self.assertEqual(popen.spawned, use_posix_spawn)
+                results.append(popen.communicate('in') + (popen.returncode,))
+        finally:
+            execute.use_posix_spawn = old_use_posix_spawn
+        self.assertEqual(results[0], ('in env\n', 'err', 4))
+        self.assertEqual(results[0], results[1])
+
+    def test_missing_program(self):
+        try:
+            execute.Popen(['/nonexistent/program'])
+        except OSError, e:
+            self.assertEqual(e.errno, errno.ENOENT)
+        else:
+            self.fail('no OSError')
+
+    def test_missing_program_with_scheduling(self):
+        if not execute.can_set_affinity():
+            return
+        try:
+            execute.Popen(['/nonexistent/program'], nice=5,
+                          ionice=(execute.IONICE_IDLE, 0),
+                          cpus=execute.get_affinity()[-1:])
+        except OSError, e:
+            self.assertEqual(e.errno, errno.ENOENT)
+        else:
+            self.fail('no OSError')
+
+    def test_spawn_with_scheduling(self):
+        if not execute.can_posix_spawn():
+            return
+        popen = execute.Popen([sys.executable, '-c',
+                               'import os; print os.nice(0)'], nice=5,
+                              cpus=execute.get_affinity()[-1:])
+        output = popen.communicate()[0]
+        self.assertTrue(popen.spawned)
+        self.assertEqual(int(output), os.nice(0) + 5)
+
+    def test_no_fd_leak(self):
+        if not os.path.isdir('/proc/self/fd'):
+            return
+        execute.check_output(['true'])
+        fd_count = len(os.listdir('/proc/self/fd'))
+        for i in xrange(20):
+            execute.check_output(['true'])
+            execute.Popen(['true'], stderr=subprocess.PIPE).communicate()
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fd_count)
+
+    def test_check_output(self):
+        self.assertEqual(execute.check_output(['echo', 'hi']), 'hi\n')
+        self.assertRaises(execute.CalledProcessError, execute.check_output,
+                          ['false'])
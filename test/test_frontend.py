@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+from mvc import frontend
+
+import base
+
+class FrontendTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.saved = (frontend._idle_add, frontend._get_conversion_directory)
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        frontend._idle_add, frontend._get_conversion_directory = self.saved
+
+    def test_call_now(self):
+        called = []
+        frontend.call_now(lambda: called.append(True))
+        self.assertEqual(called, [True])
+        self.assertRaises(ValueError, frontend.call_now, lambda: None, 1.0)
+
+    def test_install(self):
+        queued = []
+        frontend.install(idle_add=lambda cb, periodic=None: queued.append(cb),
+                         get_conversion_directory=lambda: '/converted')
+        frontend.idle_add(lambda: None)
+        self.assertEqual(len(queued), 1)
+        self.assertEqual(frontend.get_conversion_directory(), '/converted')
+
+    def test_core_without_toolkit(self):
+        root = os.path.join(os.path.dirname(__file__), '..')
+        output = subprocess.Popen(
+            [sys.executable, '-c',
+             'import sys\n'
+             'sys.path.insert(0, %r)\n'
+             'from mvc import converter, conversion, video, settings\n'
+             'print [m for m in sys.modules if m.startswith("mvc.widgets")]'
+             % os.path.abspath(root)],
+            stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual(output.strip(), '[]')
@@ -0,0 +1,85 @@
+import os
+import threading
+
+from mvc import jobserver
+
+import base
+
+class ParseMakeflagsTest(base.Test):
+
+    def test_auth(self):
+        self.assertEqual(jobserver.parse_makeflags(
+                ' -j4 --jobserver-auth=3,4'), ('fds', 3, 4))
+
+    def test_old_make(self):
+        self.assertEqual(jobserver.parse_makeflags(
+                'w -j --jobserver-fds=5,6'), ('fds', 5, 6))
+
+    def test_fifo(self):
+        self.assertEqual(jobserver.parse_makeflags(
+                '-j4 --jobserver-auth=fifo:/tmp/GMfifo123'),
+                         ('fifo', '/tmp/GMfifo123'))
+
+    def test_none(self):
+        self.assertEqual(jobserver.parse_makeflags(''), None)
+        self.assertEqual(jobserver.parse_makeflags('-k -s'), None)
+        self.assertEqual(jobserver.parse_makeflags(
+                '-j --jobserver-auth=-2,-2'), None)
+
+class JobServerClientTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.read_fd, self.write_fd = os.pipe()
+        # make -j3: 2 tokens in the pipe, and our implicit one
+        os.write(self.write_fd, 'ab')
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def make_client(self):
+        return jobserver.JobServerClient.from_environment({
+                'MAKEFLAGS': '-j3 --jobserver-auth=%i,%i' % (self.read_fd,
+                                                             self.write_fd)})
+
+    def test_acquire_release(self):
+        client = self.make_client()
+        tokens = [client.acquire() for i in xrange(3)]
+        self.assertEqual(tokens, [jobserver.IMPLICIT_TOKEN, 'a', 'b'])
+        # no tokens left
+        self.assertEqual(client.acquire(cancelled=lambda: True), None)
+        client.release('a')
+        self.assertEqual(client.acquire(), 'a')
+        client.release(jobserver.IMPLICIT_TOKEN)
+        self.assertEqual(client.acquire(), jobserver.IMPLICIT_TOKEN)
+        client.close()
+
+    def test_waits_for_token(self):
+        client = self.make_client()
+        tokens = [client.acquire() for i in xrange(3)]
+        got = []
+        thread = threading.Thread(target=lambda: got.append(client.acquire()))
+        thread.start()
+        thread.join(0.2)
+        self.assertEqual(got, [])
+        client.release('b')
+        thread.join(5)
+        self.assertEqual(got, ['b'])
+        client.close()
+
+    def test_close_gives_tokens_back(self):
+        client = self.make_client()
+        for i in xrange(3):
+            client.acquire()
+        client.close()
+        self.assertEqual(sorted(os.read(self.read_fd, 10)), ['a', 'b'])
+
+    def test_not_passed(self):
+        # make didn't pass us the pipe, so the fds are something else (or
+        # closed)
+        with open(os.devnull) as f:
+            self.assertEqual(jobserver.JobServerClient.from_environment({
+                        'MAKEFLAGS': '-j3 --jobserver-auth=%i,%i' % (
+                            f.fileno(), f.fileno())}), None)
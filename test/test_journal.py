@@ -0,0 +1,136 @@
+import os.path
+import shutil
+import tempfile
+
+from mvc import conversion
+from mvc import journal
+
+import base
+import mock
+
+class JobJournalTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'jobs.sqlite')
+        self.journal = journal.JobJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        base.Test.tearDown(self)
+
+    def reopen(self):
+        self.journal.close()
+        self.journal = journal.JobJournal(self.path)
+
+    def test_add(self):
+        job_id = self.journal.add('in.avi', 'mp4', '/out/in.mp4')
+        self.reopen()
+        job = self.journal.get(job_id)
+        self.assertEqual((job.input, job.converter, job.output, job.state),
+                         ('in.avi', 'mp4', '/out/in.mp4', 'waiting'))
+
+    def test_unfinished(self):
+        ids = [self.journal.add('in%i.avi' % i, 'mp4', 'out%i.mp4' % i)
+               for i in range(4)]
+        self.journal.update(ids[1], 'converting', temp_output='/tmp/x')
+        self.journal.update(ids[2], 'finished')
+        self.journal.update(ids[3], 'failed', error='oops')
+        self.reopen()
+        self.assertEqual([job.id for job in self.journal.unfinished()],
+                         ids[:2])
+        self.assertEqual(self.journal.get(ids[1]).temp_output, '/tmp/x')
+        self.assertEqual(self.journal.get(ids[3]).error, 'oops')
+        self.assertEqual([state for state, t in
+                          self.journal.transitions(ids[2])],
+                         ['waiting', 'finished'])
+
+    def test_is_finished(self):
+        output = os.path.join(self.temp_dir, 'out.mp4')
+        job_id = self.journal.add('in.avi', 'mp4', output)
+        self.journal.update(job_id, 'finished')
+        # the output has to still be there
+        self.assertFalse(self.journal.is_finished('in.avi', 'mp4', output))
+        open(output, 'wb').close()
+        self.assertTrue(self.journal.is_finished('in.avi', 'mp4', output))
+        self.assertFalse(self.journal.is_finished('in.avi', 'webm', output))
+
+    def test_non_utf8_filename(self):
+        job_id = self.journal.add('caf\xe9.avi', 'mp4', 'caf\xe9.mp4')
+        self.assertEqual(self.journal.get(job_id).input, 'caf\xe9.avi')
+
+    def test_clean_up(self):
+        temp_output = os.path.join(self.temp_dir, 'tmpXYZ')
+        open(temp_output, 'wb').close()
+        job_id = self.journal.add('in.avi', 'mp4', 'out.mp4')
+        self.journal.update(job_id, 'converting', temp_output=temp_output)
+        self.journal.clean_up(self.journal.get(job_id))
+        self.assertFalse(os.path.exists(temp_output))
+
+class ManagerJournalTest(JobJournalTest):
+
+    def setUp(self):
+        JobJournalTest.setUp(self)
+        self.manager = conversion.ConversionManager(simultaneous=1)
+        self.manager.journal = self.journal
+
+    def make_conversion(self, name):
+        c = mock.Mock(job_id=None, slot=None, status='initialized',
+                      error=None, temp_output=None, output=name + '.mp4')
+        c.video.filename = name + '.avi'
+        c.converter.identifier = 'mp4'
+        def run():
+            c.status = 'converting'
+            c.temp_output = name + '.tmp'
+        c.run.side_effect = run
+        return c
+
+    def test_states(self):
+        c1, c2 = self.make_conversion('one'), self.make_conversion('two')
+        self.manager.run_conversion(c1)
+        self.manager.run_conversion(c2)
+        self.assertEqual(self.journal.get(c1.job_id).state, 'converting')
+        self.assertEqual(self.journal.get(c1.job_id).temp_output, 'one.tmp')
+        self.assertEqual(self.journal.get(c2.job_id).state, 'waiting')
+        c1.status = 'finished'
+        self.manager.conversion_finished(c1)
+        self.assertEqual(self.journal.get(c1.job_id).state, 'finished')
+        self.assertEqual(self.journal.get(c2.job_id).state, 'converting')
+        self.assertEqual([job.id for job in self.journal.unfinished()],
+                         [c2.job_id])
+
+    def test_is_duplicate(self):
+        c1 = self.make_conversion('one')
+        self.manager.run_conversion(c1)
+        self.assertTrue(self.manager.is_duplicate(self.make_conversion('one')))
+        self.assertFalse(self.manager.is_duplicate(
+                self.make_conversion('two')))
+
+    def test_resume_jobs(self):
+        temp_output = os.path.join(self.temp_dir, 'tmpXYZ')
+        open(temp_output, 'wb').close()
+        running = self.journal.add('running.avi', 'mp4', '/out/running.mp4')
+        self.journal.update(running, 'converting', temp_output=temp_output)
+        waiting = self.journal.add('waiting.avi', 'mp4', '/out/waiting.mp4')
+        gone = self.journal.add('gone.avi', 'old', '/out/gone.mp4')
+        finished = self.journal.add('done.avi', 'mp4', '/out/done.mp4')
+        self.journal.update(finished, 'finished')
+
+        converters = {'mp4': mock.Mock(identifier='mp4')}
+        self.manager.get_conversion = mock.Mock(
+            side_effect=lambda v, c, output_dir: self.make_conversion(
+                os.path.join(output_dir,
+                             os.path.splitext(v.filename)[0])))
+        with mock.patch('mvc.conversion.VideoFile',
+                        lambda filename: mock.Mock(filename=filename)):
+            resumed = self.manager.resume_jobs(converters.__getitem__)
+        self.assertEqual([c.job_id for c in resumed], [running, waiting])
+        self.assertFalse(os.path.exists(temp_output))
+        self.assertEqual(self.journal.get(gone).state, 'failed')
+        self.assertEqual(self.journal.get(running).state, 'converting')
+        self.assertEqual(self.journal.get(waiting).state, 'waiting')
+        self.assertEqual([state for state, t in
+                          self.journal.transitions(running)],
+                         ['waiting', 'converting', 'waiting', 'converting'])
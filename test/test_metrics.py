@@ -0,0 +1,75 @@
+import json
+import os.path
+import shutil
+import tempfile
+import urllib2
+
+from mvc import metrics
+
+import base
+
+class HistogramTest(base.Test):
+
+    def test_observe(self):
+        histogram = metrics.Histogram((1, 10))
+        for value in (0.5, 1, 5, 100):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 106.5)
+        self.assertEqual(histogram.cumulative_counts(), [(1, 2), (10, 3)])
+
+class StageMetricsTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.metrics = metrics.StageMetrics((0.5, 2))
+        self.metrics.observe('probe', 0.25)
+        self.metrics.observe('pass1', 1.5)
+        self.metrics.observe('pass1', 3)
+
+    def test_to_dict(self):
+        self.assertEqual(self.metrics.to_dict(), {
+                'probe': {'count': 1, 'sum': 0.25,
+                          'buckets': [[0.5, 1], [2, 1]]},
+                'pass1': {'count': 2, 'sum': 4.5,
+                          'buckets': [[0.5, 0], [2, 1]]},
+                })
+
+    def test_to_prometheus(self):
+        self.assertEqual(self.metrics.to_prometheus().splitlines()[2:], [
+                'mvc_stage_seconds_bucket{stage="pass1",le="0.5"} 0',
+                'mvc_stage_seconds_bucket{stage="pass1",le="2"} 1',
+                'mvc_stage_seconds_bucket{stage="pass1",le="+Inf"} 2',
+                'mvc_stage_seconds_sum{stage="pass1"} 4.5',
+                'mvc_stage_seconds_count{stage="pass1"} 2',
+                'mvc_stage_seconds_bucket{stage="probe",le="0.5"} 1',
+                'mvc_stage_seconds_bucket{stage="probe",le="2"} 1',
+                'mvc_stage_seconds_bucket{stage="probe",le="+Inf"} 1',
+                'mvc_stage_seconds_sum{stage="probe"} 0.25',
+                'mvc_stage_seconds_count{stage="probe"} 1',
+                ])
+
+    def test_dump(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'metrics.json')
+            dumper = metrics.MetricsDumper(path, metrics=self.metrics)
+            dumper.stop()
+            with open(path) as f:
+                data = json.load(f)
+            self.assertEqual(data['stages']['pass1']['count'], 2)
+            self.assertEqual(os.listdir(temp_dir), ['metrics.json'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_server(self):
+        server = metrics.MetricsServer(0, self.metrics)
+        server.start()
+        try:
+            url = 'http://127.0.0.1:%i/metrics' % server.server_port
+            body = urllib2.urlopen(url).read()
+            self.assertEqual(body, self.metrics.to_prometheus())
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen,
+                              url + '/nope')
+        finally:
+            server.stop()
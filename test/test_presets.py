@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import tempfile
+
+from mvc import basicconverters
+from mvc import converter
+from mvc import presets
+from mvc import resources
+
+import base
+
+PRESETS = {
+    'defaults': {
+        'media_type': 'phone',
+        'extension': 'mp4',
+        'parameters': '-ac 2 -f mp4',
+        'video_encoders': 'h264_baseline',
+        'audio_encoders': 'aac',
+        'simple': 'mp4',
+    },
+    'presets': [
+        {'name': 'Generic Phone', 'size': [480, 320]},
+    ],
+    'brands': [
+        {'brand': 'Acme', 'presets': [
+                {'name': 'Acme One', 'size': [800, 480]},
+                {'name': 'Acme Audio', 'audio_only': True,
+                 'parameters': ['-f', 'mp3'], 'extension': 'mp3'},
+                ]},
+    ],
+}
+
+class PresetsTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.preset_path = os.path.join(self.temp_dir, 'phones.json')
+        self.write_presets(PRESETS)
+        self.cache_path = os.path.join(self.temp_dir, 'cache', 'presets.json')
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def write_presets(self, data, path=None):
+        with open(path or self.preset_path, 'wb') as f:
+            json.dump(data, f)
+
+    def test_compile(self):
+        entries = presets.load_preset_file(self.preset_path)
+        self.assertEqual([(e['name'], e['brand']) for e in entries],
+                         [('Generic Phone', None), ('Acme One', 'Acme'),
+                          ('Acme Audio', 'Acme')])
+        self.assertEqual(entries[0]['parameters'], ['-ac', '2', '-f', 'mp4'])
+        self.assertEqual((entries[0]['width'], entries[0]['height']),
+                         (480, 320))
+        self.assertEqual(entries[2]['parameters'], ['-f', 'mp3'])
+
+    def test_make_converter(self):
+        entry = presets.load_preset_file(self.preset_path)[1]
+        converter_info = presets.make_converter(entry)
+        self.assertTrue(isinstance(converter_info,
+                                   converter.FFmpegConverterInfo))
+        self.assertEqual(converter_info.identifier, 'acmeone')
+        self.assertEqual(converter_info.media_type, 'phone')
+        self.assertEqual((converter_info.width, converter_info.height),
+                         (800, 480))
+        self.assertEqual(converter_info.video_encoders,
+                         basicconverters.H264_BASELINE_ENCODERS)
+        self.assertEqual(converter_info.simple, basicconverters.MP4)
+
+    def test_unknown_names(self):
+        for preset in ({'name': 'Bad', 'video_encoders': 'h266'},
+                       {'name': 'Bad', 'class': 'handbrake'},
+                       {'name': 'Bad', 'colour': 'red'},
+                       {'size': [1, 1]}):
+            self.write_presets({'presets': [preset]})
+            self.assertRaises(presets.PresetError,
+                              presets.load_preset_file, self.preset_path)
+
+    def test_broken_file_skipped(self):
+        broken_path = os.path.join(self.temp_dir, 'broken.json')
+        with open(broken_path, 'wb') as f:
+            f.write('{"presets": [')
+        entries = presets.compile_presets([broken_path, self.preset_path])
+        self.assertEqual(len(entries), 3)
+
+    def test_cache(self):
+        compiled = []
+        def compile_presets(paths):
+            compiled.append(paths)
+            return presets.compile_presets(paths)
+        cache = presets.PresetCache(self.cache_path)
+        entries = cache.get([self.preset_path], compile_presets)
+        self.assertEqual(len(compiled), 1)
+        cached = presets.PresetCache(self.cache_path).get(
+            [self.preset_path], compile_presets)
+        self.assertEqual(len(compiled), 1)
+        self.assertEqual(cached, json.loads(json.dumps(entries)))
+        # changing a source recompiles
+        data = dict(PRESETS, presets=[])
+        self.write_presets(data)
+        os.utime(self.preset_path, (0, 0))
+        entries = presets.PresetCache(self.cache_path).get(
+            [self.preset_path], compile_presets)
+        self.assertEqual(len(compiled), 2)
+        self.assertEqual(len(entries), 2)
+
+    def test_encoder_fallbacks(self):
+        # what we use when the capabilities aren't known
+        fallbacks = dict((name, str(converter.choose_encoder(options, None)))
+                         for name, options in presets.ENCODER_LISTS.items())
+        self.assertEqual(fallbacks, {
+                'h264': 'libx264 -preset fast -crf 22',
+                'h264_baseline': ('libx264 -preset fast -profile:v baseline '
+                                  '-level 30'),
+                'mp4_video': 'mpeg4 -q:v 3',
+                'aac': 'aac -strict experimental',
+                'vp8': 'libvpx -deadline good -cpu-used 4',
+                })
+
+    def test_manager_indexes(self):
+        manager = converter.ConverterManager(self.cache_path)
+        manager.load_converters([self.preset_path])
+        acme_one = manager.get_by_id('acmeone')
+        self.assertEqual(manager.converter_to_brand(acme_one), 'Acme')
+        self.assertEqual([c.name for c in manager.brand_to_converters('Acme')],
+                         ['Acme One', 'Acme Audio'])
+        self.assertEqual(len(manager.media_type_to_converters('phone')), 3)
+        self.assertTrue(manager.get_by_id('acmeaudio').audio_only)
+
+    def test_shipped_presets(self):
+        entries = presets.compile_presets(resources.preset_files())
+        names = [e['name'] for e in entries]
+        self.assertTrue('Galaxy SIII' in names)
+        self.assertTrue('iPad' in names)
+        self.assertTrue('Kindle Fire' in names)
+        identifiers = [presets.make_converter(e).identifier for e in entries]
+        self.assertEqual(len(identifiers), len(set(identifiers)))
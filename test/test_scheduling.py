@@ -0,0 +1,55 @@
+from mvc import execute
+from mvc import scheduling
+
+import base
+
+class SchedulingClassTest(base.Test):
+
+    def test_popen_args(self):
+        self.assertEqual(scheduling.CLASSES['normal'].get_popen_args(), {})
+        self.assertEqual(scheduling.CLASSES['idle'].get_popen_args([2, 3]),
+                         {'nice': 19, 'ionice': (execute.IONICE_IDLE, 0),
+                          'cpus': [2, 3]})
+
+    def test_with_cores(self):
+        background = scheduling.CLASSES['background']
+        pinned = background.with_cores(2)
+        self.assertEqual(pinned.cores, 2)
+        self.assertEqual(pinned.nice, background.nice)
+        self.assertEqual(background.cores, None)
+
+class CoreAllocatorTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.allocator = scheduling.CoreAllocator(range(8))
+
+    def test_distinct_groups(self):
+        groups = [self.allocator.allocate(2) for i in xrange(4)]
+        self.assertEqual(groups, [[0, 1], [2, 3], [4, 5], [6, 7]])
+        # once every group is taken, they get shared
+        self.assertEqual(self.allocator.allocate(2), [0, 1])
+
+    def test_release(self):
+        first = self.allocator.allocate(4)
+        second = self.allocator.allocate(4)
+        self.allocator.release(first)
+        self.assertEqual(self.allocator.allocate(4), first)
+        self.allocator.release(second)
+        self.assertEqual(self.allocator.allocate(4), second)
+
+    def test_leftover_cpus(self):
+        # 8 CPUs make 2 groups of 3; CPUs 6 and 7 don't get used
+        groups = [self.allocator.allocate(3) for i in xrange(3)]
+        self.assertEqual(groups, [[0, 1, 2], [3, 4, 5], [0, 1, 2]])
+
+    def test_sparse_cpus(self):
+        allocator = scheduling.CoreAllocator([1, 3, 5, 7])
+        self.assertEqual([allocator.allocate(2) for i in xrange(2)],
+                         [[1, 3], [5, 7]])
+
+    def test_default_cpus(self):
+        self.assertTrue(scheduling.CoreAllocator().cpus)
+
+    def test_all_cpus(self):
+        self.assertEqual(self.allocator.allocate(8), None)
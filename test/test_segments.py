@@ -0,0 +1,95 @@
+import os.path
+import shutil
+import tempfile
+
+from mvc import segments
+
+import base
+
+class PlanSegmentsTest(base.Test):
+
+    def test_plan(self):
+        self.assertEqual(segments.plan_segments(90, 30),
+                         [(0, 0, 30), (1, 30, 30), (2, 60, 30)])
+
+    def test_short_leftover(self):
+        # 5 seconds isn't worth a segment of its own
+        self.assertEqual(segments.plan_segments(65, 30),
+                         [(0, 0, 30), (1, 30, 35)])
+
+    def test_long_leftover(self):
+        self.assertEqual(segments.plan_segments(80, 30),
+                         [(0, 0, 30), (1, 30, 30), (2, 60, 20)])
+
+    def test_shorter_than_a_segment(self):
+        self.assertEqual(segments.plan_segments(10, 30), [(0, 0, 10)])
+
+class SegmentCheckpointTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.scratch_root = tempfile.mkdtemp()
+        self.key = segments.job_key('in.avi', 'mp4', 'out.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch_root, ignore_errors=True)
+        base.Test.tearDown(self)
+
+    def make_checkpoint(self, duration=90, segment_length=30):
+        return segments.SegmentCheckpoint(self.scratch_root, self.key, 'mp4',
+                                          duration, segment_length)
+
+    def convert(self, checkpoint, index):
+        with open(checkpoint.partial_path(index), 'wb') as f:
+            f.write('segment %i' % index)
+        checkpoint.mark_done(index)
+
+    def test_resume(self):
+        checkpoint = self.make_checkpoint()
+        self.convert(checkpoint, 0)
+        self.convert(checkpoint, 1)
+        # segment 2 was being converted when we died
+        open(checkpoint.partial_path(2), 'wb').close()
+        checkpoint = self.make_checkpoint()
+        self.assertEqual([checkpoint.is_done(i) for i in range(3)],
+                         [True, True, False])
+        self.assertEqual(checkpoint.done_count(), 2)
+
+    def test_missing_segment_file(self):
+        checkpoint = self.make_checkpoint()
+        self.convert(checkpoint, 0)
+        self.convert(checkpoint, 1)
+        os.unlink(checkpoint.path(0))
+        checkpoint = self.make_checkpoint()
+        self.assertEqual([checkpoint.is_done(i) for i in range(3)],
+                         [False, True, False])
+
+    def test_plan_changed(self):
+        checkpoint = self.make_checkpoint()
+        self.convert(checkpoint, 0)
+        checkpoint = self.make_checkpoint(segment_length=45)
+        self.assertEqual(checkpoint.done_count(), 0)
+        self.assertFalse(os.path.exists(checkpoint.path(0)))
+
+    def test_corrupt_manifest(self):
+        checkpoint = self.make_checkpoint()
+        self.convert(checkpoint, 0)
+        with open(os.path.join(checkpoint.directory, segments.MANIFEST),
+                  'wb') as f:
+            f.write('{"key": ')
+        self.assertEqual(self.make_checkpoint().done_count(), 0)
+
+    def test_concat_list(self):
+        checkpoint = segments.SegmentCheckpoint(
+            os.path.join(self.scratch_root, "it's"), self.key, 'mp4', 60, 30)
+        with open(checkpoint.write_concat_list()) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, [
+                "file '%s'" % checkpoint.path(i).replace("'", "'\\''")
+                for i in range(2)])
+
+    def test_remove(self):
+        checkpoint = self.make_checkpoint()
+        self.convert(checkpoint, 0)
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(checkpoint.directory))
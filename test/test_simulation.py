@@ -0,0 +1,78 @@
+from mvc import conversion
+from mvc import simulation
+
+import base
+
+class SimulationTest(base.Test):
+
+    def make_jobs(self, *durations):
+        return [simulation.JobProfile(duration, 'mp4', 1.0, startup=0.0)
+                for duration in durations]
+
+    def run_jobs(self, manager, jobs):
+        simulator = simulation.Simulator(manager)
+        conversions = [simulator.submit(job) for job in jobs]
+        simulator.run()
+        return simulator, conversions
+
+    def test_fifo(self):
+        manager = conversion.ConversionManager(simultaneous=1)
+        simulator, conversions = self.run_jobs(manager,
+                                               self.make_jobs(30, 10, 20))
+        self.assertEqual([c.started_at for c in conversions], [0, 30, 40])
+        self.assertEqual([c.finished_at for c in conversions], [30, 40, 60])
+        self.assertFalse(manager.running)
+        results = simulator.get_results()
+        self.assertEqual(results['makespan'], 60)
+        self.assertEqual(results['mean_wait'], 70 / 3.0)
+        self.assertEqual(results['utilization'], 1.0)
+        self.assertEqual(results['statuses'], {'finished': 3})
+
+    def test_shortest_first(self):
+        manager = simulation.ShortestFirstManager(simultaneous=1)
+        simulator, conversions = self.run_jobs(
+            manager, self.make_jobs(30, 20, 10))
+        # the first job starts right away, then the shortest waiting one
+        self.assertEqual([c.started_at for c in conversions], [0, 40, 30])
+
+    def test_longest_first(self):
+        manager = simulation.LongestFirstManager(simultaneous=2)
+        simulator, conversions = self.run_jobs(
+            manager, self.make_jobs(5, 5, 10, 40))
+        self.assertEqual([c.started_at for c in conversions], [0, 0, 5, 5])
+        self.assertEqual(simulator.get_results()['makespan'], 45)
+
+    def test_arrivals(self):
+        jobs = self.make_jobs(10, 10)
+        jobs[1].arrival = 50
+        manager = conversion.ConversionManager(simultaneous=1)
+        simulator, conversions = self.run_jobs(manager, jobs)
+        self.assertEqual([c.started_at for c in conversions], [0, 50])
+        self.assertEqual(simulator.get_results()['utilization'], 20 / 60.0)
+
+    def test_failures(self):
+        jobs = simulation.generate_jobs(50, failure_rate=1.0)
+        results = simulation.simulate(jobs, simultaneous=4)
+        self.assertEqual(results['statuses'], {'failed': 50})
+
+    def test_stop_waiting(self):
+        manager = simulation.ShortestFirstManager(simultaneous=1)
+        simulator = simulation.Simulator(manager)
+        first, second = [simulator.submit(job)
+                         for job in self.make_jobs(10, 10)]
+        simulator.run(until=5)
+        second.stop()
+        simulator.run()
+        self.assertEqual(second.status, 'canceled')
+        self.assertEqual(len(manager.waiting), 0)
+
+    def test_generate_jobs(self):
+        jobs = simulation.generate_jobs(100, seed=1, arrival_rate=2.0)
+        self.assertEqual(len(jobs), 100)
+        arrivals = [job.arrival for job in jobs]
+        self.assertEqual(arrivals, sorted(arrivals))
+        # same seed, same jobs
+        self.assertEqual([job.duration for job in jobs],
+                         [job.duration for job in
+                          simulation.generate_jobs(100, seed=1,
+                                                   arrival_rate=2.0)])
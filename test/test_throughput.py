@@ -0,0 +1,80 @@
+import os.path
+import shutil
+import tempfile
+
+from mvc import throughput
+
+import base
+import mock
+
+class ThroughputHistoryTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'history', 'throughput.json')
+        self.history = throughput.ThroughputHistory(self.path, host='test')
+        self.converter = self.make_converter('mp4', 1280, 720)
+        self.video = mock.Mock(duration=60.0, audio_only=False)
+
+    def tearDown(self):
+        base.Test.tearDown(self)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_converter(self, identifier, width, height):
+        converter = mock.Mock(identifier=identifier, audio_only=False)
+        converter.get_target_size.return_value = (width, height)
+        return converter
+
+    def test_resolution_bucket(self):
+        self.assertEqual(throughput.resolution_bucket(None, None), 'audio')
+        self.assertEqual(throughput.resolution_bucket(320, 240), '240p')
+        self.assertEqual(throughput.resolution_bucket(854, 480), '480p')
+        self.assertEqual(throughput.resolution_bucket(800, 480), '480p')
+        self.assertEqual(throughput.resolution_bucket(1280, 720), '720p')
+        self.assertEqual(throughput.resolution_bucket(4096, 3072), 'larger')
+
+    def test_unknown(self):
+        self.assertEqual(self.history.get_speed(self.converter, self.video),
+                         None)
+        self.assertEqual(self.history.estimate_duration(self.converter,
+                                                        self.video),
+                         None)
+
+    def test_record(self):
+        self.history.record(self.converter, self.video, 60.0, 30.0)
+        self.assertEqual(self.history.get_speed(self.converter, self.video),
+                         2.0)
+        self.assertEqual(self.history.estimate_duration(self.converter,
+                                                        self.video),
+                         30.0)
+        # later samples get averaged in
+        self.history.record(self.converter, self.video, 60.0, 60.0)
+        speed = self.history.get_speed(self.converter, self.video)
+        self.assertTrue(1.0 < speed < 2.0)
+
+    def test_fallback_to_bucket(self):
+        self.history.record(self.converter, self.video, 60.0, 30.0)
+        webm = self.make_converter('webm', 1280, 720)
+        self.assertEqual(self.history.get_speed(webm, self.video), 2.0)
+        small = self.make_converter('webm', 320, 240)
+        self.assertEqual(self.history.get_speed(small, self.video), None)
+
+    def test_other_host(self):
+        self.history.record(self.converter, self.video, 60.0, 30.0)
+        self.history.save()
+        other = throughput.ThroughputHistory(self.path, host='other')
+        self.assertEqual(other.get_speed(self.converter, self.video), None)
+
+    def test_save_and_load(self):
+        self.history.record(self.converter, self.video, 60.0, 30.0)
+        self.history.save()
+        loaded = throughput.ThroughputHistory(self.path, host='test')
+        self.assertEqual(loaded.get_speed(self.converter, self.video), 2.0)
+
+    def test_load_corrupt(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'wb') as f:
+            f.write('not json')
+        loaded = throughput.ThroughputHistory(self.path, host='test')
+        self.assertEqual(loaded.entries, {})
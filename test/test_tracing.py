@@ -0,0 +1,89 @@
+import json
+import os.path
+import shutil
+import tempfile
+
+from mvc import conversion
+from mvc import tracing
+
+import base
+import mock
+
+class TracerTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.tracer = tracing.Tracer()
+        self.tracer.start_time = 100.0
+
+    def test_complete(self):
+        self.tracer.complete('pass1', 101.0, 103.5, 'slot 1',
+                             args={'conversion': 'c'})
+        events = self.tracer.to_dict()['traceEvents']
+        self.assertEqual(events[0], {'ph': 'M', 'name': 'thread_name',
+                                     'pid': self.tracer.pid, 'tid': 1,
+                                     'args': {'name': 'slot 1'}})
+        self.assertEqual(events[-1], {'ph': 'X', 'name': 'pass1',
+                                      'cat': 'stage', 'ts': 1000000,
+                                      'dur': 2500000, 'pid': self.tracer.pid,
+                                      'tid': 1, 'args': {'conversion': 'c'}})
+
+    def test_tracks(self):
+        self.tracer.instant('start', 'scheduler', t=101.0)
+        self.tracer.complete('pass1', 101.0, 102.0, 'slot 1')
+        self.tracer.instant('finish', 'scheduler', t=102.0)
+        tids = [e['tid'] for e in self.tracer.to_dict()['traceEvents']
+                if e['ph'] != 'M']
+        self.assertEqual(tids, [1, 2, 1])
+
+    def test_save(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'trace.json')
+            self.tracer.counter('conversions', {'running': 1}, t=100.5)
+            self.tracer.save(path)
+            with open(path) as f:
+                data = json.load(f)
+            self.assertEqual(data['traceEvents'][0]['ph'], 'C')
+            self.assertEqual(data['traceEvents'][0]['ts'], 500000)
+        finally:
+            shutil.rmtree(temp_dir)
+
+class SchedulerTraceTest(base.Test):
+
+    def setUp(self):
+        base.Test.setUp(self)
+        self.tracer = tracing.enable()
+        self.manager = conversion.ConversionManager(simultaneous=2)
+
+    def tearDown(self):
+        tracing.disable()
+        base.Test.tearDown(self)
+
+    def make_conversion(self, name):
+        c = mock.Mock(slot=None, queued_at=None, status='initialized')
+        c.__unicode__ = lambda self: name
+        return c
+
+    def scheduler_events(self):
+        return [(e['name'], e['args']['conversion'], e['args'].get('slot'))
+                for e in self.tracer.to_dict()['traceEvents']
+                if e.get('cat') == 'scheduler']
+
+    def test_slots(self):
+        c1, c2, c3 = [self.make_conversion(name)
+                      for name in ('c1', 'c2', 'c3')]
+        for c in (c1, c2, c3):
+            self.manager.run_conversion(c)
+        self.assertEqual((c1.slot, c2.slot, c3.slot), (1, 2, None))
+        c1.status = 'finished'
+        self.manager.conversion_finished(c1)
+        # c3 takes over the slot that c1 freed up
+        self.assertEqual(c3.slot, 1)
+        self.assertEqual(self.scheduler_events(), [
+                ('start', 'c1', 1),
+                ('start', 'c2', 2),
+                ('enqueue', 'c3', None),
+                ('finish', 'c1', None),
+                ('start', 'c3', 1),
+                ])
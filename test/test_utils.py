@@ -38,6 +38,11 @@ class UtilsTest(base.Test):
                                              dont_upsize=False), # widescreen
                          (1024, 560))
 
+    def test_duration_string(self):
+        self.assertEqual(utils.duration_string(0), '0:00')
+        self.assertEqual(utils.duration_string(65.4), '1:05')
+        self.assertEqual(utils.duration_string(3723), '1:02:03')
+
     def test_line_reader(self):
         lines = """line1
 line2
@@ -46,3 +51,16 @@ line5"""
         expected = ['line1', 'line2', 'line3', 'line4', 'line5']
         self.assertEqual(list(utils.line_reader(StringIO(lines))), expected)
 
+
+    def test_progress_reader(self):
+        output = """frame=10
+fps=25.0
+out_time_ms=400000
+progress=continue
+frame=20
+progress=end
+"""
+        self.assertEqual(list(utils.progress_reader(StringIO(output))), [
+                {'frame': '10', 'fps': '25.0', 'out_time_ms': '400000',
+                 'progress': 'continue'},
+                {'frame': '20', 'progress': 'end'}])
@@ -137,6 +137,34 @@ class GetMediaInfoTest(base.Test):
 
 
 
+class ExtractStreamDetailsTest(base.Test):
+
+    def test_video(self):
+        self.assertEqual(video.extract_stream_details(
+                'video', 'h264 (Constrained Baseline) (avc1 / 0x31637661), '
+                'yuv420p(tv, bt709), 640x480 [SAR 1:1 DAR 4:3], 993 kb/s, '
+                '29.97 fps'),
+                         {'video_profile': 'Constrained Baseline',
+                          'pixel_format': 'yuv420p',
+                          'video_bitrate': 993000})
+        self.assertEqual(video.extract_stream_details(
+                'video', 'libvpx, yuv420p, 1280x720, q=0-0'),
+                         {'pixel_format': 'yuv420p'})
+
+    def test_audio(self):
+        self.assertEqual(video.extract_stream_details(
+                'audio', 'aac (LC) (mp4a / 0x6134706D), 44100 Hz, stereo, '
+                'fltp, 125 kb/s (default)'),
+                         {'audio_profile': 'LC',
+                          'audio_sample_rate': 44100,
+                          'audio_channels': 2,
+                          'audio_bitrate': 125000})
+        # mp3float is the decoder, not a profile
+        self.assertEqual(video.extract_stream_details(
+                'audio', 'mp3 (mp3float), 48000 Hz, 5.1(side), fltp'),
+                         {'audio_sample_rate': 48000,
+                          'audio_channels': 6})
+
 class GetThumbnailTest(base.Test):
 
     def setUp(self):
@@ -0,0 +1,24 @@
+import sys
+
+# Stands in for ffmpeg in the segmented conversion tests.  A segment's output
+# records the part of the input it covers; joining the segments concatenates
+# them.
+args = sys.argv[1:]
+output = args[-1]
+if output == '/dev/null':
+    # first pass
+    sys.exit(0)
+
+def get_option(name):
+    if name in args:
+        return args[args.index(name) + 1]
+    return None
+
+if get_option('-f') == 'concat':
+    with file(output, 'w') as out:
+        for line in file(get_option('-i')):
+            path = line.strip()[len("file '"):-1].replace("'\\''", "'")
+            out.write(file(path).read())
+else:
+    with file(output, 'w') as out:
+        out.write('%s %s\n' % (get_option('-ss'), get_option('-t')))